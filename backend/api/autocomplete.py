@@ -0,0 +1,93 @@
+"""Поиск ингредиентов по началу и по подстроке названия.
+
+На PostgreSQL запросы обслуживают индексы text_pattern_ops и pg_trgm
+(recipes/migrations/0003), на остальных СУБД - индекс в памяти процесса,
+который пересобирается при смене версии справочника ингредиентов
+(reference.py).
+"""
+from bisect import bisect_left
+from collections import defaultdict
+from collections.abc import Iterable
+
+from django.db import connection
+
+from recipes.models import Ingredient
+from .reference import INGREDIENTS, Version
+
+
+def get_trigrams(value: str) -> set[str]:
+    return {value[i:i + 3] for i in range(len(value) - 2)}
+
+
+class IngredientIndex:
+    """Отсортированный массив названий и триграммный индекс к нему."""
+
+    def __init__(self, items: Iterable[tuple[int, str]]):
+        items = sorted((name.lower(), pk) for pk, name in items)
+        self.names = [name for name, _ in items]
+        self.ids = [pk for _, pk in items]
+        trigrams = defaultdict(set)
+        for position, name in enumerate(self.names):
+            for trigram in get_trigrams(name):
+                trigrams[trigram].add(position)
+        self.trigrams = {
+            trigram: sorted(positions)
+            for trigram, positions in trigrams.items()
+        }
+
+    def get_candidates(self, value: str) -> Iterable[int]:
+        """Позиции названий, которые могут содержать value."""
+        trigrams = get_trigrams(value)
+        if not trigrams:
+            return range(len(self.names))
+        return min(
+            (self.trigrams.get(trigram, ()) for trigram in trigrams), key=len
+        )
+
+    def search(self, value: str, limit: int) -> list[int]:
+        """id ингредиентов: сначала совпадения по началу, затем остальные."""
+        value = value.lower()
+        start = end = bisect_left(self.names, value)
+        while (end < len(self.names) and end - start < limit
+               and self.names[end].startswith(value)):
+            end += 1
+        result = self.ids[start:end]
+
+        for position in self.get_candidates(value):
+            if len(result) >= limit:
+                break
+            name = self.names[position]
+            if value in name and not name.startswith(value):
+                result.append(self.ids[position])
+        return result
+
+
+_index: IngredientIndex | None = None
+_index_version: Version | None = None
+
+
+def get_index() -> IngredientIndex:
+    global _index, _index_version
+    snapshot = INGREDIENTS.get()
+    if _index is None or _index_version != snapshot.version:
+        _index = IngredientIndex(
+            (item['id'], item['name']) for item in snapshot.items
+        )
+        _index_version = snapshot.version
+    return _index
+
+
+def search_in_database(value: str, limit: int) -> list[int]:
+    queryset = Ingredient.objects.order_by('name').values_list('id', flat=True)
+    result = list(queryset.filter(name__istartswith=value)[:limit])
+    if len(result) < limit:
+        result += queryset.filter(name__icontains=value).exclude(
+            name__istartswith=value
+        )[:limit - len(result)]
+    return result
+
+
+def search_ingredients(value: str, limit: int) -> list[int]:
+    if connection.vendor == 'postgresql':
+        return search_in_database(value, limit)
+    return get_index().search(value, limit)
@@ -0,0 +1,223 @@
+"""Замеры производительности: python manage.py benchmark <name>."""
+import timeit
+from collections import OrderedDict
+from contextlib import contextmanager
+from types import SimpleNamespace
+from typing import Callable
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, QuerySet
+from django.test import RequestFactory
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ReturnList
+from rest_framework.settings import api_settings
+
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, Tag,)
+from .filters import RecipeFilter
+from .recipe_cache import get_full_queryset
+from .renderers import ORJSONRenderer
+from .serializers import (RecipeReadSerializer, RecipeShortSerializer,
+                          SubscriptionsSerializer, UserSerializer,)
+from .user_state import set_recipe_flags
+from .utils import get_pdf, get_pdf_cache_key
+
+User = get_user_model()
+
+BENCHMARKS: dict[str, Callable[..., dict]] = {}
+
+
+def benchmark(func: Callable[..., dict]) -> Callable[..., dict]:
+    BENCHMARKS[func.__name__] = func
+    return func
+
+
+def measure(func: Callable, number: int = 1, repeat: int = 5) -> float:
+    """Лучшее время одного вызова, мс."""
+    return min(timeit.repeat(func, number=number, repeat=repeat)) \
+        / number * 1000
+
+
+@benchmark
+def shopping_list_pdf(size: int = 100) -> dict:
+    """Генерация pdf без кеша и повторная выдача из кеша."""
+    recipes = ['Рецепт %s' % i for i in range(size)]
+    ingredients = [
+        {'name': 'Ингредиент %s' % i, 'measurement_unit': 'г', 'amount': i}
+        for i in range(size)
+    ]
+    key = get_pdf_cache_key(recipes, ingredients, 'foodgram.ru')
+
+    def cold():
+        cache.delete(key)
+        get_pdf(recipes, ingredients, host='foodgram.ru').close()
+
+    def warm():
+        get_pdf(recipes, ingredients, host='foodgram.ru').close()
+
+    result = {'cold, ms': measure(cold), 'warm, ms': measure(warm)}
+    cache.delete(key)
+    return result
+
+
+@benchmark
+def favorites_filter(size: int = 100_000, favorites: int = 20) -> dict:
+    """is_favorited=1: Exists на каждый рецепт и id IN (избранное).
+
+    Данные создаются в транзакции, которая затем откатывается.
+    """
+    def page(queryset: QuerySet) -> Callable:
+        return lambda: (queryset.count(), list(
+            queryset.values_list('id', flat=True)[:api_settings.PAGE_SIZE]
+        ))
+
+    with transaction.atomic():
+        user = User.objects.create(
+            username='benchmark', email='benchmark@foodgram.ru'
+        )
+        recipes = Recipe.objects.bulk_create(
+            (Recipe(name='Рецепт %s' % i, text='', image='', cooking_time=1,
+                    author=user) for i in range(size)),
+            batch_size=1000
+        )
+        FavoriteRecipe.objects.bulk_create(
+            FavoriteRecipe(user=user, recipe=recipe)
+            for recipe in recipes[::max(size // favorites, 1)]
+        )
+        exists = Recipe.objects.alias(is_favorited=Exists(
+            FavoriteRecipe.objects.filter(user=user, recipe=OuterRef('pk'))
+        )).filter(is_favorited=True)
+        semi_join = RecipeFilter(
+            {'is_favorited': 'true'}, queryset=Recipe.objects.all(),
+            request=SimpleNamespace(user=user)
+        ).qs
+        result = {'exists, ms': measure(page(exists)),
+                  'semi-join, ms': measure(page(semi_join))}
+        transaction.set_rollback(True)
+    return result
+
+
+@contextmanager
+def drf_fields():
+    """to_representation сериализаторов чтения - полями DRF, без
+    representations.py: для сравнения вывода и замеров."""
+    classes = (UserSerializer, RecipeReadSerializer, RecipeShortSerializer,
+               SubscriptionsSerializer)
+    saved = {cls: cls.__dict__['to_representation'] for cls in classes}
+    try:
+        for cls in classes:
+            cls.to_representation = serializers.Serializer.to_representation
+        yield
+    finally:
+        for cls, to_representation in saved.items():
+            cls.to_representation = to_representation
+
+
+@benchmark
+def read_serializers(size: int = 100) -> dict:
+    """Сериализация страницы рецептов и подписок: поля DRF и функции.
+
+    Время на один объект; данные откатываются вместе с транзакцией.
+    """
+    request = RequestFactory().get(
+        '/api/recipes/', HTTP_HOST=settings.ALLOWED_HOSTS[0]
+    )
+    request.user = AnonymousUser()
+    context = {'request': request}
+
+    with transaction.atomic():
+        authors = User.objects.bulk_create(
+            User(username='benchmark_%s' % i,
+                 email='benchmark_%s@foodgram.ru' % i, recipes_count=1)
+            for i in range(size)
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name='benchmark_%s' % i, slug='benchmark_%s' % i,
+                color='#%06d' % i) for i in range(3)
+        )
+        ingredients = Ingredient.objects.bulk_create(
+            Ingredient(name='benchmark_%s' % i, measurement_unit='г')
+            for i in range(5)
+        )
+        recipes = Recipe.objects.bulk_create(
+            Recipe(name='Рецепт %s' % i, text='text', cooking_time=1,
+                   image='recipes/images/benchmark.png', author=author)
+            for i, author in enumerate(authors)
+        )
+        IngredientInRecipe.objects.bulk_create(
+            IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+            for recipe in recipes for ingredient in ingredients
+        )
+        Recipe.tags.through.objects.bulk_create(
+            Recipe.tags.through(recipe=recipe, tag=tag)
+            for recipe in recipes for tag in tags
+        )
+        page = list(get_full_queryset().filter(
+            id__in=[recipe.id for recipe in recipes]
+        ))
+        set_recipe_flags(page, request.user)
+        subscriptions = list(User.objects.filter(
+            id__in=[author.id for author in authors]
+        ).prefetch_related(Prefetch(
+            'recipes', queryset=Recipe.objects.all(),
+            to_attr='recipes_preview'
+        )))
+        for author in subscriptions:
+            author.is_subscribed = True
+
+        cases = {
+            'recipes': lambda: RecipeReadSerializer(
+                page, many=True, context=context
+            ).data,
+            'short recipes': lambda: RecipeShortSerializer(
+                page, many=True, context=context
+            ).data,
+            # краткие рецепты подписок - из кеша представлений
+            'subscriptions': lambda: SubscriptionsSerializer(
+                subscriptions, many=True, context=context
+            ).data,
+        }
+        result = {}
+        for name, func in cases.items():
+            with drf_fields():
+                result['%s, drf fields, us per item' % name] = \
+                    measure(func) * 1000 / size
+            result['%s, functions, us per item' % name] = \
+                measure(func) * 1000 / size
+        transaction.set_rollback(True)
+    return result
+
+
+@benchmark
+def json_renderer(size: int = 100) -> dict:
+    """Кодирование страницы из size рецептов: JSONRenderer и orjson."""
+    results = [{
+        'id': i,
+        'tags': [{'id': tag, 'name': 'Тег %s' % tag, 'slug': 'tag_%s' % tag,
+                  'color': '#E26C2D'} for tag in range(3)],
+        'author': {'email': 'author@foodgram.ru', 'id': 1,
+                   'username': 'author', 'first_name': 'Автор',
+                   'last_name': 'Авторов', 'is_subscribed': False},
+        'ingredients': [{'id': item, 'name': 'Ингредиент %s' % item,
+                         'measurement_unit': 'г', 'amount': item}
+                        for item in range(8)],
+        'is_favorited': False,
+        'is_in_shopping_cart': False,
+        'image': 'https://foodgram.ru/media/recipes/images/%s.png' % i,
+        'name': 'Рецепт %s' % i,
+        'text': 'Описание рецепта. ' * 20,
+        'cooking_time': 30,
+    } for i in range(size)]
+    page = OrderedDict((
+        ('count', size), ('next', None), ('previous', None),
+        ('results', ReturnList(results, serializer=None)),
+    ))
+    renderers = {'json': JSONRenderer(), 'orjson': ORJSONRenderer()}
+    return {'%s, ms' % name: measure(lambda: renderer.render(page),
+                                     number=10)
+            for name, renderer in renderers.items()}
@@ -0,0 +1,35 @@
+"""Условные GET-запросы: ETag, Last-Modified и ответ 304."""
+import hashlib
+from collections.abc import Callable
+from http import HTTPStatus
+
+from django.http import HttpResponseBase
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.request import Request
+
+
+def get_etag(*parts) -> str:
+    """Слабый ETag: тело ответа может сжиматься в nginx."""
+    digest = hashlib.sha256('|'.join(map(str, parts)).encode('utf-8'))
+    return 'W/"%s"' % digest.hexdigest()[:32]
+
+
+def conditional_response(request: Request,
+                         build: Callable[[], HttpResponseBase], etag: str,
+                         last_modified: float | None = None
+                         ) -> HttpResponseBase:
+    """304, если клиент прислал актуальный ETag, иначе ответ build()."""
+    if last_modified is not None:
+        last_modified = int(last_modified)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        response = build()
+    if response.status_code not in (HTTPStatus.OK, HTTPStatus.NOT_MODIFIED):
+        return response
+    response['ETag'] = etag
+    if last_modified is not None:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
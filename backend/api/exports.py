@@ -0,0 +1,69 @@
+"""Очередь выгрузок списка покупок в pdf на таблице ShoppingListExport."""
+from datetime import timedelta
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.files import File
+from django.utils import timezone
+
+from recipes.models import ShoppingListExport
+from . import shopping_list, task_queue
+from .utils import get_pdf
+
+QUEUE = task_queue.TaskQueue(
+    ShoppingListExport, 'status', 'updated', ShoppingListExport.PENDING,
+    ShoppingListExport.RUNNING, 'SHOPPING_LIST_EXPORT_TIMEOUT'
+)
+
+
+def set_progress(export: ShoppingListExport, progress: int, **fields):
+    for name, value in {'progress': progress, **fields}.items():
+        setattr(export, name, value)
+    export.save(update_fields=['progress', 'updated', *fields])
+
+
+def claim_export() -> ShoppingListExport | None:
+    """Берёт задачу из очереди; зависшие задачи выдаются повторно."""
+    return QUEUE.claim(1, 'created', progress=0).first()
+
+
+def process_export(export: ShoppingListExport) -> None:
+    try:
+        # кеш общий с веб-процессом: список обычно уже собран
+        cart = shopping_list.get_shopping_list(export.user_id)
+        set_progress(export, 30)
+        with get_pdf(shopping_list.get_recipes(cart),
+                     shopping_list.get_ingredients(cart),
+                     host=export.host) as pdf:
+            set_progress(export, 70)
+            export.file.save('%s.pdf' % uuid4().hex, File(pdf), save=False)
+        set_progress(export, 100, status=ShoppingListExport.DONE,
+                     file=export.file)
+    except Exception as exc:
+        set_progress(export, export.progress,
+                     status=ShoppingListExport.FAILED, error=str(exc))
+
+
+def delete_expired_exports() -> None:
+    expired = ShoppingListExport.objects.filter(
+        created__lt=timezone.now() - timedelta(
+            seconds=settings.SHOPPING_LIST_EXPORT_TTL
+        )
+    )
+    for export in expired:
+        export.file.delete(save=False)
+    expired.delete()
+
+
+def process_next() -> bool:
+    export = claim_export()
+    if export is None:
+        return False
+    process_export(export)
+    return True
+
+
+def run_worker(poll_interval: float = 1, once: bool = False) -> None:
+    """Обрабатывает очередь; once - до опустошения очереди."""
+    task_queue.run_worker(process_next, poll_interval, once,
+                          idle=delete_expired_exports)
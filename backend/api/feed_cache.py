@@ -0,0 +1,72 @@
+"""Готовые ответы ленты рецептов для анонимных посетителей.
+
+Гостю флаги is_favorited, is_in_shopping_cart и is_subscribed всегда
+false, поэтому страница ленты одинакова для всех гостей. Ключ кеша -
+нормализованная строка запроса и версии рецептов, тегов и ингредиентов
+(reference.py), так что изменения данных сбрасывают кеш сами собой.
+"""
+import hashlib
+from collections.abc import Callable
+from http import HTTPStatus
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.request import Request
+from rest_framework.response import Response
+
+CACHE_KEY = 'recipe_feed:{}'
+STATS_CACHE_KEY = 'recipe_feed_stats:{}'
+STATS = ('hits', 'misses')
+CACHED_PARAMS = {'page', 'limit', 'tags', 'author'}
+
+
+def get_cache_key(request: Request, versions: tuple[str, ...]) -> str | None:
+    """None - запрос не кешируется: пользователь или другие параметры."""
+    params = request.query_params
+    if request.user.is_authenticated or not params.keys() <= CACHED_PARAMS:
+        return None
+    # ?tags=b&tags=a&page=1 и ?page=1&tags=a&tags=b - одна страница
+    query = urlencode(sorted(
+        (name, value)
+        for name in params for value in set(params.getlist(name))
+    ))
+    key = '|'.join((
+        request.build_absolute_uri('/'), request.accepted_renderer.format,
+        query, *versions
+    ))
+    return CACHE_KEY.format(hashlib.sha256(key.encode('utf-8')).hexdigest())
+
+
+def count(stat: str) -> None:
+    key = STATS_CACHE_KEY.format(stat)
+    cache.add(key, 0, None)
+    try:
+        cache.incr(key)
+    except ValueError:  # ключ вытеснен между add и incr
+        cache.set(key, 1, None)
+
+
+def get_stats() -> dict[str, int]:
+    stats = cache.get_many([STATS_CACHE_KEY.format(stat) for stat in STATS])
+    return {stat: stats.get(STATS_CACHE_KEY.format(stat), 0)
+            for stat in STATS}
+
+
+def reset_stats() -> None:
+    cache.delete_many([STATS_CACHE_KEY.format(stat) for stat in STATS])
+
+
+def get_response(key: str, build: Callable[[], Response]) -> Response:
+    data = cache.get(key)
+    if data is not None:
+        count('hits')
+        response = Response(data)
+        response['X-Cache'] = 'HIT'
+        return response
+    count('misses')
+    response = build()
+    if response.status_code == HTTPStatus.OK:
+        cache.set(key, response.data, settings.RECIPE_FEED_CACHE_TIMEOUT)
+    response['X-Cache'] = 'MISS'
+    return response
@@ -1,35 +1,56 @@
-from django.db.models import BooleanField, ExpressionWrapper, Q, QuerySet
+from django.db.models import QuerySet
 from django_filters import rest_framework as filters
 
-from recipes.models import Ingredient, Recipe, Tag
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart
+from recipes.search import search_recipes
+from .tags import get_tag_choices, get_tag_ids
 
 
 class RecipeFilter(filters.FilterSet):
-    tags = filters.ModelMultipleChoiceFilter(
-        field_name='tags__slug',
-        to_field_name='slug',
-        queryset=Tag.objects.all())
-    is_favorited = filters.BooleanFilter()
-    is_in_shopping_cart = filters.BooleanFilter()
+    ORDERINGS = {
+        'created': ('-created', '-id'),
+        'favorites': ('-favorites_count', '-created', '-id'),
+    }
+    # порядок по счётчикам меняется без смены версии рецептов
+    COUNTER_ORDERINGS = {'favorites'}
+    tags = filters.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='filter_tags'
+    )
+    is_favorited = filters.BooleanFilter(method='filter_user_recipes')
+    is_in_shopping_cart = filters.BooleanFilter(method='filter_user_recipes')
+    search = filters.CharFilter(method='filter_search')
+    ordering = filters.ChoiceFilter(
+        choices=[(ordering, ordering) for ordering in ORDERINGS],
+        method='filter_ordering'
+    )
+
+    def filter_search(self, queryset: QuerySet, name, value):
+        return search_recipes(queryset, value)
+
+    def filter_tags(self, queryset: QuerySet, name, value):
+        """id IN (рецепты с тегами) - без JOIN и DISTINCT по рецептам."""
+        if not value:
+            return queryset
+        tag_ids = get_tag_ids()
+        return queryset.filter(id__in=Recipe.tags.through.objects.filter(
+            tag_id__in=[tag_ids[slug] for slug in value]
+        ).values('recipe_id'))
+
+    def filter_user_recipes(self, queryset: QuerySet, name, value):
+        """id IN (рецепты пользователя) вместо подзапроса на каждый рецепт."""
+        model = FavoriteRecipe if name == 'is_favorited' else ShoppingCart
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset.none() if value else queryset
+        recipe_ids = model.objects.filter(user=user).values('recipe_id')
+        if value:
+            return queryset.filter(id__in=recipe_ids)
+        return queryset.exclude(id__in=recipe_ids)
+
+    def filter_ordering(self, queryset: QuerySet, name, value):
+        return queryset.order_by(*self.ORDERINGS[value])
 
     class Meta:
         model = Recipe
         fields = ('tags', 'author')
-
-
-class IngredientFilter(filters.FilterSet):
-    name = filters.CharFilter(field_name='name', method='filter_name')
-
-    def filter_name(self, queryset: QuerySet, name, value):
-        return queryset.filter(
-            Q(name__istartswith=value) | Q(name__icontains=value)
-        ).annotate(
-            is_start=ExpressionWrapper(
-                Q(name__istartswith=value),
-                output_field=BooleanField()
-            )
-        ).order_by('-is_start', 'name')
-
-    class Meta:
-        model = Ingredient
-        fields = ['name']
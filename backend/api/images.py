@@ -0,0 +1,103 @@
+"""Варианты картинок рецептов: уменьшенные копии в WebP.
+
+Запрос только проверяет картинку (Base64ImageField) и сохраняет
+оригинал; Recipe.save() при замене картинки ставит рецепт в очередь
+заново. Декодирование, уменьшение и кодирование делает пул потоков
+обработчика (команда recipe_image_worker); очередь - поле
+Recipe.image_status (task_queue.py). Потоки работают только
+с файлами, запросы к БД - в основном потоке.
+"""
+from concurrent.futures import Executor, ThreadPoolExecutor
+from io import BytesIO
+from pathlib import PurePosixPath
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.utils import timezone
+from PIL import Image, ImageOps
+
+from recipes.models import Recipe, delete_files
+from . import task_queue
+from .reference import RECIPES
+
+QUEUE = task_queue.TaskQueue(
+    Recipe, 'image_status', 'image_claimed', Recipe.IMAGE_PENDING,
+    Recipe.IMAGE_RUNNING, 'RECIPE_IMAGE_TIMEOUT'
+)
+
+VARIANT_PATH = 'recipes/images/variants/{}_{}.webp'
+
+
+def make_variants(name: str) -> dict[str, str]:
+    """Сохраняет варианты картинки name, от большего к меньшему."""
+    sizes = sorted(settings.RECIPE_IMAGE_VARIANTS.items(),
+                   key=lambda item: item[1], reverse=True)
+    stem = PurePosixPath(name).stem
+    variants = {}
+    with default_storage.open(name) as file, Image.open(file) as image:
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', (sizes[0][1], sizes[0][1]))
+        image = ImageOps.exif_transpose(image)
+        transparent = 'A' in image.getbands() or 'transparency' in image.info
+        image = image.convert('RGBA' if transparent else 'RGB')
+        for variant, size in sizes:
+            # thumbnail не увеличивает картинку и уменьшает её на месте
+            image.thumbnail((size, size))
+            buffer = BytesIO()
+            image.save(buffer, 'WEBP',
+                       quality=settings.RECIPE_IMAGE_WEBP_QUALITY)
+            variants[variant] = default_storage.save(
+                VARIANT_PATH.format(stem, variant),
+                ContentFile(buffer.getvalue())
+            )
+    return variants
+
+
+def claim_recipes(limit: int) -> list[Recipe]:
+    """Берёт рецепты в обработку; зависшие выдаются повторно."""
+    # новые рецепты - первыми, старые догружаются в фоне
+    return list(QUEUE.claim(limit, '-created').only(
+        'id', 'image', 'image_claimed'
+    ))
+
+
+def process_recipes(recipes: list[Recipe], executor: Executor) -> int:
+    """Варианты картинок recipes в пуле потоков; число готовых."""
+    futures = [(recipe, executor.submit(make_variants, recipe.image.name))
+               for recipe in recipes]
+    done = 0
+    for recipe, future in futures:
+        # картинку могли заменить во время обработки (Recipe.save)
+        claimed = Recipe.objects.filter(
+            pk=recipe.pk, image=recipe.image.name,
+            image_status=Recipe.IMAGE_RUNNING,
+            image_claimed=recipe.image_claimed
+        )
+        try:
+            variants = future.result()
+        except Exception:
+            claimed.update(image_status=Recipe.IMAGE_FAILED)
+            continue
+        # новый updated - новый ключ кеша представлений (recipe_cache.py)
+        if claimed.update(image_variants=variants,
+                          image_status=Recipe.IMAGE_DONE,
+                          updated=timezone.now()):
+            done += 1
+        else:
+            delete_files(default_storage, variants.values())
+    if done:
+        RECIPES.bump()
+    return done
+
+
+def run_worker(poll_interval: float = 1, once: bool = False,
+               workers: int = 1) -> None:
+    """Обрабатывает очередь; once - до опустошения очереди."""
+    with ThreadPoolExecutor(workers) as executor:
+        def step() -> bool:
+            recipes = claim_recipes(workers * 2)
+            process_recipes(recipes, executor)
+            return bool(recipes)
+
+        task_queue.run_worker(step, poll_interval, once)
@@ -0,0 +1,27 @@
+from django.core.management import BaseCommand, CommandError
+
+from api.benchmarks import BENCHMARKS
+
+
+class Command(BaseCommand):
+    help = 'Замеры производительности'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'names', nargs='*',
+            help='%s (по умолчанию все)' % ', '.join(BENCHMARKS)
+        )
+        parser.add_argument('--size', type=int,
+                            help='размер данных (по умолчанию свой у замера)')
+
+    def handle(self, *args, **options):
+        names = options['names'] or list(BENCHMARKS)
+        unknown = set(names) - BENCHMARKS.keys()
+        if unknown:
+            raise CommandError('Нет замеров: %s' % ', '.join(unknown))
+        for name in names:
+            kwargs = {'size': options['size']} if options['size'] else {}
+            result = BENCHMARKS[name](**kwargs)
+            self.stdout.write(name)
+            for key, value in result.items():
+                self.stdout.write('    %s: %.2f' % (key, value))
@@ -0,0 +1,27 @@
+from django.core.cache import DEFAULT_CACHE_ALIAS, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import BaseCommand
+
+from api import feed_cache
+
+
+class Command(BaseCommand):
+    help = 'Попадания и промахи кеша ленты рецептов для гостей'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='обнулить счётчики')
+
+    def handle(self, *args, **options):
+        if isinstance(caches[DEFAULT_CACHE_ALIAS], LocMemCache):
+            self.stderr.write('Кеш в памяти процесса: счётчики веб-процессов '
+                              'не видны, нужен общий кеш (CACHES).')
+        stats = feed_cache.get_stats()
+        total = sum(stats.values())
+        for stat, value in stats.items():
+            self.stdout.write('%s: %s' % (stat, value))
+        self.stdout.write('hit ratio: %.2f' % (
+            stats['hits'] / total if total else 0
+        ))
+        if options['reset']:
+            feed_cache.reset_stats()
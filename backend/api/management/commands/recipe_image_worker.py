@@ -0,0 +1,18 @@
+from django.conf import settings
+
+from api.images import run_worker
+from api.task_queue import WorkerCommand
+
+
+class Command(WorkerCommand):
+    help = 'Обработчик очереди картинок рецептов: варианты в WebP'
+
+    def add_arguments(self, parser):
+        super().add_arguments(parser)
+        parser.add_argument('--workers', type=int,
+                            default=settings.RECIPE_IMAGE_WORKERS,
+                            help='потоков обработки картинок')
+
+    def handle(self, *args, **options):
+        run_worker(options['poll_interval'], options['once'],
+                   options['workers'])
@@ -0,0 +1,9 @@
+from api.exports import run_worker
+from api.task_queue import WorkerCommand
+
+
+class Command(WorkerCommand):
+    help = 'Обработчик очереди выгрузок списка покупок в pdf'
+
+    def handle(self, *args, **options):
+        run_worker(options['poll_interval'], options['once'])
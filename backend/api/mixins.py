@@ -1,7 +1,46 @@
 from rest_framework import mixins, viewsets
+from rest_framework.exceptions import NotFound
+from rest_framework.permissions import AllowAny
+from rest_framework.response import Response
+
+from .conditional import conditional_response, get_etag
+from .reference import ReferenceData, Snapshot
 
 
 class CreateListRetrieveViewSet(mixins.CreateModelMixin, mixins.ListModelMixin,
                                 mixins.RetrieveModelMixin,
                                 viewsets.GenericViewSet):
     pass
+
+
+class ReferenceViewSet(viewsets.GenericViewSet):
+    """Справочник только для чтения: ответы из памяти процесса,
+    с ETag и Last-Modified по версии справочника."""
+    reference: ReferenceData
+    permission_classes = [AllowAny]
+    pagination_class = None
+
+    def filter_items(self, snapshot: Snapshot) -> list[dict]:
+        return snapshot.items
+
+    def respond(self, snapshot: Snapshot, build) -> Response:
+        etag = get_etag(
+            snapshot.version.key, self.request.get_full_path(),
+            self.request.accepted_renderer.format
+        )
+        return conditional_response(
+            self.request, lambda: Response(build()), etag,
+            snapshot.version.modified
+        )
+
+    def list(self, request, *args, **kwargs):
+        snapshot = self.reference.get()
+        return self.respond(snapshot, lambda: self.filter_items(snapshot))
+
+    def retrieve(self, request, *args, **kwargs):
+        snapshot = self.reference.get()
+        pk = kwargs[self.lookup_field]
+        item = snapshot.by_id.get(int(pk)) if pk.isdigit() else None
+        if item is None:
+            raise NotFound
+        return self.respond(snapshot, lambda: item)
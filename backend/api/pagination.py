@@ -1,7 +1,122 @@
+import hashlib
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from functools import reduce
+
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db.models import Q, QuerySet
+from rest_framework.exceptions import NotFound
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+COUNT_CACHE_KEY = 'pagination_count:{}'
 
 
 class LimitPageNumberPagination(PageNumberPagination):
+    """Постраничная пагинация, с параметром cursor - по ключу.
+
+    В режиме cursor выборка продолжается после последней записи
+    предыдущей страницы по полям view.cursor_ordering, без OFFSET
+    и без COUNT(*). Общее число записей возвращается по запросу
+    count=1 и кешируется.
+    """
     page_size_query_param = 'limit'
     max_page_size = settings.MAX_PAGE_SIZE
+    cursor_query_param = 'cursor'
+    count_query_param = 'count'
+    invalid_cursor_message = 'Неверный курсор.'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.ordering = getattr(view, 'cursor_ordering', None)
+        self.cursor_mode = bool(
+            self.ordering and self.cursor_query_param in request.query_params
+        )
+        if not self.cursor_mode:
+            return super().paginate_queryset(queryset, request, view)
+
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        self.count = None
+        if request.query_params.get(self.count_query_param):
+            self.count = self.get_cached_count(queryset)
+
+        queryset = queryset.order_by(*self.ordering)
+        cursor = request.query_params[self.cursor_query_param]
+        if cursor:
+            queryset = queryset.filter(self.get_seek_filter(cursor))
+        page = list(queryset[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        self.page = page[:self.page_size]
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.cursor_mode:
+            return super().get_paginated_response(data)
+        response = {'next': self.get_next_link(), 'results': data}
+        if self.count is not None:
+            response = {'count': self.count, **response}
+        return Response(response)
+
+    def get_next_link(self):
+        if not self.cursor_mode:
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        last = self.page[-1]
+        values = [getattr(last, field.lstrip('-')) for field in self.ordering]
+        return replace_query_param(
+            self.request.build_absolute_uri(), self.cursor_query_param,
+            self.encode_cursor(values)
+        )
+
+    @staticmethod
+    def encode_cursor(values: list) -> str:
+        return urlsafe_b64encode(
+            # str() сохраняет микросекунды, в отличие от DjangoJSONEncoder
+            json.dumps(values, default=str).encode('utf-8')
+        ).decode('ascii')
+
+    def decode_cursor(self, cursor: str) -> list:
+        try:
+            values = json.loads(urlsafe_b64decode(cursor.encode('ascii')))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except Exception:
+            raise NotFound(self.invalid_cursor_message)
+
+    def get_seek_filter(self, cursor: str) -> Q:
+        """(a, b) < (x, y) как a < x OR (a = x AND b < y)."""
+        values = self.decode_cursor(cursor)
+        conditions = []
+        for i, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            equal = {
+                previous.lstrip('-'): value
+                for previous, value in zip(self.ordering[:i], values)
+            }
+            conditions.append(Q(**equal, **{f'{name}__{lookup}': values[i]}))
+        return reduce(Q.__or__, conditions)
+
+    @staticmethod
+    def get_cached_count(queryset: QuerySet) -> int:
+        try:
+            sql = str(queryset.query)
+        except EmptyResultSet:
+            return 0
+        key = COUNT_CACHE_KEY.format(
+            hashlib.sha256(sql.encode('utf-8')).hexdigest()
+        )
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT)
+        return count
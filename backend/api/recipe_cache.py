@@ -0,0 +1,89 @@
+"""Представления рецептов без флагов пользователя в общем кеше.
+
+Ключ - id рецепта, его updated и версии тегов и ингредиентов
+(reference.py): правка рецепта, его ингредиентов и тегов меняет
+updated, правка автора - тоже (recipes/signals.py). Флаги
+is_favorited, is_in_shopping_cart и is_subscribed подставляются
+в закешированные словари для каждого запроса.
+"""
+import hashlib
+from collections.abc import Callable, Iterable
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, QuerySet
+from rest_framework.request import Request
+
+from recipes.models import IngredientInRecipe, Recipe
+from .reference import INGREDIENTS, TAGS
+from .user_state import UserState, get_user_state
+
+CACHE_KEY = 'recipe_repr:{}:{}:{}'
+# поля, нужные для ключа кеша, пагинации и сортировок ленты
+KEY_FIELDS = ('id', 'author', 'updated', 'created', 'favorites_count')
+SHORT_FIELDS = ('id', 'name', 'image', 'cooking_time')
+
+
+def get_full_queryset() -> QuerySet:
+    return Recipe.objects.select_related('author').prefetch_related(
+        Prefetch(
+            'ingredientinrecipe_set',
+            queryset=IngredientInRecipe.objects.select_related('ingredient')
+        ),
+        'tags'
+    )
+
+
+def get_cache_prefix(request: Request | None) -> str:
+    base = request.build_absolute_uri('/') if request is not None else ''
+    key = '|'.join((base, TAGS.get_version().key,
+                    INGREDIENTS.get_version().key))
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def get_cache_key(prefix: str, recipe: Recipe) -> str:
+    return CACHE_KEY.format(prefix, recipe.id, recipe.updated.timestamp())
+
+
+def get_cached(recipes: list[Recipe], request: Request | None,
+               build: Callable[[list[int]], dict[int, dict]]) -> list[dict]:
+    """Представления recipes; промахи собирает build одним вызовом."""
+    prefix = get_cache_prefix(request)
+    keys = {recipe.id: get_cache_key(prefix, recipe) for recipe in recipes}
+    cached = cache.get_many(keys.values())
+    missing = [pk for pk, key in keys.items() if key not in cached]
+    if missing:
+        built = build(missing)
+        cache.set_many(
+            {keys[pk]: data for pk, data in built.items()},
+            settings.RECIPE_REPR_CACHE_TIMEOUT
+        )
+        cached.update((keys[pk], data) for pk, data in built.items())
+    return [cached[keys[recipe.id]] for recipe in recipes]
+
+
+def get_state(request: Request | None) -> UserState:
+    user = getattr(request, 'user', None)
+    if user is None or not user.is_authenticated:
+        return UserState(set(), set(), set())
+    return get_user_state(user.id)
+
+
+def splice_flags(representations: Iterable[dict], state: UserState) -> None:
+    for data in representations:
+        data['is_favorited'] = data['id'] in state.favorites
+        data['is_in_shopping_cart'] = data['id'] in state.shopping_cart
+        data['author']['is_subscribed'] = (
+            data['author']['id'] in state.subscriptions
+        )
+
+
+def use_list_image(representation: dict) -> None:
+    # как representations.get_list_image_url
+    representation['image'] = representation['image_variants'].get(
+        settings.RECIPE_IMAGE_LIST_VARIANT, representation['image']
+    )
+
+
+def to_short(representation: dict) -> dict:
+    return {field: representation[field] for field in SHORT_FIELDS}
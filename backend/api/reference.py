@@ -0,0 +1,114 @@
+"""Справочники - теги и ингредиенты - в памяти процесса и в общем кеше.
+
+Версия справочника хранится в общем кеше без срока, в отдельном кеше
+versions без вытеснения (settings.CACHES), и меняется только при
+изменении таблицы (signals.py): пропавшая версия сбросила бы кеш
+представлений и все ETag. Процесс держит свою копию, пока версия та же;
+при смене версии данные берутся из общего кеша и только при промахе -
+из БД. Версия задаёт и ETag/Last-Modified ответов API.
+"""
+import time
+from collections.abc import Callable
+from typing import NamedTuple
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import BaseCache, cache, caches
+
+from recipes.models import Ingredient, Tag
+
+VERSION_CACHE_KEY = 'version:{}'
+VERSIONS_CACHE = 'versions'
+DATA_CACHE_KEY = 'reference:{}:{}'
+
+
+class Version(NamedTuple):
+    key: str
+    modified: float
+
+
+class Snapshot(NamedTuple):
+    version: Version
+    items: list[dict]
+    by_id: dict[int, dict]
+
+
+class CacheVersion:
+    """Версия данных в общем кеше; новая версия - при каждом bump().
+
+    По умолчанию - в кеше versions без срока: пропавшая версия
+    сменилась бы сама собой. Версии данных пользователя - в кеше
+    default со сроком данных: потеря версии только сбрасывает данные.
+    """
+
+    def __init__(self, name: str, cache_alias: str = VERSIONS_CACHE,
+                 timeout: int | None = None):
+        self.key = VERSION_CACHE_KEY.format(name)
+        self.cache_alias = cache_alias
+        self.timeout = timeout
+
+    @property
+    def cache(self) -> BaseCache:
+        return caches[self.cache_alias]
+
+    def get(self) -> Version:
+        version = self.cache.get(self.key)
+        if version is None:
+            version = self.bump()
+        return version
+
+    def bump(self) -> Version:
+        version = Version(uuid4().hex, time.time())
+        self.cache.set(self.key, version, self.timeout)
+        return version
+
+    @staticmethod
+    def bump_many(versions: list['CacheVersion']) -> None:
+        """Одним запросом; кеш и срок - как у первой версии."""
+        if versions:
+            versions[0].cache.set_many(
+                {version.key: Version(uuid4().hex, time.time())
+                 for version in versions},
+                versions[0].timeout
+            )
+
+
+class ReferenceData:
+    def __init__(self, name: str, load: Callable[[], list[dict]]):
+        self.name = name
+        self.load = load
+        self.version = CacheVersion(name)
+        self._snapshot: Snapshot | None = None
+
+    def get_version(self) -> Version:
+        return self.version.get()
+
+    def get(self) -> Snapshot:
+        version = self.get_version()
+        snapshot = self._snapshot
+        if snapshot is None or snapshot.version != version:
+            key = DATA_CACHE_KEY.format(self.name, version.key)
+            items = cache.get(key)
+            if items is None:
+                items = self.load()
+                cache.set(key, items, settings.REFERENCE_CACHE_TIMEOUT)
+            snapshot = self._snapshot = Snapshot(
+                version, items, {item['id']: item for item in items}
+            )
+        return snapshot
+
+    def invalidate(self) -> Version:
+        return self.version.bump()
+
+
+def load_values(queryset) -> Callable[[], list[dict]]:
+    # совпадает с fields = '__all__' в TagSerializer и IngredientSerializer
+    return lambda: list(queryset.values())
+
+
+# лента рецептов: только версия для ETag, без данных
+RECIPES = CacheVersion('recipes')
+TAGS = ReferenceData('tags', load_values(Tag.objects.all()))
+INGREDIENTS = ReferenceData(
+    'ingredients', load_values(Ingredient.objects.all())
+)
@@ -0,0 +1,51 @@
+"""JSON-ответы через orjson, если он установлен.
+
+Вывод совпадает с rest_framework.renderers.JSONRenderer при настройках
+по умолчанию (компактно, UTF-8 без экранирования): типы, которых orjson
+не знает или кодирует иначе - даты и время, Decimal, ленивые строки, -
+передаются encoder_class DRF. Без orjson и для ответов с отступом
+(Accept: application/json; indent=4) работает JSONRenderer.
+"""
+from rest_framework.renderers import JSONRenderer
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+# как в JSONRenderer: разделители строк недопустимы в JavaScript
+LINE_SEPARATORS = (('\u2028'.encode(), b'\\u2028'),
+                   ('\u2029'.encode(), b'\\u2029'))
+
+
+class ORJSONRenderer(JSONRenderer):
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if orjson is None or self.get_indent(
+            accepted_media_type, renderer_context or {}
+        ):
+            return super().render(data, accepted_media_type,
+                                  renderer_context)
+        if data is None:
+            return b''
+        ret = orjson.dumps(
+            data, default=self.encoder_class().default,
+            option=orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        )
+        for separator, escaped in LINE_SEPARATORS:
+            ret = ret.replace(separator, escaped)
+        return ret
+
+
+class NDJSONRenderer(ORJSONRenderer):
+    """Одна строка JSON на объект: выгрузка рецептов (export)."""
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        return super().render(data, None, renderer_context) + b'\n'
+
+    def render_lines(self, items) -> bytes:
+        return b''.join(self.render(item) for item in items)
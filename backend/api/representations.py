@@ -0,0 +1,94 @@
+"""Представления для чтения без полей DRF.
+
+Функции повторяют вывод UserSerializer, RecipeReadSerializer,
+RecipeShortSerializer и SubscriptionsSerializer ключ в ключ, но не
+создают поле на каждое значение: сериализаторы остаются для записи,
+а их to_representation вызывает эти функции.
+"""
+from django.conf import settings
+from django.db.models.fields.files import FieldFile
+from rest_framework.request import Request
+
+from recipes.models import IngredientInRecipe, Recipe, Tag
+
+USER_FIELDS = ('email', 'id', 'username', 'first_name', 'last_name')
+RECIPE_FIELDS = ('name', 'text', 'cooking_time')
+
+
+def get_absolute_url(url: str, request: Request | None) -> str:
+    if request is not None:
+        return request.build_absolute_uri(url)
+    return url
+
+
+def get_image_url(image: FieldFile, request: Request | None) -> str | None:
+    # как ImageField.to_representation с use_url
+    if not image:
+        return None
+    return get_absolute_url(image.url, request)
+
+
+def get_variant_urls(recipe: Recipe, request: Request | None) -> dict:
+    # варианты появляются после обработки (api/images.py)
+    storage = recipe.image.storage
+    return {name: get_absolute_url(storage.url(path), request)
+            for name, path in recipe.image_variants.items()}
+
+
+def get_list_image_url(recipe: Recipe,
+                       request: Request | None) -> str | None:
+    """Картинка для карточек: малый вариант, пока его нет - оригинал."""
+    path = recipe.image_variants.get(settings.RECIPE_IMAGE_LIST_VARIANT)
+    if path is None:
+        return get_image_url(recipe.image, request)
+    return get_absolute_url(recipe.image.storage.url(path), request)
+
+
+def user_to_dict(user) -> dict:
+    data = {field: getattr(user, field) for field in USER_FIELDS}
+    # без аннотации поле пропускается, как read_only поле DRF
+    if hasattr(user, 'is_subscribed'):
+        data['is_subscribed'] = bool(user.is_subscribed)
+    return data
+
+
+def tag_to_dict(tag: Tag) -> dict:
+    return {'id': tag.id, 'name': tag.name, 'slug': tag.slug,
+            'color': tag.color}
+
+
+def ingredient_in_recipe_to_dict(item: IngredientInRecipe) -> dict:
+    return {'id': item.ingredient_id, 'name': item.ingredient.name,
+            'measurement_unit': item.ingredient.measurement_unit,
+            'amount': item.amount}
+
+
+def recipe_to_dict(recipe: Recipe, request: Request | None) -> dict:
+    data = {
+        'id': recipe.id,
+        'tags': [tag_to_dict(tag) for tag in recipe.tags.all()],
+        'author': user_to_dict(recipe.author),
+        'ingredients': [
+            ingredient_in_recipe_to_dict(item)
+            for item in recipe.ingredientinrecipe_set.all()
+        ],
+        'is_favorited': bool(recipe.is_favorited),
+        'is_in_shopping_cart': bool(recipe.is_in_shopping_cart),
+        'image': get_image_url(recipe.image, request),
+        'image_variants': get_variant_urls(recipe, request),
+    }
+    data.update((field, getattr(recipe, field)) for field in RECIPE_FIELDS)
+    return data
+
+
+def recipe_to_short_dict(recipe: Recipe, request: Request | None) -> dict:
+    return {'id': recipe.id, 'name': recipe.name,
+            'image': get_list_image_url(recipe, request),
+            'cooking_time': recipe.cooking_time}
+
+
+def subscription_to_dict(author, recipes: list[dict]) -> dict:
+    data = user_to_dict(author)
+    data['recipes'] = recipes
+    data['recipes_count'] = author.recipes_count
+    return data
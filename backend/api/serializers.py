@@ -1,15 +1,23 @@
-from collections import OrderedDict
+from collections import Counter, OrderedDict
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.auth.models import AnonymousUser
 from django.db import transaction
 from djoser.serializers import UserCreateSerializer
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 
+from recipes.counters import RECIPES_COUNTER, change_counter
 from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
-                            Recipe, ShoppingCart, Subscriptions, Tag,)
+                            Recipe, ShoppingCart, ShoppingListExport,
+                            Subscriptions, Tag,)
+from recipes.signals import schedule_search_update
+from . import recipe_cache, representations
+from .reference import INGREDIENTS, RECIPES, TAGS, ReferenceData
+from .user_state import set_recipe_flags
 from .utils import (DynamicUniqueTogetherValidator, create_list_obj,
-                    empty_validator,)
+                    empty_validator, set_prefetched_objects,)
 
 User = get_user_model()
 
@@ -22,6 +30,9 @@ class UserSerializer(UserCreateSerializer):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'password', 'is_subscribed')
 
+    def to_representation(self, instance: User):
+        return representations.user_to_dict(instance)
+
 
 class TagSerializer(serializers.ModelSerializer):
     """Теги"""
@@ -55,6 +66,27 @@ class IngredientInRecipeSerializer(serializers.ModelSerializer):
         exclude = ('recipe', 'ingredient')
 
 
+class ImageVariantsField(serializers.Field):
+    """URL вариантов картинки рецепта по названиям"""
+
+    def __init__(self, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+
+    def to_representation(self, value: Recipe):
+        return representations.get_variant_urls(
+            value, self.context.get('request')
+        )
+
+
+class ListImageField(ImageVariantsField):
+    """Картинка для карточек: малый вариант или оригинал"""
+
+    def to_representation(self, value: Recipe):
+        return representations.get_list_image_url(
+            value, self.context.get('request')
+        )
+
+
 class RecipeReadSerializer(serializers.ModelSerializer):
     """Рецепты (чтение)"""
     tags = TagSerializer(many=True)
@@ -66,10 +98,17 @@ class RecipeReadSerializer(serializers.ModelSerializer):
     is_favorited = serializers.BooleanField(read_only=True)
     is_in_shopping_cart = serializers.BooleanField(read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
 
     class Meta:
         model = Recipe
-        exclude = ('created',)
+        exclude = ('created', 'updated', 'search_document', 'favorites_count',
+                   'shopping_cart_count', 'image_status', 'image_claimed')
+
+    def to_representation(self, instance: Recipe):
+        return representations.recipe_to_dict(
+            instance, self.context.get('request')
+        )
 
 
 class RecipeWriteSerializer(RecipeReadSerializer):
@@ -81,6 +120,12 @@ class RecipeWriteSerializer(RecipeReadSerializer):
         validators=[empty_validator]
     )
 
+    def validate_tags(self, value):
+        # без повторов и по id, как при чтении из БД: список попадает
+        # в кеш prefetch и в ответ без повторной выборки
+        return sorted({tag.pk: tag for tag in value}.values(),
+                      key=lambda tag: tag.pk)
+
     def validate_ingredients(self, value):
         empty_validator(value)
         if len(value) != len(set([i['ingredient'].id for i in value])):
@@ -94,46 +139,205 @@ class RecipeWriteSerializer(RecipeReadSerializer):
         with transaction.atomic():
             recipe = Recipe.objects.create(**validated_data)
             recipe.tags.set(tags)
-            IngredientInRecipe.objects.bulk_create(
+            ingredients = IngredientInRecipe.objects.bulk_create(
                 create_list_obj(IngredientInRecipe, ingredients, recipe=recipe)
             )
+        # новый рецепт не может быть в избранном/корзине,
+        # а на себя подписаться нельзя
+        recipe.is_favorited = recipe.is_in_shopping_cart = False
+        recipe.author.is_subscribed = False
+        set_prefetched_objects(recipe, 'tags', tags)
+        set_prefetched_objects(recipe, 'ingredientinrecipe_set', ingredients)
         return recipe
 
     def update(self, instance: Recipe, validated_data: OrderedDict):
-        if 'ingredientinrecipe_set' in validated_data:
-            ingredients = validated_data.pop('ingredientinrecipe_set')
-
-            with transaction.atomic():
-                instance.ingredientinrecipe_set.all().delete()
-                IngredientInRecipe.objects.bulk_create(
-                    create_list_obj(IngredientInRecipe, ingredients,
-                                    recipe=instance)
-                )
+        ingredients = validated_data.pop('ingredientinrecipe_set', None)
+        tags = validated_data.pop('tags', None)
 
-        if 'tags' in validated_data:
-            tags = validated_data.pop('tags')
-            instance.tags.set(tags)
-
-        super().update(instance, validated_data)
+        with transaction.atomic():
+            if ingredients is not None:
+                self.update_ingredients(instance, ingredients)
+            if tags is not None:
+                instance.tags.set(tags)
+                set_prefetched_objects(instance, 'tags', tags)
+            super().update(instance, validated_data)
         return instance
 
+    @staticmethod
+    def update_ingredients(instance: Recipe, ingredients: list[OrderedDict]):
+        """Изменяет только отличающиеся строки IngredientInRecipe."""
+        existing = {
+            item.ingredient_id: item
+            for item in instance.ingredientinrecipe_set.all()
+        }
+        to_create, to_update, result = [], [], []
+        for data in ingredients:
+            item = existing.pop(data['ingredient'].id, None)
+            if item is None:
+                item = IngredientInRecipe(recipe=instance, **data)
+                to_create.append(item)
+            elif item.amount != data['amount']:
+                item.amount = data['amount']
+                to_update.append(item)
+            item.ingredient = data['ingredient']
+            result.append(item)
+
+        if existing:
+            IngredientInRecipe.objects.filter(
+                pk__in=[item.pk for item in existing.values()]
+            ).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+        set_prefetched_objects(
+            instance, 'ingredientinrecipe_set',
+            sorted(result, key=lambda item: item.pk)
+        )
+
     def to_representation(self, instance: Recipe):
-        try:
-            annotated_instance = self.context['view'].get_queryset().filter(
-                pk=instance.pk).first()
-        except Exception as e:
-            raise ValueError(e)
+        # аннотации и связанные объекты уже загружены в create/update
         return RecipeReadSerializer(
-            annotated_instance, context={'request': self.context['request']}
+            instance, context={'request': self.context['request']}
         ).data
 
 
+class ReferenceField(serializers.PrimaryKeyRelatedField):
+    """id из справочника в памяти (reference.py), без запроса к БД."""
+
+    def __init__(self, reference: ReferenceData, **kwargs):
+        self.reference = reference
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool) or not isinstance(data, (int, str)):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except ValueError:
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        if pk not in self.reference.get().by_id:
+            self.fail('does_not_exist', pk_value=data)
+        return self.get_queryset().model(pk=pk)
+
+
+class IngredientInRecipeImportSerializer(IngredientInRecipeSerializer):
+    id = ReferenceField(INGREDIENTS, queryset=Ingredient.objects.all(),
+                        source='ingredient')
+
+
+class RecipeImportListSerializer(serializers.ListSerializer):
+    """Рецепты одного запроса - bulk_create пачками в одной транзакции."""
+
+    def create(self, validated_data: list[dict]) -> list[Recipe]:
+        batch_size = settings.RECIPE_IMPORT_BATCH_SIZE
+        with transaction.atomic():
+            recipes = Recipe.objects.bulk_create([
+                Recipe(**{field: value for field, value in item.items()
+                          if field not in ('tags', 'ingredientinrecipe_set')})
+                for item in validated_data
+            ], batch_size=batch_size)
+            IngredientInRecipe.objects.bulk_create([
+                IngredientInRecipe(recipe=recipe, **ingredient)
+                for recipe, item in zip(recipes, validated_data)
+                for ingredient in item['ingredientinrecipe_set']
+            ], batch_size=batch_size)
+            Recipe.tags.through.objects.bulk_create([
+                Recipe.tags.through(recipe=recipe, tag_id=tag.pk)
+                for recipe, item in zip(recipes, validated_data)
+                for tag in item['tags']
+            ], batch_size=batch_size)
+            # bulk_create не вызывает сигналы (recipes/signals.py)
+            for author_id, count in Counter(
+                recipe.author_id for recipe in recipes
+            ).items():
+                change_counter(RECIPES_COUNTER, author_id, count)
+            schedule_search_update([recipe.id for recipe in recipes])
+            transaction.on_commit(RECIPES.bump)
+        return recipes
+
+
+class RecipeImportSerializer(RecipeWriteSerializer):
+    """Рецепты (массовая загрузка): правила RecipeWriteSerializer,
+    теги и ингредиенты проверяются по справочникам в памяти"""
+    tags = serializers.ManyRelatedField(
+        child_relation=ReferenceField(TAGS, queryset=Tag.objects.all()),
+        validators=[empty_validator]
+    )
+    ingredients = IngredientInRecipeImportSerializer(
+        many=True,
+        source='ingredientinrecipe_set',
+    )
+
+    class Meta(RecipeWriteSerializer.Meta):
+        list_serializer_class = RecipeImportListSerializer
+
+
 class RecipeShortSerializer(RecipeReadSerializer):
+    image = ListImageField()
 
     class Meta:
         model = Recipe
         fields = ('id', 'name', 'image', 'cooking_time')
 
+    def to_representation(self, instance: Recipe):
+        return representations.recipe_to_short_dict(
+            instance, self.context.get('request')
+        )
+
+
+class RecipeCachedListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        return self.child.get_representations(list(data))
+
+
+class RecipeCachedSerializer(serializers.BaseSerializer):
+    """Рецепты (чтение) из кеша представлений, с флагами пользователя"""
+    short = False
+    # image - малый вариант картинки, как в карточках
+    list_image = False
+
+    class Meta:
+        list_serializer_class = RecipeCachedListSerializer
+
+    def get_representations(self, recipes: list[Recipe]) -> list[dict]:
+        request = self.context.get('request')
+        representations = recipe_cache.get_cached(
+            recipes, request, self.build
+        )
+        if self.list_image:
+            for data in representations:
+                recipe_cache.use_list_image(data)
+        if self.short:
+            return [recipe_cache.to_short(data) for data in representations]
+        recipe_cache.splice_flags(
+            representations, recipe_cache.get_state(request)
+        )
+        return representations
+
+    def build(self, ids: list[int]) -> dict[int, dict]:
+        recipes = list(recipe_cache.get_full_queryset().filter(id__in=ids))
+        set_recipe_flags(recipes, AnonymousUser())
+        data = RecipeReadSerializer(
+            recipes, many=True, context=self.context
+        ).data
+        return {recipe.id: item for recipe, item in zip(recipes, data)}
+
+    def to_representation(self, instance: Recipe):
+        return self.get_representations([instance])[0]
+
+
+class RecipeListCachedSerializer(RecipeCachedSerializer):
+    """Рецепты (лента) из кеша представлений"""
+    list_image = True
+
+
+class RecipeShortCachedSerializer(RecipeCachedSerializer):
+    """Рецепты (кратко) из кеша представлений"""
+    short = True
+    list_image = True
+
 
 class ShoppingCartSerializer(serializers.ModelSerializer):
 
@@ -143,7 +347,8 @@ class ShoppingCartSerializer(serializers.ModelSerializer):
         validators = [DynamicUniqueTogetherValidator(model)]
 
     def to_representation(self, instance: ShoppingCart):
-        return RecipeShortSerializer(instance.recipe).data
+        # без request в контексте: картинка - относительной ссылкой
+        return RecipeShortCachedSerializer(instance.recipe).data
 
 
 class FavoriteSerializer(ShoppingCartSerializer):
@@ -153,24 +358,32 @@ class FavoriteSerializer(ShoppingCartSerializer):
         validators = [DynamicUniqueTogetherValidator(model)]
 
 
+class SubscriptionsListSerializer(serializers.ListSerializer):
+
+    def to_representation(self, data):
+        authors = list(data)
+        # промахи кеша представлений - одним запросом на всю страницу
+        RecipeShortCachedSerializer(context=self.context).get_representations(
+            [recipe for author in authors for recipe in author.recipes_preview]
+        )
+        return super().to_representation(authors)
+
+
 class SubscriptionsSerializer(UserSerializer):
     """Подписки"""
-    recipes = RecipeShortSerializer(many=True)
+    recipes = RecipeShortCachedSerializer(many=True, source='recipes_preview')
     recipes_count = serializers.IntegerField()
 
     class Meta(UserSerializer.Meta):
         fields = ('email', 'id', 'username', 'first_name', 'last_name',
                   'password', 'is_subscribed', 'recipes', 'recipes_count')
+        list_serializer_class = SubscriptionsListSerializer
 
-    def to_representation(self, instance):
-        ret = super().to_representation(instance)
-        try:
-            limit = self.context['request'].query_params.get('recipes_limit')
-            if limit:
-                ret['recipes'] = ret['recipes'][:int(limit)]
-        except Exception as e:
-            raise ValueError(e)
-        return ret
+    def to_representation(self, instance: User):
+        return representations.subscription_to_dict(
+            instance,
+            self.fields['recipes'].to_representation(instance.recipes_preview)
+        )
 
 
 class SubscribeSerialization(serializers.ModelSerializer):
@@ -200,3 +413,12 @@ class SubscribeSerialization(serializers.ModelSerializer):
         return SubscriptionsSerializer(
             annotated_author, context={'request': self.context['request']}
         ).data
+
+
+class ShoppingListExportSerializer(serializers.ModelSerializer):
+    """Выгрузка списка покупок"""
+
+    class Meta:
+        model = ShoppingListExport
+        fields = ('id', 'status', 'progress', 'file', 'error', 'created')
+        read_only_fields = fields
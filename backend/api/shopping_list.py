@@ -0,0 +1,118 @@
+"""Список покупок пользователя в кеше.
+
+Структура значения в кеше:
+    {
+        'recipes': {recipe_id: {'name': str,
+                                'ingredients': {ingredient_id: amount}}},
+        'ingredients': {ingredient_id: {'name': str,
+                                        'measurement_unit': str,
+                                        'amount': int}}
+    }
+Изменение корзины, её рецептов или ингредиентов меняет версию
+пользователя в ключе значения, и список собирается заново одним
+запросом при следующем чтении; список, собранный до изменения
+и записанный после, уже не читается. Значение не правится на месте:
+чтение-изменение-запись теряет параллельные изменения, а пересборка
+между коммитом и on_commit учла бы рецепт дважды.
+"""
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+
+from recipes.models import IngredientInRecipe, ShoppingCart
+from .reference import CacheVersion
+
+VERSION_NAME = 'shopping_list:{}'
+CACHE_KEY = 'shopping_list:{}:{}'
+
+
+def get_version(user_id: int) -> CacheVersion:
+    return CacheVersion(VERSION_NAME.format(user_id), DEFAULT_CACHE_ALIAS,
+                        settings.SHOPPING_LIST_CACHE_TIMEOUT)
+
+
+def get_cache_key(user_id: int) -> str:
+    return CACHE_KEY.format(user_id, get_version(user_id).get().key)
+
+
+def empty_shopping_list() -> dict:
+    return {'recipes': {}, 'ingredients': {}}
+
+
+def load_recipes(recipe_ids: Iterable[int]) -> tuple[dict, dict]:
+    """Ингредиенты рецептов одним запросом."""
+    recipes, ingredients = {}, {}
+    rows = IngredientInRecipe.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list(
+        'recipe_id', 'recipe__name', 'ingredient_id', 'ingredient__name',
+        'ingredient__measurement_unit', 'amount'
+    )
+    for recipe_id, recipe_name, ingredient_id, name, unit, amount in rows:
+        recipe = recipes.setdefault(
+            recipe_id, {'name': recipe_name, 'ingredients': {}}
+        )
+        recipe['ingredients'][ingredient_id] = amount
+        ingredients[ingredient_id] = {'name': name, 'measurement_unit': unit}
+    return recipes, ingredients
+
+
+def add_recipes(shopping_list: dict, recipes: dict, ingredients: dict):
+    for recipe_id, recipe in recipes.items():
+        shopping_list['recipes'][recipe_id] = recipe
+        for ingredient_id, amount in recipe['ingredients'].items():
+            item = shopping_list['ingredients'].setdefault(
+                ingredient_id, {'amount': 0}
+            )
+            item.update(ingredients[ingredient_id])
+            item['amount'] += amount
+
+
+def build_shopping_list(user_id: int) -> dict:
+    shopping_list = empty_shopping_list()
+    add_recipes(shopping_list, *load_recipes(
+        ShoppingCart.objects.filter(user_id=user_id).values('recipe_id')
+    ))
+    return shopping_list
+
+
+def get_shopping_list(user_id: int) -> dict:
+    """Список покупок из кеша, при промахе собирается из БД."""
+    # версия читается до сборки из БД
+    key = get_cache_key(user_id)
+    shopping_list = cache.get(key)
+    if shopping_list is None:
+        shopping_list = build_shopping_list(user_id)
+        cache.set(key, shopping_list, settings.SHOPPING_LIST_CACHE_TIMEOUT)
+    return shopping_list
+
+
+def get_recipes(shopping_list: dict) -> list[str]:
+    return sorted(
+        recipe['name'] for recipe in shopping_list['recipes'].values()
+    )
+
+
+def get_ingredients(shopping_list: dict) -> list[dict]:
+    return sorted(
+        shopping_list['ingredients'].values(),
+        key=lambda item: (item['name'], item['measurement_unit'])
+    )
+
+
+def invalidate(user_ids: Iterable[int]) -> None:
+    CacheVersion.bump_many([get_version(user_id) for user_id in user_ids])
+
+
+def recipes_changed(recipe_ids: Iterable[int]) -> None:
+    """Сбрасывает списки пользователей, у которых рецепты в корзине."""
+    invalidate(ShoppingCart.objects.filter(
+        recipe_id__in=recipe_ids
+    ).values_list('user_id', flat=True).distinct())
+
+
+def ingredients_changed(ingredient_ids: Iterable[int]) -> None:
+    recipes_changed(IngredientInRecipe.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).values_list('recipe_id', flat=True).distinct())
@@ -0,0 +1,104 @@
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, Subscriptions, Tag,)
+from . import shopping_list, user_state
+from .reference import INGREDIENTS, RECIPES, TAGS
+
+User = get_user_model()
+
+
+@receiver(post_save, sender=ShoppingCart)
+def shopping_cart_saved(sender, instance: ShoppingCart, created, **kwargs):
+    if created:
+        transaction.on_commit(
+            partial(shopping_list.invalidate, [instance.user_id])
+        )
+
+
+@receiver(post_delete, sender=ShoppingCart)
+def shopping_cart_deleted(sender, instance: ShoppingCart, **kwargs):
+    transaction.on_commit(
+        partial(shopping_list.invalidate, [instance.user_id])
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance: Recipe, created, **kwargs):
+    # RecipeWriteSerializer.update меняет ингредиенты через bulk-операции
+    # и всегда сохраняет рецепт, поэтому вклад рецепта пересчитывается здесь
+    if not created:
+        transaction.on_commit(
+            partial(shopping_list.recipes_changed, [instance.id])
+        )
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def ingredient_in_recipe_changed(sender, instance: IngredientInRecipe,
+                                 **kwargs):
+    # при удалении рецепта корзина очищается сигналом ShoppingCart
+    if not isinstance(kwargs.get('origin'), Recipe):
+        transaction.on_commit(
+            partial(shopping_list.recipes_changed, [instance.recipe_id])
+        )
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance: Ingredient, created, **kwargs):
+    if not created:
+        transaction.on_commit(
+            partial(shopping_list.ingredients_changed, [instance.id])
+        )
+
+
+@receiver([post_save, post_delete], sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    transaction.on_commit(INGREDIENTS.invalidate)
+
+
+@receiver([post_save, post_delete], sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(TAGS.invalidate)
+
+
+def change_user_state(instance) -> None:
+    transaction.on_commit(
+        partial(user_state.invalidate_user_state, instance.user_id)
+    )
+
+
+@receiver(post_save, sender=FavoriteRecipe)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_save, sender=Subscriptions)
+def user_state_saved(sender, instance, created, **kwargs):
+    if created:
+        change_user_state(instance)
+
+
+@receiver(post_delete, sender=FavoriteRecipe)
+@receiver(post_delete, sender=ShoppingCart)
+@receiver(post_delete, sender=Subscriptions)
+def user_state_deleted(sender, instance, **kwargs):
+    change_user_state(instance)
+
+
+# теги меняются вместе с сохранением рецепта (API, админка), а обработчик
+# m2m_changed стоил бы лишнего запроса в каждом tags.set()
+@receiver([post_save, post_delete], sender=Recipe)
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def recipe_feed_changed(sender, **kwargs):
+    transaction.on_commit(RECIPES.bump)
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields=None, **kwargs):
+    # у нового пользователя нет рецептов; вход меняет только last_login
+    if created or set(update_fields or ()) == {'last_login'}:
+        return
+    if Recipe.objects.filter(author=instance).exists():
+        transaction.on_commit(RECIPES.bump)
@@ -0,0 +1,18 @@
+"""Слаги тегов и их id из справочника тегов в памяти процесса."""
+from .reference import TAGS, Version
+
+_tag_ids: dict[str, int] = {}
+_tag_ids_version: Version | None = None
+
+
+def get_tag_ids() -> dict[str, int]:
+    global _tag_ids, _tag_ids_version
+    snapshot = TAGS.get()
+    if _tag_ids_version != snapshot.version:
+        _tag_ids = {tag['slug']: tag['id'] for tag in snapshot.items}
+        _tag_ids_version = snapshot.version
+    return _tag_ids
+
+
+def get_tag_choices() -> list[tuple[str, str]]:
+    return [(slug, slug) for slug in get_tag_ids()]
@@ -0,0 +1,80 @@
+"""Очереди фоновых обработчиков на таблицах БД.
+
+Задача - строка с полем статуса и временем взятия в работу:
+ShoppingListExport (exports.py), картинки рецептов (images.py).
+"""
+import time
+from collections.abc import Callable
+from datetime import timedelta
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.db import models
+from django.db.models import Q, QuerySet
+from django.utils import timezone
+
+
+class TaskQueue(NamedTuple):
+    model: type[models.Model]
+    status_field: str
+    claimed_field: str
+    pending: str
+    running: str
+    # имя настройки: через сколько секунд задача считается зависшей
+    timeout_setting: str
+
+    def available(self) -> QuerySet:
+        """Задачи в очереди; зависшие задачи выдаются повторно."""
+        stale = timezone.now() - timedelta(
+            seconds=getattr(settings, self.timeout_setting)
+        )
+        return self.model.objects.filter(
+            Q(**{self.status_field: self.pending})
+            | Q(**{self.status_field: self.running,
+                   self.claimed_field + '__lt': stale})
+        )
+
+    def claim(self, limit: int, *ordering: str, **fields) -> QuerySet:
+        """Берёт до limit задач; fields - дополнительные поля UPDATE."""
+        now = timezone.now()
+        queryset = self.available()
+        ids = list(queryset.order_by(*ordering).values_list(
+            'pk', flat=True
+        )[:limit])
+        # условный UPDATE: задачу получит только один обработчик
+        queryset.filter(pk__in=ids).update(
+            **{self.status_field: self.running, self.claimed_field: now},
+            **fields
+        )
+        return self.model.objects.filter(
+            pk__in=ids,
+            **{self.status_field: self.running, self.claimed_field: now}
+        ).order_by(*ordering)
+
+
+def run_worker(step: Callable[[], bool], poll_interval: float = 1,
+               once: bool = False,
+               idle: Callable[[], None] | None = None) -> None:
+    """Вызывает step, пока он находит задачи; once - до пустой очереди.
+
+    idle вызывается перед паузой на пустой очереди.
+    """
+    while True:
+        if step():
+            continue
+        if once:
+            return
+        if idle is not None:
+            idle()
+        time.sleep(poll_interval)
+
+
+class WorkerCommand(BaseCommand):
+    """Общие параметры команд обработчиков: poll_interval и once."""
+
+    def add_arguments(self, parser):
+        parser.add_argument('--poll-interval', type=float, default=1,
+                            help='пауза между опросами пустой очереди, с')
+        parser.add_argument('--once', action='store_true',
+                            help='обработать очередь и завершиться')
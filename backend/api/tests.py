@@ -1,6 +1,76 @@
+import base64
+import io
+import json
+import re
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, time, timezone
+from decimal import Decimal
 from http import HTTPStatus
+from pathlib import Path
+from unittest import mock
+from uuid import UUID
 
-from django.test import Client, TestCase
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import Prefetch, Value
+from django.test import (Client, RequestFactory, SimpleTestCase, TestCase,
+                         override_settings,)
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.exceptions import ParseError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import ReturnDict, ReturnList
+
+from api import (autocomplete, benchmarks, exports, feed_cache, images,
+                 recipe_cache, shopping_list, tags, user_state,)
+from api.parsers import ORJSONParser
+from api.renderers import ORJSONRenderer
+from api.serializers import (RecipeReadSerializer, RecipeShortSerializer,
+                             SubscriptionsSerializer, UserSerializer,)
+from api.utils import create_pdf, get_pdf
+from recipes.counters import rebuild_counters
+from recipes.management.commands.load_data import CSVStream, iter_json
+from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
+                            Recipe, ShoppingCart, ShoppingListExport,
+                            Subscriptions, Tag,)
+
+User = get_user_model()
+
+TEMP_MEDIA_ROOT = tempfile.mkdtemp()
+# тесты очищают кеш: общий кеш (Redis в docker) не должен пострадать
+LOCAL_CACHES = override_settings(CACHES={
+    alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': alias}
+    for alias in settings.CACHES
+})
+IMAGE = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAA'
+    'DUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg=='
+)
+
+
+def setUpModule():
+    LOCAL_CACHES.enable()
+
+
+def tearDownModule():
+    LOCAL_CACHES.disable()
+
+
+def clear_caches():
+    """Кеш представлений и версии данных (кеш versions)."""
+    for cache_ in caches.all():
+        cache_.clear()
 
 
 class FoodgramAPITestCase(TestCase):
@@ -11,3 +81,1743 @@ class FoodgramAPITestCase(TestCase):
         """Проверка доступности главной страницы."""
         response = self.guest_client.get('/api/recipes/')
         self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_local_caches(self):
+        for cache_ in caches.all():
+            self.assertIsInstance(cache_, LocMemCache)
+
+
+class FoodgramDataMixin:
+    """Наполнение базы для тестов API."""
+    RECIPES_PER_AUTHOR = settings.MAX_PAGE_SIZE // 2 + 1
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = cls.create_user('reader')
+        cls.authors = [cls.create_user('author_%s' % i) for i in range(2)]
+        cls.tags = Tag.objects.bulk_create(
+            [Tag(name='tag_%s' % i, slug='tag_%s' % i) for i in range(3)]
+        )
+        cls.ingredients = Ingredient.objects.bulk_create(
+            [Ingredient(name='ingredient_%s' % i, measurement_unit='г')
+             for i in range(5)]
+        )
+        cls.recipes = Recipe.objects.bulk_create(
+            [Recipe(name='recipe_%s_%s' % (author.id, i), text='text',
+                    image='recipes/images/test.png', cooking_time=i + 1,
+                    author=author)
+             for author in cls.authors
+             for i in range(cls.RECIPES_PER_AUTHOR)]
+        )
+        IngredientInRecipe.objects.bulk_create(
+            [IngredientInRecipe(recipe=recipe, ingredient=ingredient, amount=1)
+             for recipe in cls.recipes for ingredient in cls.ingredients]
+        )
+        Recipe.tags.through.objects.bulk_create(
+            [Recipe.tags.through(recipe=recipe, tag=tag)
+             for recipe in cls.recipes for tag in cls.tags]
+        )
+        FavoriteRecipe.objects.bulk_create(
+            [FavoriteRecipe(user=cls.user, recipe=recipe)
+             for recipe in cls.recipes]
+        )
+        ShoppingCart.objects.bulk_create(
+            [ShoppingCart(user=cls.user, recipe=recipe)
+             for recipe in cls.recipes[:3]]
+        )
+        Subscriptions.objects.bulk_create(
+            [Subscriptions(user=cls.user, author=author)
+             for author in cls.authors]
+        )
+        rebuild_counters()
+
+    @staticmethod
+    def create_user(username: str):
+        return User.objects.create_user(
+            username=username, email='%s@foodgram.ru' % username,
+            password='password', first_name=username, last_name=username
+        )
+
+    def setUp(self):
+        clear_caches()
+        self.guest_client = Client()
+        token, _ = Token.objects.get_or_create(user=self.user)
+        self.user_client = Client(HTTP_AUTHORIZATION='Token %s' % token.key)
+
+
+class QueryBudgetTestCase(FoodgramDataMixin, TestCase):
+    """Число запросов к БД не зависит от размера страницы."""
+    PAGE_SIZES = (6, settings.MAX_PAGE_SIZE)
+
+    def assert_query_budget(self, client, url: str, num: int,
+                            cached: int | None = None, prepare=None):
+        """num - при пустом кеше представлений, cached - при заполненном."""
+        for limit in self.PAGE_SIZES:
+            with self.subTest(url=url, limit=limit):
+                clear_caches()
+                if prepare is not None:
+                    prepare()
+                separator = '&' if '?' in url else '?'
+                url_limit = '%s%slimit=%s' % (url, separator, limit)
+                with self.assertNumQueries(num):
+                    response = client.get(url_limit)
+                self.assertEqual(response.status_code, HTTPStatus.OK)
+                if cached is not None:
+                    with self.assertNumQueries(cached):
+                        self.assertEqual(client.get(url_limit).json(),
+                                         response.json())
+
+    def warm_user_state(self):
+        user_state.get_user_state(self.user.id)
+
+    def test_recipe_list(self):
+        # count, ключи рецептов; промахи кеша представлений:
+        # recipes с авторами, ingredients, tags
+        self.assert_query_budget(self.guest_client, '/api/recipes/', 5)
+        # + token; избранное, корзина и подписки - из кеша
+        self.assert_query_budget(self.user_client, '/api/recipes/', 6, 3,
+                                 prepare=self.warm_user_state)
+
+    def test_recipe_list_filtered(self):
+        def prepare():
+            self.warm_user_state()
+            tags.get_tag_ids()
+
+        for url in ('/api/recipes/?is_favorited=1',
+                    '/api/recipes/?is_in_shopping_cart=1',
+                    '/api/recipes/?tags=tag_0&tags=tag_1'):
+            self.assert_query_budget(self.user_client, url, 6, 3,
+                                     prepare=prepare)
+
+    def test_user_state_loaded_once(self):
+        with self.assertNumQueries(7):  # + избранное, корзина и подписки
+            self.user_client.get('/api/recipes/')
+        with self.assertNumQueries(3):
+            self.user_client.get('/api/recipes/')
+
+    def test_recipe_detail(self):
+        self.warm_user_state()
+        url = '/api/recipes/%s/' % self.recipes[0].id
+        # token, ключ рецепта, recipe с автором, ingredients, tags
+        with self.assertNumQueries(5):
+            response = self.user_client.get(url)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(len(response.json()['ingredients']),
+                         len(self.ingredients))
+        with self.assertNumQueries(2):
+            self.assertEqual(self.user_client.get(url).json(),
+                             response.json())
+
+    def test_subscriptions(self):
+        # token, count, authors, ключи рецептов; промахи - одним набором
+        # запросов на страницу: recipes с авторами, ingredients, tags
+        self.assert_query_budget(
+            self.user_client, '/api/users/subscriptions/', 7, 4
+        )
+
+    def test_subscriptions_recipes_limit(self):
+        for limit in (1, 3):
+            with self.subTest(recipes_limit=limit):
+                clear_caches()
+                with self.assertNumQueries(7):
+                    response = self.user_client.get(
+                        '/api/users/subscriptions/', {'recipes_limit': limit}
+                    )
+                for author in response.json()['results']:
+                    self.assertEqual(len(author['recipes']), limit)
+                    self.assertEqual(author['recipes_count'],
+                                     self.RECIPES_PER_AUTHOR)
+
+    def test_subscriptions_recipes_limit_invalid(self):
+        response = self.user_client.get(
+            '/api/users/subscriptions/', {'recipes_limit': 'abc'}
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+class RecipePayloadMixin(FoodgramDataMixin):
+    """Запись рецептов через API."""
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def get_payload(self, **kwargs):
+        payload = {
+            'name': 'new recipe',
+            'text': 'text',
+            'cooking_time': 10,
+            'image': IMAGE,
+            'tags': [tag.id for tag in self.tags[:2]],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 5}
+                for ingredient in self.ingredients[:3]
+            ]
+        }
+        payload.update(kwargs)
+        return payload
+
+    def assert_recipe_response(self, data: dict, payload: dict):
+        recipe = self.user_client.get('/api/recipes/%s/' % data['id']).json()
+        self.assertEqual(data, recipe)
+        self.assertEqual([tag['id'] for tag in data['tags']], payload['tags'])
+        self.assertEqual(
+            [{'id': i['id'], 'amount': i['amount']}
+             for i in data['ingredients']],
+            payload['ingredients']
+        )
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeWriteTestCase(RecipePayloadMixin, TestCase):
+    """Ответ на запись рецепта собирается без повторной выборки."""
+
+    def test_create(self):
+        payload = self.get_payload()
+        # token, 2 tags, 3 ingredients, savepoint, recipe, recipes_count,
+        # tags x2, ingredients, release savepoint
+        with self.assertNumQueries(13):
+            response = self.user_client.post(
+                '/api/recipes/', payload, content_type='application/json'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        data = response.json()
+        self.assertFalse(data['is_favorited'])
+        self.assertFalse(data['is_in_shopping_cart'])
+        self.assertFalse(data['author']['is_subscribed'])
+        self.assert_recipe_response(data, payload)
+
+    def test_duplicate_tags(self):
+        tags = [self.tags[2].id, self.tags[0].id, self.tags[2].id]
+        response = self.user_client.post(
+            '/api/recipes/', self.get_payload(tags=tags),
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        data = response.json()
+        self.assertEqual([tag['id'] for tag in data['tags']],
+                         sorted(set(tags)))
+        self.assertEqual(data, self.user_client.get(
+            '/api/recipes/%s/' % data['id']
+        ).json())
+        response = self.user_client.patch(
+            '/api/recipes/%s/' % data['id'], {'tags': tags[::-1]},
+            content_type='application/json'
+        )
+        self.assertEqual([tag['id'] for tag in response.json()['tags']],
+                         sorted(set(tags)))
+
+    def test_partial_update(self):
+        recipe = self.user_client.post(
+            '/api/recipes/', self.get_payload(),
+            content_type='application/json'
+        ).json()
+        FavoriteRecipe.objects.create(user=self.user, recipe_id=recipe['id'])
+        payload = self.get_payload(
+            tags=[self.tags[2].id],
+            ingredients=[{'id': self.ingredients[4].id, 'amount': 1}]
+        )
+        del payload['image']
+        response = self.user_client.patch(
+            '/api/recipes/%s/' % recipe['id'], payload,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        data = response.json()
+        self.assertTrue(data['is_favorited'])
+        self.assert_recipe_response(data, payload)
+
+    def test_update_ingredients_diff(self):
+        recipe = self.user_client.post(
+            '/api/recipes/', self.get_payload(),
+            content_type='application/json'
+        ).json()
+        rows = dict(IngredientInRecipe.objects.filter(
+            recipe=recipe['id']).values_list('ingredient', 'pk'))
+        payload = self.get_payload(ingredients=[
+            {'id': self.ingredients[0].id, 'amount': 5},
+            {'id': self.ingredients[1].id, 'amount': 7},
+            {'id': self.ingredients[3].id, 'amount': 1},
+        ])
+        del payload['image']
+        response = self.user_client.patch(
+            '/api/recipes/%s/' % recipe['id'], payload,
+            content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assert_recipe_response(response.json(), payload)
+        new_rows = dict(IngredientInRecipe.objects.filter(
+            recipe=recipe['id']).values_list('ingredient', 'pk'))
+        for ingredient in self.ingredients[:2]:
+            self.assertEqual(rows[ingredient.id], new_rows[ingredient.id])
+        self.assertNotIn(self.ingredients[2].id, new_rows)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShoppingListTestCase(RecipePayloadMixin, TestCase):
+    """Список покупок в кеше обновляется вместе с корзиной и рецептами."""
+    URL = '/api/recipes/download_shopping_cart/'
+
+    def assert_cached_list_actual(self):
+        cached = cache.get(shopping_list.get_cache_key(self.user.id))
+        self.assertIsNotNone(cached)
+        self.assertEqual(cached,
+                         shopping_list.build_shopping_list(self.user.id))
+
+    def assert_invalidated(self):
+        # изменение сбрасывает кеш, список собирается при чтении
+        self.assertIsNone(cache.get(shopping_list.get_cache_key(self.user.id)))
+        shopping_list.get_shopping_list(self.user.id)
+        self.assert_cached_list_actual()
+
+    def test_download_uses_cache(self):
+        response = self.user_client.get(self.URL)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assert_cached_list_actual()
+        with self.assertNumQueries(1):  # token
+            response = self.user_client.get(self.URL)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_aggregate(self):
+        cart = shopping_list.get_shopping_list(self.user.id)
+        self.assertEqual(len(shopping_list.get_recipes(cart)), 3)
+        self.assertEqual(
+            [(i['name'], i['amount'])
+             for i in shopping_list.get_ingredients(cart)],
+            [(i.name, 3) for i in self.ingredients]
+        )
+
+    def test_cart_changes(self):
+        shopping_list.get_shopping_list(self.user.id)
+        url = '/api/recipes/%s/shopping_cart/'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.post(url % self.recipes[10].id)
+        self.assert_invalidated()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.delete(url % self.recipes[0].id)
+        self.assert_invalidated()
+        self.assertNotIn(self.recipes[0].id, cache.get(
+            shopping_list.get_cache_key(self.user.id))['recipes'])
+
+    def test_invalidated_during_build(self):
+        build = shopping_list.build_shopping_list
+
+        def build_then_invalidate(user_id):
+            # изменение и его on_commit - между сборкой и записью в кеш
+            result = build(user_id)
+            shopping_list.invalidate([user_id])
+            return result
+
+        with mock.patch.object(shopping_list, 'build_shopping_list',
+                               build_then_invalidate):
+            shopping_list.get_shopping_list(self.user.id)
+        self.assertIsNone(cache.get(shopping_list.get_cache_key(self.user.id)))
+
+    def test_rebuilt_before_on_commit(self):
+        url = '/api/recipes/%s/shopping_cart/' % self.recipes[10].id
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.user_client.post(url)
+        # чтение после коммита INSERT, но до on_commit
+        shopping_list.get_shopping_list(self.user.id)
+        for callback in callbacks:
+            callback()
+        self.assertEqual(
+            shopping_list.get_ingredients(
+                shopping_list.get_shopping_list(self.user.id)
+            )[0]['amount'],
+            4
+        )
+
+    def test_recipe_changes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = self.user_client.post(
+                '/api/recipes/', self.get_payload(),
+                content_type='application/json'
+            ).json()
+            self.user_client.post(
+                '/api/recipes/%s/shopping_cart/' % recipe['id']
+            )
+        shopping_list.get_shopping_list(self.user.id)
+        payload = self.get_payload(ingredients=[
+            {'id': self.ingredients[0].id, 'amount': 50},
+            {'id': self.ingredients[4].id, 'amount': 1},
+        ])
+        del payload['image']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.patch(
+                '/api/recipes/%s/' % recipe['id'], payload,
+                content_type='application/json'
+            )
+        self.assert_invalidated()
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.filter(pk=recipe['id']).delete()
+        self.assert_invalidated()
+
+
+class ShoppingListPDFTestCase(SimpleTestCase):
+    """Длинный список покупок переносится на следующие страницы."""
+
+    @staticmethod
+    def count_pages(pdf: bytes) -> int:
+        return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+    def render(self, size: int) -> bytes:
+        ingredients = [
+            {'name': 'ingredient_%s' % i, 'measurement_unit': 'г',
+             'amount': i} for i in range(size)
+        ]
+        recipes = ['recipe_%s' % i for i in range(size)]
+        with create_pdf(recipes, ingredients, host='foodgram.ru') as file:
+            return file.read()
+
+    def test_single_page(self):
+        self.assertEqual(self.count_pages(self.render(5)), 1)
+
+    def test_multiple_pages(self):
+        # не больше 36 строк по 20pt на странице LETTER
+        self.assertGreaterEqual(self.count_pages(self.render(300)),
+                                2 * 300 // 36)
+
+    def test_cache_by_content(self):
+        clear_caches()
+        recipes = ['recipe']
+        ingredients = [{'name': 'соль', 'measurement_unit': 'г', 'amount': 5}]
+        with get_pdf(recipes, ingredients, host='foodgram.ru') as file:
+            pdf = file.read()
+        with mock.patch('api.utils.create_pdf') as render:
+            with get_pdf(recipes, ingredients, host='foodgram.ru') as file:
+                self.assertEqual(file.read(), pdf)
+            render.assert_not_called()
+        ingredients[0]['amount'] = 6
+        with mock.patch('api.utils.create_pdf', wraps=create_pdf) as render:
+            get_pdf(recipes, ingredients, host='foodgram.ru').close()
+            render.assert_called_once()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class ShoppingListExportTestCase(FoodgramDataMixin, TestCase):
+    """Фоновая выгрузка списка покупок в pdf."""
+    URL = '/api/shopping_list_exports/'
+
+    def test_export(self):
+        response = self.user_client.post(self.URL)
+        self.assertEqual(response.status_code, HTTPStatus.ACCEPTED)
+        export = response.json()
+        self.assertEqual(export['status'], ShoppingListExport.PENDING)
+        self.assertEqual(self.user_client.post(self.URL).json()['id'],
+                         export['id'])
+
+        call_command('shopping_list_worker', '--once')
+
+        export = self.user_client.get('%s%s/' % (self.URL, export['id']))
+        export = export.json()
+        self.assertEqual(export['status'], ShoppingListExport.DONE)
+        self.assertEqual(export['progress'], 100)
+        self.assertTrue(export['file'].endswith('.pdf'))
+        with ShoppingListExport.objects.get(pk=export['id']).file as file:
+            self.assertTrue(file.read().startswith(b'%PDF'))
+
+    def test_export_uses_cache(self):
+        shopping_list.get_shopping_list(self.user.id)
+        ShoppingListExport.objects.create(user=self.user)
+        with mock.patch.object(shopping_list, 'build_shopping_list') as build:
+            exports.process_next()
+        build.assert_not_called()
+        self.assertEqual(ShoppingListExport.objects.get().status,
+                         ShoppingListExport.DONE)
+
+    def test_claim_once(self):
+        export = ShoppingListExport.objects.create(user=self.user)
+        self.assertEqual(exports.claim_export(), export)
+        self.assertIsNone(exports.claim_export())
+
+    def test_only_own_exports(self):
+        export = ShoppingListExport.objects.create(user=self.authors[0])
+        response = self.user_client.get('%s%s/' % (self.URL, export.id))
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+        response = self.guest_client.post(self.URL)
+        self.assertEqual(response.status_code, HTTPStatus.UNAUTHORIZED)
+
+
+class IngredientIndexTestCase(SimpleTestCase):
+    """Индекс ингредиентов в памяти."""
+    NAMES = ('Соль', 'соль морская', 'Морская капуста', 'Сахар',
+             'йодированная соль', 'Базилик')
+
+    def setUp(self):
+        self.index = autocomplete.IngredientIndex(enumerate(self.NAMES))
+
+    def search(self, value: str, limit: int = 10) -> list[str]:
+        return [self.NAMES[pk] for pk in self.index.search(value, limit)]
+
+    def test_prefix_first(self):
+        self.assertEqual(self.search('сол'),
+                         ['Соль', 'соль морская', 'йодированная соль'])
+        self.assertEqual(self.search('МОРСК'),
+                         ['Морская капуста', 'соль морская'])
+
+    def test_short_and_missing(self):
+        self.assertEqual(self.search('с')[:2], ['Сахар', 'Соль'])
+        self.assertEqual(self.search('перец'), [])
+
+    def test_limit(self):
+        self.assertEqual(self.search('соль', limit=2),
+                         ['Соль', 'соль морская'])
+        self.assertEqual(len(self.search('а', limit=3)), 3)
+
+
+class IngredientSearchTestCase(FoodgramDataMixin, TestCase):
+    """Поиск ингредиентов через API."""
+
+    def search(self, value: str) -> list[str]:
+        response = self.guest_client.get('/api/ingredients/', {'name': value})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [item['name'] for item in response.json()]
+
+    @override_settings(INGREDIENT_SEARCH_LIMIT=3)
+    def test_search(self):
+        Ingredient.objects.create(name='gredient', measurement_unit='г')
+        self.assertEqual(self.search('gredient'),
+                         ['gredient', 'ingredient_0', 'ingredient_1'])
+        self.assertEqual(self.search('nothing'), [])
+
+    def test_index_invalidation(self):
+        self.assertEqual(self.search('new'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            Ingredient.objects.create(name='new ingredient',
+                                      measurement_unit='г')
+        self.assertEqual(self.search('new'), ['new ingredient'])
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeSearchTestCase(RecipePayloadMixin, TestCase):
+    """Полнотекстовый поиск рецептов."""
+
+    def create_recipe(self, **kwargs) -> int:
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.user_client.post(
+                '/api/recipes/', self.get_payload(**kwargs),
+                content_type='application/json'
+            )
+        recipe = response.json()
+        self.assertNotIn('search_document', recipe)
+        return recipe['id']
+
+    def search(self, value: str) -> list[int]:
+        response = self.guest_client.get('/api/recipes/', {'search': value})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        return [recipe['id'] for recipe in response.json()['results']]
+
+    def test_search(self):
+        beet = Ingredient.objects.create(name='Свёкла', measurement_unit='г')
+        borscht = self.create_recipe(
+            name='Борщ', text='Борщ со сметаной',
+            ingredients=[{'id': beet.id, 'amount': 100}]
+        )
+        soup = self.create_recipe(name='Суп', text='Почти борщ')
+        self.assertEqual(self.search('борщ'), [borscht, soup])
+        self.assertEqual(self.search('СВЁКЛ'), [borscht])
+        self.assertEqual(self.search('сметана суп'), [])
+        self.assertEqual(self.search('!!!'), [])
+
+    def test_search_document_updates(self):
+        recipe = self.create_recipe(name='Окрошка', text='На квасе')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.patch(
+                '/api/recipes/%s/' % recipe, {'text': 'На кефире'},
+                content_type='application/json'
+            )
+        self.assertEqual(self.search('кефир'), [recipe])
+        self.assertEqual(self.search('квас'), [])
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.delete('/api/recipes/%s/' % recipe)
+        self.assertEqual(self.search('окрошка'), [])
+
+
+class CursorPaginationTestCase(FoodgramDataMixin, TestCase):
+    """Пагинация по ключу для ленты рецептов и подписок."""
+
+    def walk(self, url: str, limit: int, **params) -> list[int]:
+        ids, response = [], self.user_client.get(
+            url, {'cursor': '', 'limit': limit, **params}
+        ).json()
+        while True:
+            self.assertNotIn('count', response)
+            ids += [item['id'] for item in response['results']]
+            if response['next'] is None:
+                return ids
+            response = self.user_client.get(response['next']).json()
+
+    def test_recipes(self):
+        expected = list(Recipe.objects.order_by(
+            '-created', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk('/api/recipes/', 7), expected)
+        # token, ключи рецептов - без COUNT, представления - из кеша
+        with self.assertNumQueries(2):
+            self.user_client.get('/api/recipes/', {'cursor': ''})
+
+    def test_filtered_recipes(self):
+        self.assertEqual(
+            self.walk('/api/recipes/', 5, author=self.authors[0].id),
+            list(Recipe.objects.filter(author=self.authors[0]).order_by(
+                '-created', '-id').values_list('id', flat=True))
+        )
+
+    def test_search_refused(self):
+        response = self.user_client.get('/api/recipes/',
+                                        {'cursor': '', 'search': 'recipe'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('cursor', response.json())
+        response = self.user_client.get('/api/recipes/', {'search': 'recipe'})
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+
+    def test_subscriptions(self):
+        self.assertEqual(
+            self.walk('/api/users/subscriptions/', 1),
+            [author.id for author in reversed(self.authors)]
+        )
+
+    def test_count(self):
+        response = self.user_client.get(
+            '/api/recipes/', {'cursor': '', 'count': 1}
+        )
+        self.assertEqual(response.json()['count'], len(self.recipes))
+        with self.assertNumQueries(2):  # COUNT и представления из кеша
+            self.user_client.get('/api/recipes/', {'cursor': '', 'count': 1})
+
+    def test_invalid_cursor(self):
+        response = self.user_client.get('/api/recipes/', {'cursor': 'abc'})
+        self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+    def test_page_number_still_works(self):
+        response = self.guest_client.get('/api/recipes/', {'page': 2})
+        self.assertEqual(response.json()['count'], len(self.recipes))
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class CountersTestCase(RecipePayloadMixin, TestCase):
+    """Счётчики избранного, корзин, подписчиков и рецептов."""
+
+    def assert_counters(self, recipe: Recipe, favorites: int, carts: int):
+        recipe.refresh_from_db()
+        self.assertEqual(
+            (recipe.favorites_count, recipe.shopping_cart_count),
+            (favorites, carts)
+        )
+
+    def test_rebuilt(self):
+        self.assert_counters(self.recipes[0], 1, 1)
+        self.assert_counters(self.recipes[-1], 1, 0)
+        author = User.objects.get(pk=self.authors[0].pk)
+        self.assertEqual(author.recipes_count, self.RECIPES_PER_AUTHOR)
+        self.assertEqual(author.subscribers_count, 1)
+
+    def test_favorite_and_cart(self):
+        recipe = self.recipes[-1]
+        favorite = '/api/recipes/%s/favorite/' % recipe.id
+        cart = '/api/recipes/%s/shopping_cart/' % recipe.id
+        for method, url, counters in (('delete', favorite, (0, 0)),
+                                      ('post', favorite, (1, 0)),
+                                      ('post', favorite, (1, 0)),
+                                      ('post', cart, (1, 1)),
+                                      ('delete', cart, (1, 0))):
+            getattr(self.user_client, method)(url)
+            self.assert_counters(recipe, *counters)
+
+    def test_subscriptions_and_recipes(self):
+        author = self.authors[0]
+        self.user_client.delete('/api/users/%s/subscribe/' % author.id)
+        author.refresh_from_db()
+        self.assertEqual(author.subscribers_count, 0)
+        response = self.user_client.post(
+            '/api/users/%s/subscribe/' % author.id
+        )
+        self.assertEqual(
+            response.json()['recipes_count'], self.RECIPES_PER_AUTHOR
+        )
+        author.refresh_from_db()
+        self.assertEqual(author.subscribers_count, 1)
+
+        user = User.objects.get(pk=self.user.pk)
+        recipe_id = self.user_client.post(
+            '/api/recipes/', self.get_payload(),
+            content_type='application/json'
+        ).json()['id']
+        self.assertEqual(
+            User.objects.get(pk=user.pk).recipes_count, user.recipes_count + 1
+        )
+        self.user_client.delete('/api/recipes/%s/' % recipe_id)
+        self.assertEqual(
+            User.objects.get(pk=user.pk).recipes_count, user.recipes_count
+        )
+
+    def test_save_keeps_counters(self):
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        FavoriteRecipe.objects.create(user=self.authors[0], recipe=recipe)
+        recipe.name = 'renamed'
+        recipe.save()
+        self.assert_counters(recipe, 2, 1)
+
+    def test_save_copy(self):
+        recipe = Recipe.objects.get(pk=self.recipes[0].pk)
+        recipe.pk = None
+        recipe.name = 'copy'
+        recipe.save()
+        self.assertNotEqual(recipe.pk, self.recipes[0].pk)
+        self.assertEqual(Recipe.objects.get(pk=recipe.pk).name, 'copy')
+
+    def test_save_deferred(self):
+        recipe = Recipe.objects.only('id', 'name').get(pk=self.recipes[0].pk)
+        recipe.name = 'renamed'
+        with CaptureQueriesContext(connection) as queries:
+            recipe.save()
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('"text"', queries[0]['sql'])
+        self.assertIn('"updated"', queries[0]['sql'])
+        self.assert_counters(recipe, 1, 1)
+
+    def test_rebuild_command(self):
+        Recipe.objects.filter(pk=self.recipes[0].pk).update(favorites_count=5)
+        User.objects.filter(pk=self.authors[0].pk).update(recipes_count=0)
+        call_command('rebuild_counters', stdout=mock.Mock())
+        self.assert_counters(self.recipes[0], 1, 1)
+        self.assertEqual(
+            User.objects.get(pk=self.authors[0].pk).recipes_count,
+            self.RECIPES_PER_AUTHOR
+        )
+        self.assertEqual(set(rebuild_counters().values()), {0})
+
+    def test_most_favorited(self):
+        popular = self.recipes[-1]
+        FavoriteRecipe.objects.create(user=self.authors[0], recipe=popular)
+        for params in ({}, {'cursor': ''}):
+            with self.subTest(params=params):
+                results = self.guest_client.get(
+                    '/api/recipes/', {'ordering': 'favorites', **params}
+                ).json()['results']
+                self.assertEqual(results[0]['id'], popular.id)
+
+
+class UserStateTestCase(FoodgramDataMixin, TestCase):
+    """Флаги рецептов из закешированных множеств пользователя."""
+
+    def get_recipe(self, client=None) -> dict:
+        return (client or self.user_client).get(
+            '/api/recipes/%s/' % self.recipe.id
+        ).json()
+
+    def assert_flags(self, favorited: bool, in_cart: bool, subscribed: bool):
+        recipe = self.get_recipe()
+        self.assertEqual(
+            (recipe['is_favorited'], recipe['is_in_shopping_cart'],
+             recipe['author']['is_subscribed']),
+            (favorited, in_cart, subscribed)
+        )
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+
+    def test_flags(self):
+        self.assert_flags(True, True, True)
+        in_cart = {recipe.id for recipe in self.recipes[:3]}
+        for recipe in self.user_client.get(
+            '/api/recipes/', {'author': self.recipe.author_id}
+        ).json()['results']:
+            self.assertTrue(recipe['is_favorited'])
+            self.assertEqual(recipe['is_in_shopping_cart'],
+                             recipe['id'] in in_cart)
+
+    def test_endpoints_update_cache(self):
+        self.assert_flags(True, True, True)
+        urls = ('/api/recipes/%s/favorite/' % self.recipe.id,
+                '/api/recipes/%s/shopping_cart/' % self.recipe.id,
+                '/api/users/%s/subscribe/' % self.recipe.author_id)
+        for method, flags in (('delete', (False, False, False)),
+                              ('post', (True, True, True))):
+            for url in urls:
+                with self.captureOnCommitCallbacks(execute=True):
+                    getattr(self.user_client, method)(url)
+            # token, ключ рецепта, множества: без сборки представления
+            with self.assertNumQueries(3):
+                self.assert_flags(*flags)
+
+    def test_invalidated_during_build(self):
+        build = user_state.build_user_state
+
+        def build_then_invalidate(user_id):
+            # изменение и его on_commit - между сборкой и записью в кеш
+            state = build(user_id)
+            user_state.invalidate_user_state(user_id)
+            return state
+
+        with mock.patch.object(user_state, 'build_user_state',
+                               build_then_invalidate):
+            user_state.get_user_state(self.user.id)
+        with self.assertNumQueries(1):
+            user_state.get_user_state(self.user.id)
+
+    def test_guest(self):
+        with mock.patch('api.user_state.cache') as user_state_cache:
+            recipe = self.get_recipe(self.guest_client)
+        user_state_cache.get.assert_not_called()
+        self.assertFalse(recipe['is_favorited'])
+        self.assertFalse(recipe['is_in_shopping_cart'])
+        self.assertFalse(recipe['author']['is_subscribed'])
+        response = self.guest_client.get('/api/recipes/', {'is_favorited': 1})
+        self.assertEqual(response.json()['count'], 0)
+
+
+class UserRecipeFilterTestCase(FoodgramDataMixin, TestCase):
+    """Фильтры is_favorited и is_in_shopping_cart."""
+
+    def get_ids(self, **params) -> set[int]:
+        response = self.user_client.get(
+            '/api/recipes/', {'limit': settings.MAX_PAGE_SIZE, **params}
+        )
+        return {recipe['id'] for recipe in response.json()['results']}
+
+    def test_filters(self):
+        in_cart = {recipe.id for recipe in self.recipes[:3]}
+        self.assertEqual(self.get_ids(is_in_shopping_cart=1), in_cart)
+        self.assertFalse(self.get_ids(is_in_shopping_cart=0) & in_cart)
+        self.assertEqual(
+            self.get_ids(is_in_shopping_cart=1, is_favorited=1), in_cart
+        )
+        self.assertEqual(self.get_ids(is_favorited=0), set())
+
+    def test_semi_join(self):
+        user_state.get_user_state(self.user.id)
+        with CaptureQueriesContext(connection) as queries:
+            self.user_client.get('/api/recipes/', {'is_favorited': 1})
+        sql = [query['sql'] for query in queries
+               if 'recipes_favoriterecipe' in query['sql']]
+        self.assertTrue(sql)
+        for query in sql:
+            self.assertNotIn('EXISTS', query)
+            self.assertIn('"recipes_recipe"."id" IN (SELECT', query)
+
+    def test_benchmark(self):
+        result = benchmarks.favorites_filter(size=50, favorites=5)
+        self.assertEqual(set(result), {'exists, ms', 'semi-join, ms'})
+        self.assertFalse(Recipe.objects.filter(name='Рецепт 0').exists())
+
+
+class TagFilterTestCase(FoodgramDataMixin, TestCase):
+    """Фильтр по тегам без размножения строк."""
+
+    def get(self, *slugs: str):
+        return self.guest_client.get(
+            '/api/recipes/', {'tags': slugs, 'limit': settings.MAX_PAGE_SIZE}
+        )
+
+    def test_no_duplicates(self):
+        response = self.get('tag_0', 'tag_1', 'tag_2').json()
+        ids = [recipe['id'] for recipe in response['results']]
+        self.assertEqual(response['count'], len(self.recipes))
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_no_extra_queries(self):
+        self.get('tag_0')
+        with CaptureQueriesContext(connection) as queries:
+            self.get('tag_0', 'tag_1', 'tag_2')
+        # count, ключи рецептов: слаги - из памяти процесса,
+        # представления - из кеша
+        self.assertEqual(len(queries), 2)
+        for query in queries[:2]:
+            self.assertNotIn('DISTINCT', query['sql'])
+            self.assertNotIn('JOIN "recipes_recipe_tags"', query['sql'])
+
+    def test_unknown_slug(self):
+        self.assertEqual(self.get('missing').status_code,
+                         HTTPStatus.BAD_REQUEST)
+
+    def test_new_tag(self):
+        self.get('tag_0')
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = Tag.objects.create(name='new', slug='new')
+        self.recipes[0].tags.add(tag)
+        self.assertEqual(
+            [recipe['id'] for recipe in self.get('new').json()['results']],
+            [self.recipes[0].id]
+        )
+
+
+class ReferenceDataTestCase(FoodgramDataMixin, TestCase):
+    """Теги и ингредиенты из памяти процесса, с условными запросами."""
+    URLS = ('/api/tags/', '/api/ingredients/', '/api/ingredients/?name=ingr')
+
+    def test_no_queries(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                first = self.guest_client.get(url)
+                with self.assertNumQueries(0):
+                    second = self.guest_client.get(url)
+                self.assertEqual(first.json(), second.json())
+        self.assertEqual(len(self.guest_client.get(self.URLS[2]).json()),
+                         len(self.ingredients))
+
+    def test_not_modified(self):
+        for url in self.URLS:
+            with self.subTest(url=url):
+                response = self.guest_client.get(url)
+                self.assertTrue(response['ETag'].startswith('W/'))
+                for headers in (
+                    {'HTTP_IF_NONE_MATCH': response['ETag']},
+                    {'HTTP_IF_MODIFIED_SINCE': response['Last-Modified']}
+                ):
+                    not_modified = self.guest_client.get(url, **headers)
+                    self.assertEqual(not_modified.status_code,
+                                     HTTPStatus.NOT_MODIFIED)
+                    self.assertEqual(not_modified['ETag'], response['ETag'])
+
+    def test_invalidation(self):
+        etag = self.guest_client.get('/api/tags/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            tag = Tag.objects.create(name='new', slug='new')
+        response = self.guest_client.get(
+            '/api/tags/', HTTP_IF_NONE_MATCH=etag
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertIn(tag.id, [item['id'] for item in response.json()])
+
+    def test_detail(self):
+        tag = self.tags[0]
+        response = self.guest_client.get('/api/tags/%s/' % tag.id)
+        self.assertEqual(response.json(), {
+            'id': tag.id, 'name': tag.name, 'slug': tag.slug, 'color': None
+        })
+        for pk in (0, 'abc'):
+            response = self.guest_client.get('/api/tags/%s/' % pk)
+            self.assertEqual(response.status_code, HTTPStatus.NOT_FOUND)
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeConditionalGetTestCase(RecipePayloadMixin, TestCase):
+    """ETag ленты и рецепта, ответ 304 без сериализации."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.detail = '/api/recipes/%s/' % self.recipe.id
+        user_state.get_user_state(self.user.id)
+
+    def assert_not_modified(self, client, url: str, etag: str, num: int):
+        with self.assertNumQueries(num):
+            response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def assert_modified(self, client, url: str, etag: str) -> str:
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertNotEqual(response['ETag'], etag)
+        return response['ETag']
+
+    def test_not_modified(self):
+        for client, url, num in ((self.guest_client, '/api/recipes/', 0),
+                                 (self.user_client, '/api/recipes/', 1),
+                                 (self.guest_client, self.detail, 1),
+                                 (self.user_client, self.detail, 2)):
+            with self.subTest(url=url, num=num):
+                etag = client.get(url)['ETag']
+                self.assertTrue(etag.startswith('W/'))
+                self.assert_not_modified(client, url, etag, num)
+
+    def test_recipe_changed(self):
+        etags = {url: self.guest_client.get(url)['ETag']
+                 for url in ('/api/recipes/', self.detail)}
+        updated = Recipe.objects.get(pk=self.recipe.pk).updated
+        token, _ = Token.objects.get_or_create(user=self.recipe.author)
+        author_client = Client(HTTP_AUTHORIZATION='Token %s' % token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = author_client.patch(
+                self.detail, {'cooking_time': 99},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertGreater(Recipe.objects.get(pk=self.recipe.pk).updated,
+                           updated)
+        for url, etag in etags.items():
+            self.assert_modified(self.guest_client, url, etag)
+
+    def test_user_state_changed(self):
+        other = '/api/recipes/%s/' % self.recipes[-1].id
+        etags = {url: self.user_client.get(url)['ETag']
+                 for url in ('/api/recipes/', self.detail, other)}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user_client.delete(self.detail + 'shopping_cart/')
+        self.assert_modified(self.user_client, '/api/recipes/',
+                             etags['/api/recipes/'])
+        self.assert_modified(self.user_client, self.detail,
+                             etags[self.detail])
+        # флаги другого рецепта не изменились
+        self.assert_not_modified(self.user_client, other, etags[other], 2)
+
+    def test_etag_survives_cache_eviction(self):
+        etag = self.guest_client.get('/api/recipes/')['ETag']
+        # версии - в отдельном кеше versions
+        cache.clear()
+        response = self.guest_client.get('/api/recipes/',
+                                         HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.NOT_MODIFIED)
+
+    def test_counter_ordering_without_etag(self):
+        params = {'ordering': 'favorites'}
+        first = self.guest_client.get('/api/recipes/', params)
+        self.assertFalse(first.has_header('ETag'))
+        self.assertNotEqual(first.json()['results'][0]['id'], self.recipe.id)
+        token = Token.objects.create(user=self.create_user('fan'))
+        fan = Client(HTTP_AUTHORIZATION='Token %s' % token.key)
+        with self.captureOnCommitCallbacks(execute=True):
+            fan.post(self.detail + 'favorite/')
+        response = self.guest_client.get(
+            '/api/recipes/', params, HTTP_IF_NONE_MATCH='W/"any"'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['results'][0]['id'], self.recipe.id)
+
+    def test_errors_without_etag(self):
+        response = self.guest_client.get('/api/recipes/', {'tags': 'missing'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class RecipeFeedCacheTestCase(FoodgramDataMixin, TestCase):
+    """Кеш ленты рецептов для гостей."""
+
+    def get(self, client=None, **params):
+        return (client or self.guest_client).get('/api/recipes/', params)
+
+    def test_hit(self):
+        first = self.get(tags=['tag_1', 'tag_0'], page=2)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.get(page=2, tags=['tag_0', 'tag_1', 'tag_0'])
+        self.assertEqual(second['X-Cache'], 'HIT')
+        self.assertEqual(first.json(), second.json())
+        self.assertEqual(feed_cache.get_stats(), {'hits': 1, 'misses': 1})
+
+    def test_not_cached(self):
+        for client, params in (
+            (self.user_client, {}),
+            (self.guest_client, {'search': 'recipe'}),
+            (self.guest_client, {'cursor': ''}),
+        ):
+            with self.subTest(params=params):
+                self.get(client, **params)
+                self.assertFalse(self.get(client, **params).has_header(
+                    'X-Cache'
+                ))
+        self.assertEqual(feed_cache.get_stats(), {'hits': 0, 'misses': 0})
+        for _ in range(2):  # ошибки не кешируются
+            self.assertEqual(self.get(tags='missing').status_code,
+                             HTTPStatus.BAD_REQUEST)
+        self.assertEqual(feed_cache.get_stats(), {'hits': 0, 'misses': 2})
+
+    def test_invalidation(self):
+        self.get()
+        for change in (
+            lambda: Recipe.objects.get(pk=self.recipes[0].pk).save(),
+            lambda: Tag.objects.filter(pk=self.tags[0].pk).get().save(),
+            lambda: Ingredient.objects.create(name='new',
+                                              measurement_unit='г'),
+        ):
+            with self.captureOnCommitCallbacks(execute=True):
+                change()
+            self.assertEqual(self.get()['X-Cache'], 'MISS')
+            self.assertEqual(self.get()['X-Cache'], 'HIT')
+
+    def test_user_without_recipes_keeps_cache(self):
+        self.get()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.guest_client.post('/api/users/', {
+                'username': 'new', 'email': 'new@foodgram.ru',
+                'password': 'Pa55word!x', 'first_name': 'new',
+                'last_name': 'new'
+            })
+            self.assertEqual(response.status_code, HTTPStatus.CREATED)
+            user = User.objects.get(pk=self.user.pk)
+            user.first_name = 'changed'
+            user.save()
+        with self.assertNumQueries(0):
+            self.get()
+
+    def test_stats_command(self):
+        self.get()
+        self.get()
+        stdout = io.StringIO()
+        call_command('recipe_feed_cache', '--reset', stdout=stdout,
+                     stderr=io.StringIO())
+        self.assertIn('hit ratio: 0.50', stdout.getvalue())
+        self.assertEqual(feed_cache.get_stats(), {'hits': 0, 'misses': 0})
+
+    def test_stats_command_local_cache(self):
+        stderr = io.StringIO()
+        with override_settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+        }}):
+            call_command('recipe_feed_cache', stdout=io.StringIO(),
+                         stderr=stderr)
+        self.assertIn('CACHES', stderr.getvalue())
+
+
+class RecipeReprCacheTestCase(FoodgramDataMixin, TestCase):
+    """Кеш представлений рецептов без флагов пользователя."""
+
+    def setUp(self):
+        super().setUp()
+        self.recipe = self.recipes[0]
+        self.url = '/api/recipes/%s/' % self.recipe.id
+        token, _ = Token.objects.get_or_create(user=self.authors[1])
+        self.other_client = Client(
+            HTTP_AUTHORIZATION='Token %s' % token.key
+        )
+
+    def get(self, client=None) -> dict:
+        return (client or self.user_client).get(self.url).json()
+
+    def test_flags_not_shared(self):
+        self.assertTrue(self.get()['is_favorited'])
+        with self.assertNumQueries(3):  # token, ключ рецепта, множества
+            recipe = self.get(self.other_client)
+        self.assertFalse(recipe['is_favorited'])
+        self.assertFalse(recipe['is_in_shopping_cart'])
+        self.assertFalse(recipe['author']['is_subscribed'])
+        self.assertTrue(self.get()['author']['is_subscribed'])
+
+    def test_rebuilt_on_change(self):
+        for model, pk, field, read in (
+            (Recipe, self.recipe.pk, 'name', lambda data: data['name']),
+            (Ingredient, self.ingredients[0].pk, 'name',
+             lambda data: data['ingredients'][0]['name']),
+            (Tag, self.tags[0].pk, 'name',
+             lambda data: data['tags'][0]['name']),
+            (User, self.recipe.author_id, 'first_name',
+             lambda data: data['author']['first_name']),
+        ):
+            with self.subTest(model=model.__name__):
+                self.get()
+                instance = model.objects.get(pk=pk)
+                setattr(instance, field, 'changed')
+                with self.captureOnCommitCallbacks(execute=True):
+                    instance.save()
+                with self.assertNumQueries(5):  # представление собрано заново
+                    self.assertEqual(read(self.get()), 'changed')
+
+    def test_rebuilt_on_ingredient_row_change(self):
+        etag = self.user_client.get(self.url).headers['ETag']
+        item = IngredientInRecipe.objects.filter(recipe=self.recipe).first()
+        item.amount = 99
+        with self.captureOnCommitCallbacks(execute=True):
+            item.save()
+        response = self.user_client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(
+            {row['id']: row['amount']
+             for row in response.json()['ingredients']}[item.ingredient_id],
+            99
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            item.delete()
+        ids = [row['id'] for row in self.get()['ingredients']]
+        self.assertNotIn(item.ingredient_id, ids)
+        feed = self.user_client.get(
+            '/api/recipes/', {'author': self.recipe.author_id,
+                              'limit': settings.MAX_PAGE_SIZE}
+        ).json()['results']
+        recipe = next(data for data in feed if data['id'] == self.recipe.id)
+        self.assertNotIn(item.ingredient_id,
+                         [row['id'] for row in recipe['ingredients']])
+
+    def test_last_login_keeps_cache(self):
+        self.get()
+        author = User.objects.get(pk=self.recipe.author_id)
+        author.save(update_fields=['last_login'])
+        with self.assertNumQueries(2):
+            self.get()
+
+    def test_short_representations(self):
+        full = self.get()
+        response = self.user_client.get('/api/users/subscriptions/')
+        preview = next(
+            recipe for author in response.json()['results']
+            for recipe in author['recipes'] if recipe['id'] == self.recipe.id
+        )
+        self.assertEqual(
+            preview, {field: full[field]
+                      for field in ('id', 'name', 'image', 'cooking_time')}
+        )
+        self.user_client.delete(self.url + 'shopping_cart/')
+        response = self.user_client.post(self.url + 'shopping_cart/')
+        self.assertEqual(response.status_code, HTTPStatus.CREATED)
+        self.assertEqual(set(response.json()), set(preview))
+        self.assertEqual(response.json()['name'], full['name'])
+
+
+class RepresentationsTestCase(FoodgramDataMixin, TestCase):
+    """Функции представлений повторяют вывод полей DRF."""
+
+    def setUp(self):
+        super().setUp()
+        request = RequestFactory().get('/api/recipes/')
+        request.user = self.user
+        self.context = {'request': request}
+        self.recipes = list(recipe_cache.get_full_queryset())
+        user_state.set_recipe_flags(self.recipes, self.user)
+
+    def assert_same_output(self, serializer_class, instance, **kwargs):
+        kwargs.setdefault('context', self.context)
+        data = serializer_class(instance, **kwargs).data
+        with benchmarks.drf_fields():
+            expected = serializer_class(instance, **kwargs).data
+        # порядок ключей тоже совпадает
+        self.assertEqual(json.dumps(data), json.dumps(expected))
+
+    def test_recipes(self):
+        self.recipes[0].image = ''
+        self.recipes[1].image_variants = {
+            'small': 'recipes/images/variants/test_small.webp'
+        }
+        for serializer_class in (RecipeReadSerializer, RecipeShortSerializer):
+            with self.subTest(serializer=serializer_class.__name__):
+                self.assert_same_output(serializer_class, self.recipes,
+                                        many=True)
+                self.assert_same_output(serializer_class, self.recipes[1],
+                                        context={})
+
+    def test_users(self):
+        subscribed = User.objects.annotate(
+            is_subscribed=Value(True)
+        ).get(pk=self.authors[0].pk)
+        for user in (self.user, subscribed):
+            self.assert_same_output(UserSerializer, user)
+
+    def test_subscriptions(self):
+        authors = list(User.objects.filter(
+            pk__in=[author.pk for author in self.authors]
+        ).annotate(is_subscribed=Value(True)).prefetch_related(Prefetch(
+            'recipes', queryset=Recipe.objects.all(),
+            to_attr='recipes_preview'
+        )))
+        self.assert_same_output(SubscriptionsSerializer, authors, many=True)
+
+    def test_benchmark(self):
+        result = benchmarks.read_serializers(size=5)
+        self.assertEqual(len(result), 6)
+        self.assertFalse(Recipe.objects.filter(name='Рецепт 0').exists())
+
+
+class ORJSONTestCase(SimpleTestCase):
+    """orjson: тот же вывод, что у JSONRenderer DRF."""
+    DATA = ReturnDict((
+        ('list', ReturnList([1, 'два', None, True], serializer=None)),
+        ('lazy', gettext_lazy('Рецепт')),
+        ('decimal', Decimal('1.5')),
+        ('datetime', datetime(2023, 6, 1, 12, 30, 15, 123456,
+                              tzinfo=timezone.utc)),
+        ('naive', datetime(2023, 6, 1, 12, 30)),
+        ('date', date(2023, 6, 1)),
+        ('time', time(12, 30, 15, 123456)),
+        ('uuid', UUID(int=1)),
+        ('separators', 'a\u2028b\u2029c'),
+        ('int keys', {1: 'a'}),
+        ('tuple', (1, 2)),
+    ), serializer=None)
+
+    def test_same_bytes(self):
+        self.assertEqual(ORJSONRenderer().render(self.DATA),
+                         JSONRenderer().render(self.DATA))
+
+    def test_fallbacks(self):
+        expected = JSONRenderer().render(self.DATA, 'application/json; '
+                                                    'indent=2')
+        self.assertEqual(ORJSONRenderer().render(
+            self.DATA, 'application/json; indent=2'
+        ), expected)
+        with mock.patch('api.renderers.orjson', None):
+            self.assertEqual(ORJSONRenderer().render(self.DATA),
+                             JSONRenderer().render(self.DATA))
+        self.assertEqual(ORJSONRenderer().render(None), b'')
+
+    def test_parser(self):
+        body = '{"name": "Борщ", "tags": [1, 2]}'.encode()
+        self.assertEqual(ORJSONParser().parse(io.BytesIO(body)),
+                         {'name': 'Борщ', 'tags': [1, 2]})
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'{"name": '))
+        with self.assertRaises(ParseError):
+            ORJSONParser().parse(io.BytesIO(b'NaN'))
+
+
+class ORJSONEndpointsTestCase(FoodgramDataMixin, TestCase):
+
+    def test_endpoints(self):
+        for url in ('/api/recipes/', '/api/recipes/%s/' % self.recipes[0].id,
+                    '/api/users/subscriptions/', '/api/users/me/',
+                    '/api/tags/'):
+            with self.subTest(url=url):
+                response = self.user_client.get(url)
+                self.assertEqual(response.content,
+                                 JSONRenderer().render(response.data))
+
+    def test_write(self):
+        response = self.user_client.post(
+            '/api/recipes/', '{"name": ', content_type='application/json'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+    def test_benchmark(self):
+        result = benchmarks.json_renderer(size=5)
+        self.assertEqual(set(result), {'json, ms', 'orjson, ms'})
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class LoadRecipesTestCase(FoodgramDataMixin, TestCase):
+    """Загрузка рецептов пачками: load_recipes."""
+
+    def setUp(self):
+        super().setUp()
+        self.file = Path(TEMP_MEDIA_ROOT) / 'recipes.json'
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def write(self, names: list[str], ingredient: str = 'new') -> None:
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.file.write_text(json.dumps([{
+            'name': name, 'text': 'text', 'cooking_time': '10',
+            'image': 'tag_1-%s.jpg' % name,
+            'ingredients': [
+                {'name': 'ingredient_0', 'measurement_unit': 'г',
+                 'amount': '100'},
+                {'name': ingredient, 'measurement_unit': 'шт',
+                 'amount': '2'},
+                {'name': ingredient, 'measurement_unit': 'шт',
+                 'amount': '3'},
+            ],
+        } for name in names], ensure_ascii=False), encoding='utf-8')
+
+    def load(self, **options) -> str:
+        stdout = io.StringIO()
+        options.setdefault('file', self.file)
+        call_command('load_recipes', author=self.authors[0].username,
+                     stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_load(self):
+        names = ['Борщ %s' % i for i in range(5)]
+        self.write(names)
+        output = self.load(batch_size=2)
+        self.assertIn('5 новых, 0 пропущено', output)
+        self.assertIn('строк/с', output)
+        recipes = Recipe.objects.filter(name__in=names)
+        self.assertEqual(recipes.count(), 5)
+        self.assertEqual(Ingredient.objects.filter(name='new').count(), 1)
+        self.assertEqual(
+            Ingredient.objects.filter(name='ingredient_0').count(), 1
+        )
+        recipe = recipes.get(name='Борщ 0')
+        self.assertEqual(
+            dict(recipe.ingredientinrecipe_set.values_list(
+                'ingredient__name', 'amount'
+            )),
+            {'ingredient_0': 100, 'new': 5}
+        )
+        self.assertEqual(list(recipe.tags.values_list('slug', flat=True)),
+                         ['tag_1'])
+        self.assertEqual(recipe.image.name, 'recipes/images/tag_1-Борщ 0.jpg')
+        self.assertEqual(
+            User.objects.get(pk=self.authors[0].pk).recipes_count,
+            self.RECIPES_PER_AUTHOR + 5
+        )
+        response = self.guest_client.get('/api/recipes/', {'search': 'борщ'})
+        self.assertEqual(response.json()['count'], 5)
+
+    def test_idempotent_and_resumable(self):
+        names = ['Суп %s' % i for i in range(5)]
+        self.write(names)
+        self.load(batch_size=2)
+        self.assertIn('0 новых, 5 пропущено', self.load(batch_size=2))
+        Recipe.objects.filter(name__in=names[3:]).delete()
+        self.assertIn('2 новых, 3 пропущено', self.load(batch_size=2))
+        self.assertEqual(Recipe.objects.filter(name__in=names).count(), 5)
+        self.assertEqual(set(rebuild_counters().values()), {0})
+
+    def test_queries_per_batch(self):
+        queries = []
+        for names, ingredient in ((['a'], 'x'),
+                                  (['b%s' % i for i in range(20)], 'y')):
+            self.write(names, ingredient)
+            with CaptureQueriesContext(connection) as captured:
+                self.load()
+            queries.append(len(captured))
+        self.assertEqual(queries[0], queries[1])
+
+    def test_author(self):
+        self.write(['Каша'])
+        with self.assertRaises(CommandError):
+            call_command('load_recipes', file=self.file, stdout=io.StringIO())
+        User.objects.filter(pk=self.authors[1].pk).update(is_superuser=True)
+        call_command('load_recipes', file=self.file, stdout=io.StringIO())
+        self.assertEqual(Recipe.objects.get(name='Каша').author,
+                         self.authors[1])
+        with self.assertRaises(CommandError):
+            self.load(file=Path(TEMP_MEDIA_ROOT) / 'missing.json')
+
+    def test_iter_json(self):
+        data = [{'name': 'x' * 100, 'amount': i} for i in range(50)]
+        self.file.parent.mkdir(parents=True, exist_ok=True)
+        self.file.write_text(json.dumps(data, indent=1))
+        for chunk_size in (1, 7, 1 << 16):
+            self.assertEqual(list(iter_json(self.file, chunk_size)), data)
+        for content in ('[1, 2', '{"a": 1}', ''):
+            self.file.write_text(content)
+            with self.assertRaises(ValueError):
+                list(iter_json(self.file, 3))
+
+
+class LoadDataTestCase(FoodgramDataMixin, TestCase):
+    """Загрузка справочников upsert'ом: load_data."""
+
+    def setUp(self):
+        super().setUp()
+        self.dir = Path(tempfile.mkdtemp())
+
+    def tearDown(self):
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+    def load(self, name: str, content: str, **options) -> str:
+        file = self.dir / name
+        file.write_text(content, encoding='utf-8')
+        stdout = io.StringIO()
+        call_command('load_data', file, stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def test_csv(self):
+        content = 'ingredient_0,г\nмука,г\n\nмука,г\nсоль, щепотка\n'
+        output = self.load('ingredients.csv', content, batch_size=2)
+        self.assertIn('4 строк, добавлено 2', output)
+        self.assertIn('строк/с', output)
+        self.assertEqual(
+            Ingredient.objects.get(name='соль').measurement_unit, 'щепотка'
+        )
+        self.assertIn('добавлено 0', self.load('ingredients.csv', content))
+        self.assertEqual(Ingredient.objects.filter(name='мука').count(), 1)
+
+    def test_json_upsert(self):
+        tag = self.tags[0]
+        content = json.dumps([
+            {'name': 'new', 'slug': tag.slug, 'color': '#000000'},
+            {'name': 'завтрак', 'slug': 'zavtrak', 'color': '#FF0000'},
+        ], ensure_ascii=False)
+        self.assertIn('добавлено 1', self.load('tags.json', content))
+        tag.refresh_from_db()
+        self.assertEqual((tag.name, tag.color), ('new', '#000000'))
+        self.assertEqual(Tag.objects.count(), len(self.tags) + 1)
+
+    def test_reference_invalidated(self):
+        self.guest_client.get('/api/ingredients/')
+        self.load('ingredients.json', json.dumps(
+            [{'name': 'перец', 'measurement_unit': 'г'}], ensure_ascii=False
+        ))
+        response = self.guest_client.get('/api/ingredients/',
+                                         {'name': 'перец'})
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['перец'])
+
+    def test_queries_per_batch(self):
+        content = ''.join('ingredient %s,г\n' % i for i in range(10))
+        with CaptureQueriesContext(connection) as queries:
+            self.load('ingredients.csv', content, batch_size=5)
+        inserts = [query for query in queries
+                   if query['sql'].startswith('INSERT')]
+        self.assertEqual(len(inserts), 2)
+
+    def test_errors(self):
+        with self.assertRaises(CommandError):
+            self.load('ingredients.csv', 'мука,г\n', copy=True)
+        with self.assertRaises(CommandError):
+            self.load('recipes_soups.json', '[]')
+        with self.assertRaises(CommandError):
+            self.load('tags.json', '[{"name": "x", "slug": "x"')
+        self.assertFalse(Tag.objects.filter(slug='x').exists())
+
+    def test_csv_stream(self):
+        rows = [('мука', 'г'), ('a,b', None), ('"q"', 'шт')]
+        stream = CSVStream(rows)
+        chunks = iter(lambda: stream.read(5), '')
+        self.assertEqual(''.join(chunks),
+                         'мука,г\n"a,b",\n"""q""",шт\n')
+        self.assertEqual(stream.count, 3)
+
+
+class RecipeExportTestCase(FoodgramDataMixin, TestCase):
+    """Выгрузка рецептов строками NDJSON."""
+
+    def export(self, client=None, **params) -> list[dict]:
+        response = (client or self.user_client).get('/api/recipes/export/',
+                                                    params)
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        lines = b''.join(response.streaming_content).splitlines()
+        return [json.loads(line) for line in lines]
+
+    def test_export(self):
+        recipes = self.export()
+        self.assertEqual(
+            [recipe['id'] for recipe in recipes],
+            list(Recipe.objects.values_list('id', flat=True))
+        )
+        detail = self.user_client.get('/api/recipes/%s/' % recipes[0]['id'])
+        self.assertEqual(recipes[0], detail.json())
+        self.assertTrue(recipes[0]['is_favorited'])
+        self.assertFalse(self.export(self.guest_client)[0]['is_favorited'])
+
+    def test_filters(self):
+        author = self.authors[0]
+        self.assertEqual(
+            {recipe['author']['id'] for recipe in self.export(
+                author=author.id
+            )},
+            {author.id}
+        )
+        self.assertEqual(len(self.export(is_in_shopping_cart=1)), 3)
+        response = self.user_client.get('/api/recipes/export/',
+                                        {'tags': 'missing'})
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+    @override_settings(RECIPE_EXPORT_CHUNK_SIZE=50)
+    def test_chunks(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(len(self.export()), len(self.recipes))
+        # полные рецепты - одним запросом на часть выгрузки
+        self.assertEqual(
+            sum('"recipes_recipe"."text"' in query['sql']
+                for query in queries),
+            -(-len(self.recipes) // 50)
+        )
+        with self.assertNumQueries(2):  # token, ключи рецептов
+            self.export()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeImportTestCase(RecipePayloadMixin, TestCase):
+    """Массовая загрузка рецептов: NDJSON или JSON-массив."""
+    URL = '/api/recipes/import/'
+
+    def post(self, items: list[dict], client=None, ndjson: bool = True):
+        if ndjson:
+            data = '\n'.join(json.dumps(item) for item in items)
+        else:
+            data = json.dumps(items)
+        with self.captureOnCommitCallbacks(execute=True):
+            return (client or self.user_client).post(
+                self.URL, data, content_type='application/x-ndjson'
+                if ndjson else 'application/json'
+            )
+
+    def test_import(self):
+        for ndjson in (True, False):
+            with self.subTest(ndjson=ndjson):
+                payloads = [self.get_payload(name='Импорт %s %s' % (ndjson, i))
+                            for i in range(3)]
+                response = self.post(payloads, ndjson=ndjson)
+                self.assertEqual(response.status_code, HTTPStatus.CREATED)
+                data = response.json()
+                self.assertEqual(data['created'], 3)
+                for pk, payload in zip(data['ids'], payloads):
+                    recipe = self.user_client.get(
+                        '/api/recipes/%s/' % pk
+                    ).json()
+                    self.assert_recipe_response(recipe, payload)
+                    self.assertEqual(recipe['author']['id'], self.user.id)
+                    self.assertTrue(recipe['image'].endswith('.png'))
+        self.assertEqual(User.objects.get(pk=self.user.pk).recipes_count, 6)
+        self.assertEqual(set(rebuild_counters().values()), {0})
+        feed = self.user_client.get('/api/recipes/', {'search': 'импорт'})
+        self.assertEqual(feed.json()['count'], 6)
+
+    def test_errors_match_single_create(self):
+        invalid = [
+            self.get_payload(tags=[999]),
+            self.get_payload(tags=[]),
+            self.get_payload(ingredients=[{'id': self.ingredients[0].id,
+                                           'amount': 1}] * 2),
+            self.get_payload(ingredients=[{'id': 999, 'amount': 1}]),
+            self.get_payload(cooking_time=0),
+        ]
+        response = self.post([self.get_payload(), *invalid])
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        errors = response.json()
+        self.assertEqual(errors[0], {})
+        for error, payload in zip(errors[1:], invalid):
+            single = self.user_client.post('/api/recipes/', payload,
+                                           content_type='application/json')
+            self.assertEqual(error, single.json())
+        self.assertFalse(Recipe.objects.filter(author=self.user).exists())
+
+    def test_queries(self):
+        self.post([self.get_payload()])  # справочники загружены в память
+        counts = []
+        for size in (1, 10):
+            with CaptureQueriesContext(connection) as queries:
+                self.post([self.get_payload() for _ in range(size)])
+            counts.append(len(queries))
+        self.assertEqual(counts[0], counts[1])
+
+    def test_request_errors(self):
+        self.assertEqual(self.post([self.get_payload()],
+                                   self.guest_client).status_code,
+                         HTTPStatus.UNAUTHORIZED)
+        response = self.user_client.post(
+            self.URL, '{"name": "a"}\n{"name": ',
+            content_type='application/x-ndjson'
+        )
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        self.assertIn('line 2', response.json()['detail'])
+        response = self.user_client.post(self.URL, self.get_payload(),
+                                         content_type='application/json')
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+        with override_settings(RECIPE_IMPORT_MAX_ITEMS=1):
+            response = self.post([self.get_payload()] * 2)
+        self.assertEqual(response.status_code, HTTPStatus.BAD_REQUEST)
+
+
+def make_image(size: tuple[int, int], color: str = 'red') -> str:
+    buffer = io.BytesIO()
+    Image.new('RGB', size, color).save(buffer, 'JPEG')
+    return 'data:image/jpeg;base64,%s' % base64.b64encode(
+        buffer.getvalue()
+    ).decode()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class RecipeImageTestCase(RecipePayloadMixin, TestCase):
+    """Варианты картинок рецептов в фоновом обработчике."""
+
+    def setUp(self):
+        super().setUp()
+        # у рецептов из setUpTestData нет файлов картинок
+        Recipe.objects.update(image_status=Recipe.IMAGE_DONE)
+        self.recipe = self.user_client.post(
+            '/api/recipes/', self.get_payload(image=make_image((1000, 600))),
+            content_type='application/json'
+        ).json()
+        self.url = '/api/recipes/%s/' % self.recipe['id']
+
+    def get_recipe(self) -> Recipe:
+        return Recipe.objects.get(pk=self.recipe['id'])
+
+    def test_variants(self):
+        self.assertEqual(self.recipe['image_variants'], {})
+        self.assertEqual(self.get_recipe().image_status, Recipe.IMAGE_PENDING)
+
+        call_command('recipe_image_worker', '--once', '--workers', '2')
+
+        recipe = self.get_recipe()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_DONE)
+        sizes = {}
+        for name, path in recipe.image_variants.items():
+            with default_storage.open(path) as file, Image.open(file) as image:
+                self.assertEqual(image.format, 'WEBP')
+                sizes[name] = image.size
+        self.assertEqual(sizes, {'small': (320, 192), 'medium': (960, 576),
+                                 'large': (1000, 600)})
+
+        data = self.user_client.get(self.url).json()
+        self.assertEqual(data['image'], self.recipe['image'])
+        self.assertEqual(set(data['image_variants']), set(sizes))
+        small = data['image_variants']['small']
+        self.assertTrue(small.startswith('http://testserver/media/'))
+        feed = self.user_client.get('/api/recipes/', {'author': self.user.id})
+        self.assertEqual(feed.json()['results'][0]['image'], small)
+        self.user_client.delete(self.url + 'shopping_cart/')
+        short = self.user_client.post(self.url + 'shopping_cart/').json()
+        self.assertTrue(small.endswith(short['image']))
+
+    def test_image_replaced(self):
+        images.run_worker(once=True)
+        old = self.get_recipe().image_variants
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.user_client.patch(
+                self.url, {'image': make_image((100, 100), 'blue')},
+                content_type='application/json'
+            )
+        self.assertEqual(response.status_code, HTTPStatus.OK)
+        self.assertEqual(response.json()['image_variants'], {})
+        self.assertFalse(any(default_storage.exists(path)
+                             for path in old.values()))
+
+        images.run_worker(once=True)
+        variants = self.user_client.get(self.url).json()['image_variants']
+        self.assertEqual(len(variants), len(old))
+
+    def test_stale_result_discarded(self):
+        claimed = images.claim_recipes(10)
+        self.assertEqual([recipe.id for recipe in claimed],
+                         [self.recipe['id']])
+        self.assertEqual(images.claim_recipes(10), [])
+        self.user_client.patch(
+            self.url, {'image': make_image((100, 100), 'blue')},
+            content_type='application/json'
+        )
+        with ThreadPoolExecutor(1) as executor:
+            self.assertEqual(images.process_recipes(claimed, executor), 0)
+        recipe = self.get_recipe()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_PENDING)
+        self.assertEqual(recipe.image_variants, {})
+
+    def test_failed(self):
+        Recipe.objects.filter(pk=self.recipe['id']).update(
+            image='recipes/images/missing.png'
+        )
+        images.run_worker(once=True)
+        self.assertEqual(self.get_recipe().image_status, Recipe.IMAGE_FAILED)
+
+    def test_save_keeps_variants(self):
+        recipe = self.get_recipe()
+        images.run_worker(once=True)
+        recipe.name = 'changed'
+        recipe.save()
+        recipe = self.get_recipe()
+        self.assertEqual(recipe.name, 'changed')
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_DONE)
+        self.assertEqual(len(recipe.image_variants),
+                         len(settings.RECIPE_IMAGE_VARIANTS))
+
+    def test_model_save_requeues(self):
+        images.run_worker(once=True)
+        recipe = self.get_recipe()
+        old = recipe.image_variants
+        recipe.image = ContentFile(
+            base64.b64decode(make_image((50, 50)).split(',')[1]),
+            name='replaced.jpg'
+        )
+        with self.captureOnCommitCallbacks() as callbacks:
+            recipe.save()
+        # до коммита старые варианты на месте
+        self.assertTrue(all(default_storage.exists(path)
+                            for path in old.values()))
+        for callback in callbacks:
+            callback()
+        self.assertFalse(any(default_storage.exists(path)
+                             for path in old.values()))
+        recipe = self.get_recipe()
+        self.assertEqual(recipe.image_status, Recipe.IMAGE_PENDING)
+        self.assertEqual(recipe.image_variants, {})
+        images.run_worker(once=True)
+        self.assertEqual(self.get_recipe().image_status, Recipe.IMAGE_DONE)
+
+    def test_delete_removes_variants(self):
+        images.run_worker(once=True)
+        variants = self.get_recipe().image_variants
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.user_client.delete(self.url)
+        self.assertEqual(response.status_code, HTTPStatus.NO_CONTENT)
+        self.assertFalse(any(default_storage.exists(path)
+                             for path in variants.values()))
@@ -1,7 +1,8 @@
 from django.urls import include, path
 from rest_framework.routers import DefaultRouter
 
-from .views import IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet
+from .views import (IngredientViewSet, RecipeViewSet,
+                    ShoppingListExportViewSet, TagViewSet, UserViewSet,)
 
 app_name = 'api'
 
@@ -11,6 +12,8 @@ v1_router.register('users', UserViewSet, basename='users')
 v1_router.register('tags', TagViewSet, basename='tags')
 v1_router.register('recipes', RecipeViewSet, basename='recipes')
 v1_router.register('ingredients', IngredientViewSet, basename='ingredients')
+v1_router.register('shopping_list_exports', ShoppingListExportViewSet,
+                   basename='shopping_list_exports')
 
 urlpatterns = [
     path('auth/', include('djoser.urls.authtoken')),
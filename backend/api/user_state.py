@@ -0,0 +1,87 @@
+"""id избранных рецептов, рецептов в корзине и авторов в подписках.
+
+Множества пользователя хранятся в кеше одним значением и загружаются
+одним запросом при промахе. По ним флаги is_favorited,
+is_in_shopping_cart и is_subscribed выставляются в Python, без
+подзапросов на каждую строку ленты.
+
+Ключ значения содержит версию пользователя: изменение меняет версию,
+и множества, собранные до него и записанные после, уже не читаются.
+"""
+from collections.abc import Iterable
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache
+from django.db.models import IntegerField, Value
+
+from recipes.models import FavoriteRecipe, Recipe, ShoppingCart, Subscriptions
+from .reference import CacheVersion
+
+VERSION_NAME = 'user_state:{}'
+CACHE_KEY = 'user_state:{}:{}'
+FAVORITES, SHOPPING_CART, SUBSCRIPTIONS = range(3)
+
+
+class UserState(NamedTuple):
+    favorites: set[int]
+    shopping_cart: set[int]
+    subscriptions: set[int]
+
+
+def get_version(user_id: int) -> CacheVersion:
+    return CacheVersion(VERSION_NAME.format(user_id), DEFAULT_CACHE_ALIAS,
+                        settings.USER_STATE_CACHE_TIMEOUT)
+
+
+def get_cache_key(user_id: int) -> str:
+    return CACHE_KEY.format(user_id, get_version(user_id).get().key)
+
+
+def build_user_state(user_id: int) -> UserState:
+    state = UserState(set(), set(), set())
+    rows = FavoriteRecipe.objects.filter(user_id=user_id).values_list(
+        Value(FAVORITES, output_field=IntegerField()), 'recipe_id'
+    ).union(
+        ShoppingCart.objects.filter(user_id=user_id).values_list(
+            Value(SHOPPING_CART, output_field=IntegerField()), 'recipe_id'
+        ),
+        Subscriptions.objects.filter(user_id=user_id).values_list(
+            Value(SUBSCRIPTIONS, output_field=IntegerField()), 'author_id'
+        ),
+        all=True
+    )
+    for kind, pk in rows:
+        state[kind].add(pk)
+    return state
+
+
+def get_user_state(user_id: int) -> UserState:
+    # версия читается до сборки из БД
+    key = get_cache_key(user_id)
+    state = cache.get(key)
+    if state is None:
+        state = build_user_state(user_id)
+        cache.set(key, state, settings.USER_STATE_CACHE_TIMEOUT)
+    return state
+
+
+def invalidate_user_state(user_id: int) -> None:
+    """Множества загрузятся одним запросом при следующем чтении.
+
+    Правка закешированного значения на месте теряла бы параллельные
+    изменения того же пользователя.
+    """
+    get_version(user_id).bump()
+
+
+def set_recipe_flags(recipes: Iterable[Recipe], user) -> None:
+    """Флаги для рецептов и их авторов; гостю - без обращения к кешу."""
+    state = (get_user_state(user.id) if user.is_authenticated
+             else UserState(set(), set(), set()))
+    for recipe in recipes:
+        recipe.is_favorited = recipe.id in state.favorites
+        recipe.is_in_shopping_cart = recipe.id in state.shopping_cart
+        recipe.author.is_subscribed = (
+            recipe.author_id in state.subscriptions
+        )
@@ -1,10 +1,15 @@
+import hashlib
+import json
 from collections import OrderedDict
-from io import BytesIO
-from typing import Any, Generic, TypeVar
+from collections.abc import Iterable, Iterator
+from io import SEEK_END, BytesIO
+from itertools import islice
+from tempfile import SpooledTemporaryFile
+from typing import IO, Any, Generic, TypeVar
 
 from django.conf import settings
+from django.core.cache import cache
 from django.db import models
-from django.db.models.query import QuerySet
 from reportlab.lib.colors import black, gray
 from reportlab.lib.pagesizes import LETTER
 from reportlab.lib.units import inch
@@ -15,6 +20,8 @@ from rest_framework.validators import UniqueTogetherValidator, ValidationError
 
 ModelType = TypeVar('ModelType', bound=models.Model)
 
+PDF_CACHE_KEY = 'shopping_list_pdf:{}'
+
 
 def create_list_obj(cls: Generic[ModelType], items: list[OrderedDict | dict],
                     **kwargs) -> list[Generic[ModelType]]:
@@ -24,6 +31,24 @@ def create_list_obj(cls: Generic[ModelType], items: list[OrderedDict | dict],
         raise ValueError(exc)
 
 
+def batched(items: Iterable, size: int) -> Iterator[list]:
+    items = iter(items)
+    while batch := list(islice(items, size)):
+        yield batch
+
+
+def set_prefetched_objects(instance: models.Model, related_name: str,
+                           objects: list[models.Model]) -> None:
+    """Кладёт уже загруженные объекты в кеш prefetch_related."""
+    if not hasattr(instance, '_prefetched_objects_cache'):
+        instance._prefetched_objects_cache = {}
+    instance._prefetched_objects_cache.pop(related_name, None)
+    queryset = getattr(instance, related_name).get_queryset()
+    queryset._result_cache = list(objects)
+    queryset._prefetch_done = True
+    instance._prefetched_objects_cache[related_name] = queryset
+
+
 def empty_validator(value: Any) -> Any:
     if not value:
         raise ValidationError('Обязательное поле.')
@@ -46,12 +71,46 @@ class DynamicUniqueTogetherValidator(UniqueTogetherValidator):
         super().__init__(queryset, fields, message)
 
 
-def create_pdf(recipes: QuerySet, ingredients: QuerySet, **kwargs) -> BytesIO:
+def register_pdf_font() -> None:
+    """Регистрирует шрифт один раз на процесс (ApiConfig.ready)."""
+    if 'DejaVuSerif' not in pdfmetrics.getRegisteredFontNames():
+        pdfmetrics.registerFont(TTFont('DejaVuSerif', settings.PDF_FONT_PATH))
+
+
+class ShoppingListCanvas(canvas.Canvas):
+    """Построчный вывод с переносом на новую страницу."""
+    x = 20
+    top = LETTER[1] - 0.5 * inch
+    bottom = 0.5 * inch
+    line_height = 20
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.y = self.top
+
+    def new_page(self):
+        font = self._fontname, self._fontsize
+        self.showPage()
+        self.setFont(*font)
+        self.y = self.top
+
+    def ensure_space(self, height: float):
+        if self.y - height < self.bottom:
+            self.new_page()
+
+    def write_line(self, text: str, step: float = None):
+        step = self.line_height if step is None else step
+        self.ensure_space(step)
+        self.y -= step
+        self.drawString(self.x, self.y, text)
+
+
+def create_pdf(recipes: list[str], ingredients: list[dict],
+               **kwargs) -> SpooledTemporaryFile:
     """Запись списка покупок в pdf"""
     host = kwargs.get('host')
-    buffer = BytesIO()
-    c = canvas.Canvas(buffer, pagesize=LETTER)
-    pdfmetrics.registerFont(TTFont('DejaVuSerif', 'DejaVuSerif.ttf'))
+    file = SpooledTemporaryFile(max_size=settings.PDF_SPOOL_MAX_SIZE)
+    c = ShoppingListCanvas(file, pagesize=LETTER)
 
     # header
     c.setFillColor(gray)
@@ -61,32 +120,57 @@ def create_pdf(recipes: QuerySet, ingredients: QuerySet, **kwargs) -> BytesIO:
     c.drawCentredString(8.5 * inch / 2, 10.6 * inch, 'Продуктовый помощник')
 
     # список рецептов
-    c.drawString(x := 20, y := 10 * inch, 'Список рецептов:')
+    c.y = 10 * inch
+    c.write_line('Список рецептов:', step=0)
     c.setFont('DejaVuSerif', settings.PDF_FONT_SIZE)
     for item in recipes:
-        y -= 20
-        c.drawString(x, y, '\u2022 {recipe__name}'.format(**item))
-    y -= 0.5 * inch
+        c.write_line('\u2022 {}'.format(item))
 
     # список ингредиентов
-    text = '\u2022 {ingredient__name} ({measurement}) - {amount_sum}'
+    text = '\u2022 {name} ({measurement_unit}) - {amount}'
     c.setFont('DejaVuSerif', settings.PDF_FONT_SIZE + 4)
-    c.drawString(x, y, 'Список ингредиентов:')
+    c.ensure_space(0.5 * inch + c.line_height)
+    c.write_line('Список ингредиентов:', step=0.5 * inch)
     c.setFont('DejaVuSerif', settings.PDF_FONT_SIZE)
     for item in ingredients:
-        y -= 20
-        c.drawString(x, y, text.format(**item))
-    y -= 0.5 * inch
+        c.write_line(text.format(**item))
 
     # footer
-    c.line(0, y, 8.5 * inch, y)
+    c.ensure_space(0.5 * inch + c.line_height)
+    c.y -= 0.5 * inch
+    c.line(0, c.y, 8.5 * inch, c.y)
     if host:
         footer_text = 'https://' + host
     else:
         footer_text = 'Foodgram'
-    c.drawRightString(8.5 * inch - 50, y - 20, footer_text)
+    c.drawRightString(8.5 * inch - 50, c.y - 20, footer_text)
 
     c.showPage()
     c.save()
-    buffer.seek(0)
-    return buffer
+    file.seek(0)
+    return file
+
+
+def get_pdf_cache_key(recipes: list[str], ingredients: list[dict],
+                      host: str = None) -> str:
+    content = json.dumps([recipes, ingredients, host],
+                         ensure_ascii=False, sort_keys=True)
+    return PDF_CACHE_KEY.format(
+        hashlib.sha256(content.encode('utf-8')).hexdigest()
+    )
+
+
+def get_pdf(recipes: list[str], ingredients: list[dict],
+            **kwargs) -> IO[bytes]:
+    """Список покупок в pdf из кеша по хешу содержимого."""
+    key = get_pdf_cache_key(recipes, ingredients, kwargs.get('host'))
+    pdf = cache.get(key)
+    if pdf is not None:
+        return BytesIO(pdf)
+
+    file = create_pdf(recipes, ingredients, **kwargs)
+    if file.seek(0, SEEK_END) <= settings.PDF_SPOOL_MAX_SIZE:
+        file.seek(0)
+        cache.set(key, file.read(), settings.PDF_CACHE_TIMEOUT)
+    file.seek(0)
+    return file
@@ -1,28 +1,39 @@
+from functools import partial
 from uuid import uuid4
 
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.db.models import (Count, Exists, F, OuterRef, Prefetch, Subquery,
-                              Sum,)
-from django.http import FileResponse
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
 from rest_framework import status, viewsets
 from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.models import (FavoriteRecipe, Ingredient, IngredientInRecipe,
-                            Recipe, ShoppingCart, Subscriptions, Tag,)
-from .filters import IngredientFilter, RecipeFilter
-from .mixins import CreateListRetrieveViewSet
+from recipes.models import (FavoriteRecipe, Ingredient, Recipe, ShoppingCart,
+                            ShoppingListExport, Subscriptions, Tag,)
+from . import feed_cache, recipe_cache, shopping_list
+from .autocomplete import search_ingredients
+from .conditional import conditional_response, get_etag
+from .filters import RecipeFilter
+from .mixins import CreateListRetrieveViewSet, ReferenceViewSet
+from .parsers import NDJSONParser, ORJSONParser
 from .permissions import IsAuthenticatedOrOwnerOrReadOnly
+from .reference import INGREDIENTS, RECIPES, TAGS, CacheVersion
+from .renderers import NDJSONRenderer, ORJSONRenderer
 from .serializers import (FavoriteSerializer, IngredientSerializer,
-                          RecipeReadSerializer, RecipeShortSerializer,
+                          RecipeCachedSerializer, RecipeImportSerializer,
+                          RecipeListCachedSerializer, RecipeShortSerializer,
                           RecipeWriteSerializer, ShoppingCartSerializer,
-                          SubscribeSerialization, SubscriptionsSerializer,
-                          TagSerializer, UserSerializer,)
-from .utils import create_pdf
+                          ShoppingListExportSerializer, SubscribeSerialization,
+                          SubscriptionsSerializer, TagSerializer,
+                          UserSerializer,)
+from .user_state import get_user_state, set_recipe_flags
+from .utils import batched, get_pdf
 
 User = get_user_model()
 
@@ -32,6 +43,7 @@ class UserViewSet(CreateListRetrieveViewSet):
     queryset = User.objects.all()
     serializer_class = UserSerializer
     permission_classes = [AllowAny]
+    cursor_ordering = ('-date_joined', '-id')
 
     def get_queryset(self):
         queryset = super().get_queryset().annotate(is_subscribed=Exists(
@@ -44,13 +56,28 @@ class UserViewSet(CreateListRetrieveViewSet):
         ))
 
         if self.action in ('subscriptions', 'subscribe'):
-            return queryset.annotate(
-                recipes_count=Count('recipes')
-            ).prefetch_related('recipes').filter(
-                following__user=self.request.user
-            )
+            # краткие представления - из кеша (recipe_cache.py)
+            recipes = Recipe.objects.only('id', 'author', 'updated')
+            limit = self.get_recipes_limit()
+            if limit is not None:
+                # ROW_NUMBER() по автору: не больше limit рецептов на автора
+                recipes = recipes[:limit]
+            return queryset.prefetch_related(
+                Prefetch('recipes', queryset=recipes,
+                         to_attr='recipes_preview')
+            ).filter(following__user=self.request.user)
         return queryset
 
+    def get_recipes_limit(self) -> int | None:
+        limit = self.request.query_params.get('recipes_limit')
+        if not limit:
+            return None
+        if not limit.isdigit():
+            raise ValidationError(
+                {'recipes_limit': 'Должно быть целым неотрицательным числом.'}
+            )
+        return int(limit)
+
     def get_serializer_class(self):
         serializers = {
             'subscriptions': SubscriptionsSerializer,
@@ -112,54 +139,104 @@ class UserViewSet(CreateListRetrieveViewSet):
 
 class RecipeViewSet(viewsets.ModelViewSet):
     queryset = Recipe.objects.all()
-    serializer_class = RecipeReadSerializer
+    serializer_class = RecipeCachedSerializer
     permission_classes = [IsAuthenticatedOrOwnerOrReadOnly]
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
 
+    @property
+    def cursor_ordering(self) -> tuple[str, ...]:
+        params = self.request.query_params
+        # поиск сортирует по релевантности, курсор по полям её бы потерял
+        if params.get('search') and 'cursor' in params:
+            raise ValidationError(
+                {'cursor': 'Курсор нельзя сочетать с поиском.'}
+            )
+        return RecipeFilter.ORDERINGS.get(
+            params.get('ordering'),
+            RecipeFilter.ORDERINGS['created']
+        )
+
     def get_queryset(self):
         user = self.request.user
-        if self.action == 'download_shopping_cart':
-            return IngredientInRecipe.objects.filter(
-                recipe__shoppingcart__user=user
-            )
         if self.action == 'shopping_cart':
             return ShoppingCart.objects.filter(user=user)
         if self.action == 'favorite':
             return FavoriteRecipe.objects.filter(user=user)
 
-        filter_user_recipe = {
-            'user': user.id,
-            'recipe': OuterRef("pk")
-        }
-
-        prefetch = Prefetch(
-            'author',
-            queryset=User.objects.annotate(is_subscribed=Exists(Subquery(
-                Subscriptions.objects.filter(
-                    user=user.id, author=OuterRef("pk")
-                )
-            )))
+        if self.action in ('list', 'retrieve', 'export'):
+            # представления берутся из кеша, из БД - только ключи к нему
+            return super().get_queryset().only(*recipe_cache.KEY_FIELDS)
+        return recipe_cache.get_full_queryset()
+
+    def get_object(self):
+        recipe = super().get_object()
+        if self.action != 'retrieve':
+            # флаги для ответа на запись, без подзапросов
+            set_recipe_flags([recipe], self.request.user)
+        return recipe
+
+    def get_etag(self, *parts) -> str:
+        return get_etag(
+            *parts, self.request.get_full_path(),
+            self.request.accepted_renderer.format
         )
 
-        queryset = super().get_queryset().annotate(
-            is_favorited=Exists(
-                Subquery(FavoriteRecipe.objects.filter(**filter_user_recipe))
-            ),
-            is_in_shopping_cart=Exists(
-                Subquery(ShoppingCart.objects.filter(**filter_user_recipe))
-            )
-        ).prefetch_related(prefetch, 'ingredients', 'tags')
-        return queryset
+    @staticmethod
+    def get_versions(*versions: CacheVersion) -> tuple[str, ...]:
+        return tuple(version.get().key
+                     for version in (*versions, TAGS.version,
+                                     INGREDIENTS.version))
+
+    def get_user_state_parts(self, recipe: Recipe | None = None) -> tuple:
+        user = self.request.user
+        if not user.is_authenticated:
+            return ()
+        state = get_user_state(user.id)
+        if recipe is None:
+            return tuple(sorted(ids) for ids in state)
+        return (recipe.id in state.favorites,
+                recipe.id in state.shopping_cart,
+                recipe.author_id in state.subscriptions)
+
+    def list(self, request, *args, **kwargs):
+        if (request.query_params.get('ordering')
+                in RecipeFilter.COUNTER_ORDERINGS):
+            # без ETag: счётчики не меняют версию рецептов
+            return super().list(request, *args, **kwargs)
+        # версии меняются при любом изменении рецептов, запросов к БД нет
+        versions = self.get_versions(RECIPES)
+        etag = self.get_etag(*versions, *self.get_user_state_parts())
+        key = feed_cache.get_cache_key(request, versions)
+
+        def build():
+            response = partial(super(RecipeViewSet, self).list,
+                               request, *args, **kwargs)
+            if key is None:
+                return response()
+            return feed_cache.get_response(key, response)
+        return conditional_response(request, build, etag)
+
+    def retrieve(self, request, *args, **kwargs):
+        recipe = self.get_object()
+        etag = self.get_etag(
+            recipe.id, recipe.updated, *self.get_versions(),
+            *self.get_user_state_parts(recipe)
+        )
+        return conditional_response(
+            request, lambda: Response(self.get_serializer(recipe).data), etag
+        )
 
     def get_serializer_class(self):
         serializers = {
+            'list': RecipeListCachedSerializer,
             'download_shopping_cart': RecipeShortSerializer,
             'shopping_cart': ShoppingCartSerializer,
             'favorite': FavoriteSerializer,
             'create': RecipeWriteSerializer,
             'update': RecipeWriteSerializer,
-            'partial_update': RecipeWriteSerializer
+            'partial_update': RecipeWriteSerializer,
+            'bulk_import': RecipeImportSerializer
         }
         return serializers.get(self.action, super().get_serializer_class())
 
@@ -171,22 +248,60 @@ class RecipeViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
 
+    def perform_update(self, serializer):
+        super().perform_update(serializer)
+        # UpdateModelMixin сбрасывает кеш prefetch_related после сохранения,
+        # поэтому ответ собирается сразу, из уже загруженных объектов
+        serializer.data
+
+    @action(detail=False, renderer_classes=[NDJSONRenderer, ORJSONRenderer])
+    def export(self, request):
+        """Рецепты с фильтрами ленты строками NDJSON, без пагинации"""
+        queryset = self.filter_queryset(self.get_queryset())
+        chunk_size = settings.RECIPE_EXPORT_CHUNK_SIZE
+        context = self.get_serializer_context()
+        renderer = NDJSONRenderer()
+
+        def lines():
+            # в памяти - не больше chunk_size рецептов
+            for recipes in batched(queryset.iterator(chunk_size), chunk_size):
+                yield renderer.render_lines(RecipeCachedSerializer(
+                    recipes, many=True, context=context
+                ).data)
+        return StreamingHttpResponse(lines(),
+                                     content_type=renderer.media_type)
+
+    @action(['post'], detail=False, url_path='import', url_name='import',
+            parser_classes=[NDJSONParser, ORJSONParser])
+    def bulk_import(self, request):
+        """Рецепты в формате POST /api/recipes/: NDJSON или JSON-массив"""
+        if not isinstance(request.data, list):
+            raise ValidationError('Ожидается список рецептов.')
+        if len(request.data) > settings.RECIPE_IMPORT_MAX_ITEMS:
+            raise ValidationError('Не больше %s рецептов за запрос.'
+                                  % settings.RECIPE_IMPORT_MAX_ITEMS)
+        serializer = self.get_serializer(data=request.data, many=True)
+        serializer.is_valid(raise_exception=True)
+        recipes = serializer.save(author=request.user)
+        return Response({
+            'created': len(recipes),
+            'ids': [recipe.id for recipe in recipes]
+        }, status=status.HTTP_201_CREATED)
+
     @action(detail=False)
     def download_shopping_cart(self, request):
-        queryset = self.get_queryset()
-        recipes = queryset.values('recipe__name').distinct()
-        ingredients = queryset.values(
-            'ingredient__name',
-            measurement=F('ingredient__measurement_unit'),
-        ).annotate(amount_sum=Sum('amount'))
+        cart = shopping_list.get_shopping_list(request.user.id)
+        recipes = shopping_list.get_recipes(cart)
+        ingredients = shopping_list.get_ingredients(cart)
         filename = 'foodgram_shopping_cart_{}.pdf'.format(uuid4().time_low)
         try:
-            pdf_buffer = create_pdf(
-                recipes, ingredients, host=request._request.META['HTTP_HOST']
+            pdf_file = get_pdf(
+                recipes, ingredients, host=request.get_host()
             )
         except Exception as exc:
             raise ValueError(exc)
-        return FileResponse(pdf_buffer, as_attachment=True, filename=filename)
+        # FileResponse отдаёт файл частями и закрывает его после отправки
+        return FileResponse(pdf_file, as_attachment=True, filename=filename)
 
     def __create_destroy_recipes(self, request, pk):
         if request.method == "POST":
@@ -218,15 +333,42 @@ class RecipeViewSet(viewsets.ModelViewSet):
         return self.__create_destroy_recipes(request, pk)
 
 
-class TagViewSet(viewsets.ReadOnlyModelViewSet):
+class TagViewSet(ReferenceViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
-    permission_classes = [AllowAny]
-    pagination_class = None
+    reference = TAGS
 
 
-class IngredientViewSet(TagViewSet):
+class IngredientViewSet(ReferenceViewSet):
+    """Ингредиенты; name - поиск по началу и подстроке названия"""
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
-    filter_backends = (DjangoFilterBackend,)
-    filterset_class = IngredientFilter
+    reference = INGREDIENTS
+
+    def filter_items(self, snapshot):
+        name = self.request.query_params.get('name')
+        if not name:
+            return snapshot.items
+        ids = search_ingredients(name, settings.INGREDIENT_SEARCH_LIMIT)
+        return [snapshot.by_id[pk] for pk in ids if pk in snapshot.by_id]
+
+
+class ShoppingListExportViewSet(CreateListRetrieveViewSet):
+    """Фоновая выгрузка списка покупок в pdf"""
+    serializer_class = ShoppingListExportSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return ShoppingListExport.objects.filter(user=self.request.user)
+
+    def create(self, request, *args, **kwargs):
+        # пока выгрузка не готова, повторный запрос её не дублирует
+        export = self.get_queryset().filter(
+            status__in=(ShoppingListExport.PENDING, ShoppingListExport.RUNNING)
+        ).first()
+        if export is None:
+            export = ShoppingListExport.objects.create(
+                user=request.user, host=request.get_host()
+            )
+        serializer = self.get_serializer(export)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
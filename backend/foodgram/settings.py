@@ -1,4 +1,5 @@
 import os
+import tempfile
 from pathlib import Path
 
 
@@ -73,6 +74,41 @@ DATABASES = {
     }
 }
 
+# кеш общий для gunicorn, обработчиков очередей и команд manage.py:
+# версии ленты и справочников (api/reference.py) и статистика кеша
+# ленты должны быть видны всем процессам. В docker - Redis
+# (docker-compose.yml), локально - файлы во временном каталоге
+CACHE_BACKEND = os.getenv(
+    'DJANGO_CACHE_BACKEND',
+    'django.core.cache.backends.filebased.FileBasedCache'
+)
+# файловый кеш по умолчанию хранит 300 записей и при переполнении
+# удаляет треть из них; у Redis вытеснение задаёт его maxmemory-policy
+CACHE_OPTIONS = (
+    {'MAX_ENTRIES': 100_000} if CACHE_BACKEND.endswith('FileBasedCache')
+    else {}
+)
+CACHES = {
+    'default': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'DJANGO_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_cache')
+        ),
+        'OPTIONS': CACHE_OPTIONS,
+    },
+    # версии данных (api/reference.py): хранятся без срока и не должны
+    # вытесняться вместе с представлениями рецептов
+    'versions': {
+        'BACKEND': CACHE_BACKEND,
+        'LOCATION': os.getenv(
+            'DJANGO_VERSIONS_CACHE_LOCATION',
+            os.path.join(tempfile.gettempdir(), 'foodgram_versions')
+        ),
+        'OPTIONS': CACHE_OPTIONS,
+    },
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -114,7 +150,12 @@ REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'rest_framework.authentication.TokenAuthentication',
     ],
-    'DEFAULT_RENDERER_CLASSES': ('rest_framework.renderers.JSONRenderer',),
+    'DEFAULT_RENDERER_CLASSES': ('api.renderers.ORJSONRenderer',),
+    'DEFAULT_PARSER_CLASSES': (
+        'api.parsers.ORJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ),
     'DEFAULT_PAGINATION_CLASS': 'api.pagination.LimitPageNumberPagination',
     'PAGE_SIZE': 6,
 }
@@ -130,6 +171,7 @@ PASSWORD_HASHERS = [
 AUTH_USER_MODEL = 'users.User'
 
 MAX_PAGE_SIZE = 100
+PAGINATION_COUNT_CACHE_TIMEOUT = 60
 USER_FIRST_NAME_MAX_LENGTH = 150
 USER_LAST_NAME_MAX_LENGTH = 150
 USER_PASSWORD_MAX_LENGTH = 150
@@ -144,6 +186,27 @@ RECIPE_NAME_MAX_LENGTH = 200
 COOKING_TIME_MIN = 1
 INGREDIENT_AMOUNT_MIN = 1
 PDF_FONT_SIZE = 12
+PDF_SPOOL_MAX_SIZE = 1024 * 1024
+PDF_FONT_PATH = BASE_DIR / 'DejaVuSerif.ttf'
+PDF_CACHE_TIMEOUT = 60 * 60
+SHOPPING_LIST_EXPORT_TIMEOUT = 60 * 10
+SHOPPING_LIST_EXPORT_TTL = 60 * 60 * 24
+INGREDIENT_SEARCH_LIMIT = 20
+REFERENCE_CACHE_TIMEOUT = 60 * 60
+SEARCH_CONFIG = 'russian'
+SHOPPING_LIST_CACHE_TIMEOUT = 60 * 60 * 24
+USER_STATE_CACHE_TIMEOUT = 60 * 60 * 24
+RECIPE_FEED_CACHE_TIMEOUT = 60 * 10
+RECIPE_REPR_CACHE_TIMEOUT = 60 * 60 * 24
+RECIPE_EXPORT_CHUNK_SIZE = 500
+RECIPE_IMPORT_BATCH_SIZE = 500
+RECIPE_IMPORT_MAX_ITEMS = 1000
+# наибольшая сторона варианта картинки рецепта, px; все варианты - WebP
+RECIPE_IMAGE_VARIANTS = {'small': 320, 'medium': 960, 'large': 1920}
+RECIPE_IMAGE_LIST_VARIANT = 'small'
+RECIPE_IMAGE_WEBP_QUALITY = 80
+RECIPE_IMAGE_TIMEOUT = 60 * 10
+RECIPE_IMAGE_WORKERS = 2
 
 
 UNIQUE_TOGETHER_VALIDATOR_DATA = {
@@ -1,7 +1,8 @@
 from django.contrib import admin
 
 from .models import (FavoriteRecipe, Ingredient, IngredientInRecipe, Recipe,
-                     ShoppingCart, Subscriptions, Tag,)
+                     ShoppingCart, ShoppingListExport, Subscriptions, Tag,)
+from .search import search_recipes
 
 
 class IngredientsInline(admin.TabularInline):
@@ -12,14 +13,16 @@ class IngredientsInline(admin.TabularInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = [IngredientsInline]
-    readonly_fields = ('author', 'show_favorite_count')
-    list_display = ('name', 'author')
-    search_fields = ('author__username', 'name', 'tags__slug')
-    list_filter = ('author__username', 'name', 'tags__slug')
+    readonly_fields = ('author', 'favorites_count', 'shopping_cart_count')
+    list_display = ('name', 'author', 'favorites_count')
+    search_fields = ('name',)
+    search_help_text = 'Поиск по названию, описанию и ингредиентам'
+    list_filter = ('author__username', 'name', 'tags__slug', 'image_status')
 
-    @admin.display(description='В избранном')
-    def show_favorite_count(self, obj: Recipe):
-        return obj.favoriterecipe_set.count()
+    def get_search_results(self, request, queryset, search_term):
+        if not search_term:
+            return queryset, False
+        return search_recipes(queryset, search_term), False
 
 
 @admin.register(Ingredient)
@@ -28,6 +31,12 @@ class IngredientAdmin(admin.ModelAdmin):
     list_filter = ('name',)
 
 
+@admin.register(ShoppingListExport)
+class ShoppingListExportAdmin(admin.ModelAdmin):
+    list_display = ('user', 'status', 'progress', 'created')
+    list_filter = ('status',)
+
+
 admin.site.register(Tag)
 admin.site.register(IngredientInRecipe)
 admin.site.register(FavoriteRecipe)
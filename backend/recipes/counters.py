@@ -0,0 +1,71 @@
+"""Денормализованные счётчики избранного, корзин, подписчиков и рецептов.
+
+Счётчики меняются в той же транзакции, что и строки, которые они считают
+(см. signals.py), атомарным UPDATE ... SET field = field + 1. Массовые
+операции сигналов не вызывают: после них, как и при расхождении,
+счётчики пересчитывает команда rebuild_counters.
+"""
+from typing import NamedTuple
+
+from django.contrib.auth import get_user_model
+from django.db import models
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+from .models import FavoriteRecipe, Recipe, ShoppingCart, Subscriptions
+
+User = get_user_model()
+
+
+class Counter(NamedTuple):
+    source: type[models.Model]
+    target: type[models.Model]
+    foreign_key: str
+    field: str
+
+
+COUNTERS = (
+    Counter(FavoriteRecipe, Recipe, 'recipe', 'favorites_count'),
+    Counter(ShoppingCart, Recipe, 'recipe', 'shopping_cart_count'),
+    Counter(Subscriptions, User, 'author', 'subscribers_count'),
+    Counter(Recipe, User, 'author', 'recipes_count'),
+)
+RECIPES_COUNTER = COUNTERS[-1]
+
+
+def change_counter(counter: Counter, pk: int, delta: int) -> None:
+    queryset = counter.target.objects.filter(pk=pk)
+    if delta < 0:
+        queryset = queryset.filter(**{'%s__gte' % counter.field: -delta})
+    queryset.update(**{counter.field: F(counter.field) + delta})
+
+
+def get_actual_count(counter: Counter) -> Coalesce:
+    return Coalesce(Subquery(
+        counter.source.objects.filter(
+            **{counter.foreign_key: OuterRef('pk')}
+        ).order_by().values(counter.foreign_key).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def rebuild_counters(batch_size: int = 1000) -> dict[str, int]:
+    """Исправляет разошедшиеся счётчики, возвращает число исправленных."""
+    fixed = {}
+    for counter in COUNTERS:
+        drifted = [
+            counter.target(pk=pk, **{counter.field: actual})
+            for pk, actual in counter.target.objects.annotate(
+                actual=get_actual_count(counter)
+            ).exclude(
+                **{counter.field: F('actual')}
+            ).values_list('pk', 'actual').iterator(chunk_size=batch_size)
+        ]
+        counter.target.objects.bulk_update(
+            drifted, [counter.field], batch_size=batch_size
+        )
+        fixed['%s.%s' % (counter.target.__name__, counter.field)] = len(
+            drifted
+        )
+    return fixed
@@ -1,23 +1,52 @@
+"""Загрузка справочников - ингредиентов и тегов - из data/.
+
+Файлы JSON и CSV читаются потоком и пишутся пачками upsert'ом по
+естественному ключу: повторная загрузка обновляет справочник, а не
+дублирует его, и таблицу не нужно очищать. На PostgreSQL с --copy
+строки идут через COPY во временную таблицу и одним INSERT ... ON
+CONFLICT переносятся в справочник.
+"""
+import csv
+import io
 import json
+import time
+from collections.abc import Iterable, Iterator
 from pathlib import PosixPath
+from typing import NamedTuple
 
 import rstr
 from django.conf import settings
-from django.core.management import BaseCommand
-from django.db import IntegrityError
+from django.core.management import BaseCommand, CommandError
+from django.db import IntegrityError, connection, models, transaction
 from transliterate import slugify
 
-from recipes.models import Ingredient, Recipe, Tag
-
-FILES_CLASSES = {
-    'ingredients': Ingredient,
-    'tags': Tag,
-    'recipes_soups': Recipe
-}
+from api.reference import INGREDIENTS, TAGS, ReferenceData
+from api.utils import batched
+from recipes.models import Ingredient, Tag
 
 PATH_FILES = settings.BASE_DIR.parent.joinpath('data')
 
 
+class Upsert(NamedTuple):
+    model: type[models.Model]
+    columns: tuple[str, ...]  # порядок столбцов в CSV
+    unique_fields: tuple[str, ...]
+    reference: ReferenceData
+
+    @property
+    def update_fields(self) -> tuple[str, ...]:
+        return tuple(
+            field for field in self.columns if field not in self.unique_fields
+        )
+
+
+UPSERTS = {
+    'ingredients': Upsert(Ingredient, ('name', 'measurement_unit'),
+                          ('name', 'measurement_unit'), INGREDIENTS),
+    'tags': Upsert(Tag, ('name', 'slug', 'color'), ('slug',), TAGS),
+}
+
+
 def open_file(file: PosixPath) -> list[dict | str]:
     try:
         if file.name.endswith('.json'):
@@ -27,24 +56,142 @@ def open_file(file: PosixPath) -> list[dict | str]:
         print('Файл %s не найден.' % file.as_posix())
 
 
-def load_json_files(files: list[PosixPath]) -> None:
-    for file in files:
-        if file.name == 'recipes.json':
-            print('Файл %s пропущен. Комманда для загрузки вручную:'
-                  ' python manage.py load_recipes' % file.name)
-            continue
-        cls = FILES_CLASSES[file.name.split('.')[0]]
-        not_loaded = 'Файл %s не загружен.' % file.name
-        loaded = 'Файл %s загружен.' % file.name
-        if cls.objects.exists():
-            print(f'В таблице {cls.__name__} уже есть данные.', not_loaded)
-            continue
-        try:
-            objects = [cls(**el) for el in open_file(file)]
-            cls.objects.bulk_create(objects)
-            print(loaded)
-        except (ValueError, IntegrityError) as exc:
-            print('Ошибка в загружаемых данных %s' % exc, not_loaded)
+def iter_json(file: PosixPath, chunk_size: int = 1 << 16) -> Iterator:
+    """Элементы JSON-массива по одному, без чтения файла целиком."""
+    decoder = json.JSONDecoder()
+    buffer, opened, eof = '', False, False
+    with file.open(encoding='utf-8') as stream:
+        while True:
+            buffer = buffer.lstrip()
+            if buffer and not opened:
+                if buffer[0] != '[':
+                    raise ValueError('%s: ожидался JSON-массив' % file.name)
+                buffer, opened = buffer[1:], True
+                continue
+            if buffer[:1] == ']':
+                return
+            if buffer[:1] == ',':
+                buffer = buffer[1:]
+                continue
+            if buffer:
+                try:
+                    item, end = decoder.raw_decode(buffer)
+                except json.JSONDecodeError:
+                    if eof:
+                        raise
+                else:
+                    # число в конце буфера может продолжиться в файле
+                    if end < len(buffer) or eof:
+                        yield item
+                        buffer = buffer[end:]
+                        continue
+            if eof:
+                raise ValueError('%s: неполный JSON-массив' % file.name)
+            chunk = stream.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+
+
+def iter_rows(file: PosixPath, upsert: Upsert) -> Iterator[tuple]:
+    """Строки файла JSON или CSV (без заголовка) в порядке upsert.columns."""
+    if file.suffix == '.json':
+        for item in iter_json(file):
+            yield tuple(item.get(field) for field in upsert.columns)
+        return
+    with file.open(encoding='utf-8', newline='') as stream:
+        for row in csv.reader(stream):
+            if any(row):
+                # пустое значение - NULL, как у COPY
+                yield tuple(value.strip() or None for value in row)
+
+
+def deduplicate(rows: Iterable[tuple], upsert: Upsert) -> list[tuple]:
+    # один ключ дважды в INSERT ... ON CONFLICT DO UPDATE - ошибка
+    positions = [upsert.columns.index(field) for field in upsert.unique_fields]
+    return list({
+        tuple(row[i] for i in positions): row for row in rows
+    }.values())
+
+
+def upsert_batches(rows: Iterable[tuple], upsert: Upsert,
+                   batch_size: int) -> int:
+    total = 0
+    for batch in batched(rows, batch_size):
+        objects = [upsert.model(**dict(zip(upsert.columns, row)))
+                   for row in deduplicate(batch, upsert)]
+        if upsert.update_fields:
+            upsert.model.objects.bulk_create(
+                objects, update_conflicts=True,
+                unique_fields=upsert.unique_fields,
+                update_fields=upsert.update_fields
+            )
+        else:
+            upsert.model.objects.bulk_create(objects, ignore_conflicts=True)
+        total += len(batch)
+    return total
+
+
+class CSVStream:
+    """Строки как CSV-файл для COPY; читаются по мере запроса."""
+
+    def __init__(self, rows: Iterable[tuple]):
+        self.rows = iter(rows)
+        self.pending = ''
+        self.output = io.StringIO()
+        self.writer = csv.writer(self.output, lineterminator='\n')
+        self.count = 0
+
+    def read(self, size: int = -1) -> str:
+        while size < 0 or len(self.pending) < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            self.output.seek(0)
+            self.output.truncate()
+            self.writer.writerow(row)
+            self.pending += self.output.getvalue()
+            self.count += 1
+        if size < 0:
+            size = len(self.pending)
+        data, self.pending = self.pending[:size], self.pending[size:]
+        return data
+
+
+def upsert_copy(rows: Iterable[tuple], upsert: Upsert) -> int:
+    """COPY во временную таблицу и INSERT ... ON CONFLICT (PostgreSQL)."""
+    quote = connection.ops.quote_name
+    columns = ', '.join(map(quote, upsert.columns))
+    unique = ', '.join(map(quote, upsert.unique_fields))
+    if upsert.update_fields:
+        action = 'UPDATE SET ' + ', '.join(
+            '%s = EXCLUDED.%s' % (quote(field), quote(field))
+            for field in upsert.update_fields
+        )
+    else:
+        action = 'NOTHING'
+    table = upsert.model._meta.db_table
+    staging = quote(table + '_staging')
+    stream = CSVStream(rows)
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(
+            'CREATE TEMPORARY TABLE %s (position bigserial, %s) '
+            'ON COMMIT DROP' % (staging, ', '.join(
+                '%s text' % quote(field) for field in upsert.columns
+            ))
+        )
+        cursor.copy_expert(
+            'COPY %s (%s) FROM STDIN WITH (FORMAT csv)' % (staging, columns),
+            stream
+        )
+        # как deduplicate: из повторов ключа берётся последняя строка
+        cursor.execute(
+            'INSERT INTO %s (%s) SELECT DISTINCT ON (%s) %s FROM %s '
+            'ORDER BY %s, position DESC ON CONFLICT (%s) DO %s' % (
+                quote(table), columns, unique, columns, staging,
+                unique, unique, action
+            )
+        )
+    return stream.count
 
 
 def save_json(data: list[dict]) -> None:
@@ -82,10 +229,61 @@ def gen_tags() -> None:
 
 
 class Command(BaseCommand):
+    help = 'Загрузка ингредиентов и тегов из JSON и CSV'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'files', nargs='*', type=PosixPath,
+            help='файлы ingredients.* и tags.* (по умолчанию все из data/)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='строк в одном INSERT')
+        parser.add_argument('--copy', action='store_true',
+                            help='COPY во временную таблицу (PostgreSQL)')
 
     def handle(self, *args, **options):
-        json_files = list(PATH_FILES.glob('*.json'))
-        load_json_files(json_files)
-        if PATH_FILES.joinpath('tags.json') not in json_files:
-            print('файл tags.json не найден')
+        if options['copy'] and connection.vendor != 'postgresql':
+            raise CommandError('--copy работает только с PostgreSQL.')
+        files = options['files'] or sorted(
+            file for suffix in ('*.json', '*.csv')
+            for file in PATH_FILES.glob(suffix)
+        )
+        for file in files:
+            self.load_file(file, options['batch_size'], options['copy'])
+        if not options['files'] and not PATH_FILES.joinpath(
+            'tags.json'
+        ).exists():
+            self.stdout.write('файл tags.json не найден')
             gen_tags()
+
+    def load_file(self, file: PosixPath, batch_size: int, copy: bool):
+        if file.name == 'recipes.json':
+            self.stdout.write('Файл %s пропущен. Команда для загрузки: '
+                              'python manage.py load_recipes' % file.name)
+            return
+        upsert = UPSERTS.get(file.name.split('.')[0])
+        if upsert is None or file.suffix not in ('.json', '.csv'):
+            raise CommandError('Неизвестный файл %s.' % file.name)
+        if not file.exists():
+            raise CommandError('Файл %s не найден.' % file.as_posix())
+
+        before = upsert.model.objects.count()
+        start = time.monotonic()
+        rows = iter_rows(file, upsert)
+        try:
+            if copy:
+                total = upsert_copy(rows, upsert)
+            else:
+                with transaction.atomic():
+                    total = upsert_batches(rows, upsert, batch_size)
+        except (ValueError, IntegrityError) as exc:
+            raise CommandError(
+                'Ошибка в данных %s: %s. Файл не загружен.' % (file.name, exc)
+            )
+        upsert.reference.invalidate()
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.stdout.write(
+            'Файл %s загружен: %s строк, добавлено %s, %.1f с, %.0f строк/с'
+            % (file.name, total, upsert.model.objects.count() - before,
+               elapsed, total / elapsed)
+        )
@@ -1,63 +1,166 @@
-import random
+"""Загрузка рецептов из data/recipes.json пачками.
+
+Файл читается потоком (iter_json). Каждая пачка - одна транзакция:
+рецепты, их ингредиенты и теги создаются bulk_create, отсутствующие
+ингредиенты - bulk_create(ignore_conflicts=True). Рецепты автора с тем
+же названием пропускаются, поэтому повторный запуск ничего не
+дублирует и продолжает прерванную загрузку с первой незагруженной пачки.
+"""
+import time
+from collections import Counter
+from pathlib import Path
 
 from django.contrib.auth import get_user_model
-from django.core.management import BaseCommand
+from django.core.management import BaseCommand, CommandError
+from django.db import transaction
 
+from api.reference import INGREDIENTS, RECIPES
+from api.utils import batched
+from recipes.counters import RECIPES_COUNTER, change_counter
 from recipes.models import Ingredient, IngredientInRecipe, Recipe, Tag
-from .load_data import PATH_FILES, open_file
+from recipes.search import update_search_documents
+from .load_data import PATH_FILES, iter_json
 
 User = get_user_model()
 
-user = User.objects.get(id=1)
-file_name = 'recipes.json'
-recipes = open_file(PATH_FILES.joinpath(file_name))
-
-
-def load_recipes():
-    if IngredientInRecipe.objects.exists():
-        print(f'В таблице {IngredientInRecipe.__name__} уже есть данные.')
-        print('Загрузка %s не выполнена' % file_name)
-        return
-
-    print('Загрузка рецептов из %s' % file_name)
-    print('%s рецептов' % len(recipes))
-    recipes_list = [
-        Recipe(
-            name=i['name'],
-            text=i['text'],
-            image='recipes/images/' + i['image'],
-            cooking_time=i['cooking_time'],
-            author=user) for i in recipes
-    ]
-    recipes_obj = Recipe.objects.bulk_create(recipes_list)
-    all_tags = Tag.objects.values_list('slug', flat=True)
-    tags_image = {i['name']: i['image'] for i in recipes}
-    for recipe in recipes_obj:
-        tags = [tag for tag in all_tags if tag in tags_image[recipe.name]]
-        if not tags:
-            tags = [random.choice(['завтрак', 'обед', 'ужин', []])]
-        tags = Tag.objects.filter(slug__in=tags)
-        recipe.tags.set(tags)
-
-    ingredients_in_recipes = []
-    for i in range(len(recipes)):
-        recipe = recipes_obj[i]
-        ingredients = recipes[i]['ingredients']
-
-        for j in ingredients:
-            ingredient, _ = Ingredient.objects.get_or_create(
-                name=j['name'], measurement_unit=j['measurement_unit']
-            )
-            ingredients_in_recipes.append(
-                IngredientInRecipe(
-                    ingredient=ingredient, recipe=recipe, amount=j['amount']
-                )
-            )
-    IngredientInRecipe.objects.bulk_create(ingredients_in_recipes)
-    print('Рецепты из %s загружены' % file_name)
+
+def get_author(username: str | None) -> User:
+    if username is None:
+        author = User.objects.filter(is_superuser=True).order_by('id').first()
+        if author is None:
+            raise CommandError('Нет суперпользователя, укажите --author.')
+        return author
+    try:
+        return User.objects.get(username=username)
+    except User.DoesNotExist:
+        raise CommandError('Пользователь %s не найден.' % username)
+
+
+def get_tag_ids(image: str, tags: dict[str, int]) -> list[int]:
+    # тег - по слагу в имени картинки: salat-s-kalmarami.jpg -> salat
+    return [pk for slug, pk in tags.items() if slug in image]
+
+
+class RecipeImporter:
+    """Пачки рецептов одного автора; справочники - в памяти."""
+
+    def __init__(self, author: User):
+        self.author = author
+        self.ingredients = {
+            (name, unit): pk for pk, name, unit in
+            Ingredient.objects.values_list('id', 'name', 'measurement_unit')
+        }
+        self.tags = dict(Tag.objects.values_list('slug', 'id'))
+        self.new_ingredients = 0
+
+    def resolve_ingredients(self, items: list[dict]) -> None:
+        missing = {
+            (ingredient['name'], ingredient['measurement_unit'])
+            for item in items for ingredient in item['ingredients']
+        } - self.ingredients.keys()
+        if not missing:
+            return
+        Ingredient.objects.bulk_create(
+            [Ingredient(name=name, measurement_unit=unit)
+             for name, unit in missing],
+            ignore_conflicts=True
+        )
+        # id новых (и созданных параллельно) ингредиентов - одним запросом
+        self.ingredients.update(
+            ((name, unit), pk) for pk, name, unit in Ingredient.objects.filter(
+                name__in={name for name, _ in missing}
+            ).values_list('id', 'name', 'measurement_unit')
+        )
+        self.new_ingredients += len(missing)
+
+    def get_amounts(self, item: dict) -> dict[int, int]:
+        # повтор ингредиента в рецепте нарушил бы ограничение
+        # уникальности: количества складываются, как в миграции 0007
+        amounts = Counter()
+        for ingredient in item['ingredients']:
+            amounts[self.ingredients[
+                ingredient['name'], ingredient['measurement_unit']
+            ]] += int(ingredient['amount'])
+        return amounts
+
+    def import_batch(self, items: list[dict]) -> tuple[int, int]:
+        """Число созданных рецептов и строк всего."""
+        existing = set(Recipe.objects.filter(
+            author=self.author, name__in=[item['name'] for item in items]
+        ).values_list('name', flat=True))
+        items = [item for item in items if item['name'] not in existing]
+        items = list({item['name']: item for item in items}.values())
+        if not items:
+            return 0, 0
+
+        self.resolve_ingredients(items)
+        recipes = Recipe.objects.bulk_create([
+            Recipe(name=item['name'], text=item['text'],
+                   image='recipes/images/' + item['image'],
+                   cooking_time=int(item['cooking_time']),
+                   author=self.author)
+            for item in items
+        ])
+        ingredients = IngredientInRecipe.objects.bulk_create([
+            IngredientInRecipe(recipe=recipe, ingredient_id=pk, amount=amount)
+            for recipe, item in zip(recipes, items)
+            for pk, amount in self.get_amounts(item).items()
+        ])
+        tags = Recipe.tags.through.objects.bulk_create([
+            Recipe.tags.through(recipe=recipe, tag_id=tag_id)
+            for recipe, item in zip(recipes, items)
+            for tag_id in get_tag_ids(item['image'], self.tags)
+        ])
+        # bulk_create не вызывает сигналы (recipes/signals.py)
+        change_counter(RECIPES_COUNTER, self.author.id, len(recipes))
+        update_search_documents([recipe.id for recipe in recipes])
+        return len(recipes), len(recipes) + len(ingredients) + len(tags)
 
 
 class Command(BaseCommand):
+    help = 'Загрузка рецептов из JSON-файла'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--file', type=Path, default=PATH_FILES / 'recipes.json',
+            help='JSON-массив рецептов (по умолчанию data/recipes.json)'
+        )
+        parser.add_argument(
+            '--author',
+            help='username автора (по умолчанию первый суперпользователь)'
+        )
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='рецептов в одной транзакции')
 
     def handle(self, *args, **options):
-        load_recipes()
+        file = options['file']
+        if not file.exists():
+            raise CommandError('Файл %s не найден.' % file.as_posix())
+        importer = RecipeImporter(get_author(options['author']))
+        created = rows = total = 0
+        start = time.monotonic()
+        for items in batched(iter_json(file), options['batch_size']):
+            with transaction.atomic():
+                batch_created, batch_rows = importer.import_batch(items)
+            created += batch_created
+            rows += batch_rows
+            total += len(items)
+            self.stdout.write('%s рецептов обработано, %s создано' % (
+                total, created
+            ))
+        if created:
+            RECIPES.bump()
+        if importer.new_ingredients:
+            INGREDIENTS.invalidate()
+
+        elapsed = max(time.monotonic() - start, 1e-6)
+        self.stdout.write(
+            'Рецепты из %s загружены: %s новых, %s пропущено, '
+            'ингредиентов добавлено %s' % (
+                file.name, created, total - created,
+                importer.new_ingredients
+            )
+        )
+        self.stdout.write('%.1f с, %.0f рецептов/с, %.0f строк/с' % (
+            elapsed, created / elapsed, rows / elapsed
+        ))
@@ -0,0 +1,11 @@
+from django.core.management import BaseCommand
+
+from recipes.counters import rebuild_counters
+
+
+class Command(BaseCommand):
+    help = 'Пересчёт счётчиков избранного, корзин, подписчиков и рецептов'
+
+    def handle(self, *args, **options):
+        for counter, fixed in rebuild_counters().items():
+            self.stdout.write('%s: исправлено %s' % (counter, fixed))
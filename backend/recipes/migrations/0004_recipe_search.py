@@ -0,0 +1,69 @@
+from django.conf import settings
+from django.db import migrations, models
+
+POSTGRESQL_SQL = (
+    'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector '
+    "GENERATED ALWAYS AS (to_tsvector('%s', search_document)) STORED"
+    % settings.SEARCH_CONFIG,
+    'CREATE INDEX recipes_recipe_search_vector_idx '
+    'ON recipes_recipe USING gin (search_vector)',
+)
+POSTGRESQL_REVERSE_SQL = (
+    'ALTER TABLE recipes_recipe DROP COLUMN search_vector',
+)
+SQLITE_SQL = (
+    'CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5('
+    "search_document, tokenize='unicode61 remove_diacritics 2')",
+    'INSERT INTO recipes_recipe_fts(rowid, search_document) '
+    'SELECT id, search_document FROM recipes_recipe',
+)
+SQLITE_REVERSE_SQL = (
+    'DROP TABLE recipes_recipe_fts',
+)
+
+
+def fill_search_document(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ingredients = {}
+    for recipe_id, name in IngredientInRecipe.objects.order_by(
+        'id'
+    ).values_list('recipe_id', 'ingredient__name'):
+        ingredients.setdefault(recipe_id, []).append(name)
+    recipes = list(Recipe.objects.only('id', 'name', 'text'))
+    for recipe in recipes:
+        recipe.search_document = '\n'.join(
+            (recipe.name, recipe.text, *ingredients.get(recipe.id, ()))
+        )
+    Recipe.objects.bulk_update(recipes, ['search_document'], batch_size=500)
+
+
+def run_sql(postgresql_sql, sqlite_sql):
+    def operation(apps, schema_editor):
+        statements = {
+            'postgresql': postgresql_sql,
+            'sqlite': sqlite_sql
+        }.get(schema_editor.connection.vendor, ())
+        for statement in statements:
+            schema_editor.execute(statement, params=None)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0003_ingredient_name_search_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_document',
+            field=models.TextField(blank=True, editable=False, verbose_name='Текст для поиска'),
+        ),
+        migrations.RunPython(fill_search_document, migrations.RunPython.noop),
+        migrations.RunPython(
+            run_sql(POSTGRESQL_SQL, SQLITE_SQL),
+            run_sql(POSTGRESQL_REVERSE_SQL, SQLITE_REVERSE_SQL)
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.2 on 2026-10-18 04:45
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+COUNTERS = (
+    ('recipes', 'FavoriteRecipe', 'recipes', 'Recipe', 'recipe',
+     'favorites_count'),
+    ('recipes', 'ShoppingCart', 'recipes', 'Recipe', 'recipe',
+     'shopping_cart_count'),
+    ('recipes', 'Subscriptions', 'users', 'User', 'author',
+     'subscribers_count'),
+    ('recipes', 'Recipe', 'users', 'User', 'author', 'recipes_count'),
+)
+
+
+def fill_counters(apps, schema_editor):
+    for (source_app, source, target_app, target,
+         foreign_key, field) in COUNTERS:
+        Source = apps.get_model(source_app, source)
+        Target = apps.get_model(target_app, target)
+        Target.objects.update(**{field: Coalesce(Subquery(
+            Source.objects.filter(**{foreign_key: OuterRef('pk')}).order_by(
+            ).values(foreign_key).annotate(count=Count('pk')).values('count')
+        ), 0)})
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0004_recipe_search'),
+        ('users', '0002_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(db_index=True, default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В корзинах'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
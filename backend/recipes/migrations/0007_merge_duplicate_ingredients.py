@@ -0,0 +1,39 @@
+from django.db import migrations
+from django.db.models import F
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    first, duplicates = {}, {}
+    for pk, *key in Ingredient.objects.order_by('id').values_list(
+        'id', 'name', 'measurement_unit'
+    ):
+        duplicates[pk] = first.setdefault(tuple(key), pk)
+    duplicates = {pk: to for pk, to in duplicates.items() if pk != to}
+    for item in IngredientInRecipe.objects.filter(
+        ingredient_id__in=duplicates
+    ):
+        to = duplicates[item.ingredient_id]
+        # количество повтора прибавляется к оставшейся строке рецепта
+        if IngredientInRecipe.objects.filter(
+            recipe_id=item.recipe_id, ingredient_id=to
+        ).update(amount=F('amount') + item.amount):
+            item.delete()
+        else:
+            item.ingredient_id = to
+            item.save(update_fields=['ingredient'])
+    Ingredient.objects.filter(id__in=duplicates).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_recipe_updated'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,17 @@
+from django.db import migrations, models
+
+
+# отдельно от 0007: в PostgreSQL ALTER TABLE в одной транзакции
+# с изменением строк под FK падает с pending trigger events
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_merge_duplicate_ingredients'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredient',
+            constraint=models.UniqueConstraint(fields=('name', 'measurement_unit'), name='unique_ingredient'),
+        ),
+    ]
@@ -1,11 +1,15 @@
+from collections.abc import Iterable
+from functools import partial
 from typing import Any
 
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.files.storage import Storage
 from django.core.validators import validate_slug
-from django.db import models
+from django.db import models, transaction
 from django.utils.translation import gettext_lazy as _
 
+from users.models import CountersMixin
 from .validators import (validate_cooking_time_min, validate_hex_color,
                          validate_ingredient_amount_min,)
 
@@ -21,6 +25,11 @@ def get_constrains(fields: list, cls_name: str) -> list[Any]:
     ]
 
 
+def delete_files(storage: Storage, names: Iterable[str]) -> None:
+    for name in names:
+        storage.delete(name)
+
+
 class Base(models.Model):
     def __str__(self):
         field_1, field_2 = self._meta.fields[1:3]
@@ -94,11 +103,28 @@ class Ingredient(Base):
     )
 
     class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['name', 'measurement_unit'],
+                name='unique_ingredient'
+            )
+        ]
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
 
 
-class Recipe(Base):
+class Recipe(CountersMixin, Base):
+    IMAGE_PENDING = 'pending'
+    IMAGE_RUNNING = 'running'
+    IMAGE_DONE = 'done'
+    IMAGE_FAILED = 'failed'
+    IMAGE_STATUSES = (
+        (IMAGE_PENDING, 'В очереди'),
+        (IMAGE_RUNNING, 'Выполняется'),
+        (IMAGE_DONE, 'Готово'),
+        (IMAGE_FAILED, 'Ошибка'),
+    )
+
     name = models.CharField(
         'Название',
         max_length=settings.RECIPE_NAME_MAX_LENGTH
@@ -129,12 +155,79 @@ class Recipe(Base):
         auto_now_add=True,
         db_index=True
     )
+    updated = models.DateTimeField('Дата изменения', auto_now=True)
+    search_document = models.TextField(
+        'Текст для поиска',
+        blank=True,
+        editable=False
+    )
+    favorites_count = models.PositiveIntegerField(
+        'В избранном', default=0, editable=False, db_index=True
+    )
+    shopping_cart_count = models.PositiveIntegerField(
+        'В корзинах', default=0, editable=False
+    )
+    image_variants = models.JSONField(
+        'Варианты картинки', default=dict, blank=True, editable=False
+    )
+    image_status = models.CharField(
+        'Обработка картинки',
+        max_length=max(len(status) for status, _ in IMAGE_STATUSES),
+        choices=IMAGE_STATUSES,
+        default=IMAGE_PENDING,
+        editable=False,
+        db_index=True
+    )
+    image_claimed = models.DateTimeField(
+        'Картинка взята в обработку', null=True, editable=False
+    )
+    counter_fields = ('favorites_count', 'shopping_cart_count')
+    # пишет фоновый обработчик (api/images.py), save() - только при
+    # замене картинки
+    image_fields = ('image_variants', 'image_status', 'image_claimed')
+    # имя картинки, прочитанное из БД; None - не загружалась
+    _loaded_image: str | None = None
 
     class Meta:
         ordering = ['-created']
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        if 'image' in instance.__dict__:
+            instance._loaded_image = instance.image.name
+        return instance
+
+    def image_changed(self) -> bool:
+        return (self._loaded_image is not None
+                and self.image.name != self._loaded_image)
+
+    def get_protected_fields(self) -> set[str]:
+        fields = super().get_protected_fields()
+        if self.image_changed():
+            return fields
+        return fields | set(self.image_fields)
+
+    def save(self, *args, **kwargs):
+        if self.image_changed():
+            # варианты старой картинки удаляются только после коммита,
+            # новая картинка - снова в очередь
+            transaction.on_commit(partial(
+                delete_files, self.image.storage,
+                list(self.image_variants.values())
+            ))
+            self.image_variants = {}
+            self.image_status = self.IMAGE_PENDING
+            self.image_claimed = None
+            if kwargs.get('update_fields') is not None:
+                kwargs['update_fields'] = {*kwargs['update_fields'],
+                                           *self.image_fields}
+        super().save(*args, **kwargs)
+        if 'image' in self.__dict__:
+            self._loaded_image = self.image.name
+
 
 class IngredientInRecipe(Base, RecipeMixin):
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE)
@@ -177,3 +270,39 @@ class Subscriptions(Base, UserMixin):
         constraints = get_constrains(['user', 'author'], 'subscriptions')
         verbose_name = 'Подписка на автора'
         verbose_name_plural = 'Подписки на авторов'
+
+
+class ShoppingListExport(Base, UserMixin):
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (PENDING, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    )
+
+    status = models.CharField(
+        'Статус',
+        max_length=max(len(status) for status, _ in STATUSES),
+        choices=STATUSES,
+        default=PENDING,
+        db_index=True
+    )
+    progress = models.PositiveSmallIntegerField('Прогресс, %', default=0)
+    host = models.CharField('Хост', max_length=255, blank=True)
+    file = models.FileField(
+        'Файл',
+        upload_to='shopping_lists/',
+        blank=True
+    )
+    error = models.TextField('Ошибка', blank=True)
+    created = models.DateTimeField('Создан', auto_now_add=True)
+    updated = models.DateTimeField('Обновлён', auto_now=True)
+
+    class Meta:
+        ordering = ['-created']
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списка покупок'
@@ -0,0 +1,95 @@
+"""Полнотекстовый поиск рецептов по названию, описанию и ингредиентам.
+
+Recipe.search_document хранит склеенный текст рецепта. По нему
+PostgreSQL считает сохраняемый столбец search_vector с GIN-индексом,
+а на SQLite документ копируется в таблицу FTS5 recipes_recipe_fts
+(см. migrations/0004). Триггеры SQLite не используются: Django удаляет
+их, когда пересоздаёт таблицу рецептов в миграциях.
+"""
+import re
+from collections.abc import Iterable
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import BooleanField, FloatField, QuerySet
+from django.db.models.expressions import RawSQL
+
+from .models import IngredientInRecipe, Recipe
+
+WORD_RE = re.compile(r'\w+')
+
+
+def build_search_document(name: str, text: str,
+                          ingredients: Iterable[str]) -> str:
+    return '\n'.join((name, text, *ingredients))
+
+
+def update_search_documents(recipe_ids: Iterable[int]) -> None:
+    recipes = {
+        recipe.id: recipe
+        for recipe in Recipe.objects.filter(id__in=recipe_ids).only(
+            'id', 'name', 'text', 'search_document'
+        )
+    }
+    ingredients = {recipe_id: [] for recipe_id in recipes}
+    for recipe_id, name in IngredientInRecipe.objects.filter(
+        recipe_id__in=recipes
+    ).order_by('id').values_list('recipe_id', 'ingredient__name'):
+        ingredients[recipe_id].append(name)
+
+    changed = []
+    for recipe in recipes.values():
+        document = build_search_document(
+            recipe.name, recipe.text, ingredients[recipe.id]
+        )
+        if recipe.search_document != document:
+            recipe.search_document = document
+            changed.append(recipe)
+    Recipe.objects.bulk_update(changed, ['search_document'])
+    if connection.vendor == 'sqlite':
+        delete_fts5_documents([recipe.id for recipe in changed])
+        with connection.cursor() as cursor:
+            cursor.executemany(
+                'INSERT INTO recipes_recipe_fts(rowid, search_document) '
+                'VALUES (%s, %s)',
+                [(recipe.id, recipe.search_document) for recipe in changed]
+            )
+
+
+def delete_fts5_documents(recipe_ids: list[int]) -> None:
+    with connection.cursor() as cursor:
+        cursor.executemany(
+            'DELETE FROM recipes_recipe_fts WHERE rowid = %s',
+            [(recipe_id,) for recipe_id in recipe_ids]
+        )
+
+
+def to_fts5_query(value: str) -> str:
+    """Слова запроса как префиксы: "борщ"* "свекл"*."""
+    return ' '.join('"%s"*' % word for word in WORD_RE.findall(value))
+
+
+def search_recipes(queryset: QuerySet, value: str) -> QuerySet:
+    """Рецепты по запросу value, от более релевантных к менее."""
+    if connection.vendor == 'postgresql':
+        query = "websearch_to_tsquery('%s', %%s)" % settings.SEARCH_CONFIG
+        matched_sql = 'recipes_recipe.search_vector @@ ' + query
+        rank_sql = 'ts_rank(recipes_recipe.search_vector, %s)' % query
+    else:
+        value = to_fts5_query(value)
+        if not value:
+            return queryset.none()
+        fts = ('SELECT {} FROM recipes_recipe_fts '
+               'WHERE recipes_recipe_fts MATCH %s')
+        matched_sql = 'recipes_recipe.id IN (%s)' % fts.format('rowid')
+        # bm25 тем меньше, чем релевантнее
+        rank_sql = '-(%s AND rowid = recipes_recipe.id)' % fts.format(
+            'bm25(recipes_recipe_fts)'
+        )
+    return queryset.annotate(
+        search_matched=RawSQL(matched_sql, (value,),
+                              output_field=BooleanField()),
+        search_rank=RawSQL(rank_sql, (value,), output_field=FloatField())
+    ).filter(search_matched=True).order_by(
+        '-search_rank', *Recipe._meta.ordering
+    )
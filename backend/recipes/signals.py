@@ -0,0 +1,101 @@
+import threading
+from collections.abc import Callable, Iterable
+from functools import partial
+
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .counters import COUNTERS, Counter, change_counter
+from .models import Ingredient, IngredientInRecipe, Recipe, delete_files
+from .search import delete_fts5_documents, update_search_documents
+
+User = get_user_model()
+
+
+def on_commit_batch(func: Callable[[set], None]) -> Callable[..., None]:
+    """Копит id до конца транзакции и передаёт их в func одним вызовом."""
+    local = threading.local()
+
+    def flush():
+        ids, local.ids = getattr(local, 'ids', set()), set()
+        if ids:
+            func(ids)
+
+    def schedule(ids: Iterable[int]):
+        if not getattr(local, 'ids', None):
+            local.ids = set()
+        local.ids.update(ids)
+        transaction.on_commit(flush)
+    return schedule
+
+
+schedule_search_update = on_commit_batch(update_search_documents)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_saved(sender, instance: Recipe, update_fields=None, **kwargs):
+    if update_fields is None or {'name', 'text'} & set(update_fields):
+        schedule_search_update([instance.id])
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_deleted(sender, instance: Recipe, **kwargs):
+    if connection.vendor == 'sqlite':
+        delete_fts5_documents([instance.id])
+    transaction.on_commit(partial(
+        delete_files, instance.image.storage,
+        list(instance.image_variants.values())
+    ))
+
+
+@receiver([post_save, post_delete], sender=IngredientInRecipe)
+def ingredient_in_recipe_changed(sender, instance: IngredientInRecipe,
+                                 **kwargs):
+    if not isinstance(kwargs.get('origin'), Recipe):
+        # строка изменена без сохранения рецепта (админка, ORM):
+        # новый updated - новый ключ кеша представлений и ETag
+        Recipe.objects.filter(pk=instance.recipe_id).update(
+            updated=timezone.now()
+        )
+        schedule_search_update([instance.recipe_id])
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance: Ingredient, created, **kwargs):
+    if not created:
+        schedule_search_update(IngredientInRecipe.objects.filter(
+            ingredient=instance
+        ).values_list('recipe_id', flat=True))
+
+
+@receiver(post_save, sender=User)
+def author_saved(sender, instance, created, update_fields=None, **kwargs):
+    # автор входит в представление рецепта; вход меняет только last_login
+    if created or set(update_fields or ()) == {'last_login'}:
+        return
+    Recipe.objects.filter(author=instance).update(updated=timezone.now())
+
+
+def connect_counter(counter: Counter) -> None:
+    def saved(sender, instance, created, **kwargs):
+        if created:
+            change_counter(
+                counter, getattr(instance, counter.foreign_key + '_id'), 1
+            )
+
+    def deleted(sender, instance, origin=None, **kwargs):
+        pk = getattr(instance, counter.foreign_key + '_id')
+        # строка удаляется вместе с объектом, чей счётчик она меняет
+        if isinstance(origin, counter.target) and origin.pk == pk:
+            return
+        change_counter(counter, pk, -1)
+
+    post_save.connect(saved, sender=counter.source, weak=False)
+    post_delete.connect(deleted, sender=counter.source, weak=False)
+
+
+for counter in COUNTERS:
+    connect_counter(counter)
@@ -5,6 +5,8 @@ from .models import User
 
 class PostAdmin(admin.ModelAdmin):
     list_filter = ('email', 'username')
+    list_display = ('username', 'email', 'recipes_count', 'subscribers_count')
+    readonly_fields = ('recipes_count', 'subscribers_count')
 
 
 admin.site.register(User, PostAdmin)
@@ -4,6 +4,48 @@ from django.db import models
 from django.utils.translation import gettext_lazy as _
 
 
+class ProtectedFieldsMixin(models.Model):
+    """Поля, которые меняются в обход save().
+
+    Обычный save() не перезаписывает их значениями, прочитанными
+    из БД до изменения.
+    """
+
+    class Meta:
+        abstract = True
+
+    def get_protected_fields(self) -> set[str]:
+        return set()
+
+    def save(self, *args, **kwargs):
+        # копия (pk=None) и force_insert - INSERT всех полей
+        if (kwargs.get('update_fields') is None
+                and not kwargs.get('force_insert')
+                and not self._state.adding and self.pk is not None):
+            protected = self.get_protected_fields()
+            # отложенные поля (only/defer) не читаются из БД ради UPDATE;
+            # auto_now получают значение в pre_save и пишутся всегда
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name not in protected
+                and (field.attname not in deferred
+                     or getattr(field, 'auto_now', False))
+            ]
+        super().save(*args, **kwargs)
+
+
+class CountersMixin(ProtectedFieldsMixin):
+    """Счётчики меняются только F()-выражениями (recipes/counters.py)."""
+    counter_fields: tuple[str, ...] = ()
+
+    class Meta:
+        abstract = True
+
+    def get_protected_fields(self) -> set[str]:
+        return super().get_protected_fields() | set(self.counter_fields)
+
+
 class UserManager(BaseUserManager):
     use_in_migrations = True
 
@@ -51,7 +93,7 @@ class UserManager(BaseUserManager):
                                  first_name, last_name, **extra_fields)
 
 
-class User(AbstractUser):
+class User(CountersMixin, AbstractUser):
     first_name = models.CharField(
         _("first name"),
         max_length=settings.USER_FIRST_NAME_MAX_LENGTH
@@ -73,6 +115,13 @@ class User(AbstractUser):
                 'Пользователь с таким адресом электронной почты уже существует'
         },
     )
+    recipes_count = models.PositiveIntegerField(
+        'Число рецептов', default=0, editable=False
+    )
+    subscribers_count = models.PositiveIntegerField(
+        'Число подписчиков', default=0, editable=False
+    )
+    counter_fields = ('recipes_count', 'subscribers_count')
 
     USERNAME_FIELD = "email"
     REQUIRED_FIELDS = ["username"]